@@ -0,0 +1,903 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks hors ligne du serveur, résultats en JSON
+
+Usage:
+    python benchmark.py downscale [--megapixels 16,64] [--factors 2,4,8] [--output res.json]
+    python benchmark.py expiry [--counts 1000,10000,50000] [--backend memory|disk]
+    python benchmark.py downloads [--clients 2000] [--worker-classes gevent,sync] [--workers 2]
+    python benchmark.py compress [--megapixels 1,16,64,500] [--formats PNG,JPEG,WEBP]
+    python benchmark.py roundtrip [--sizes 1K,1M,64M,1G] [--backend memory|disk]
+    python benchmark.py cleanup [--counts 1000,10000,100000,1000000]
+    python benchmark.py startup [--counts 10000,100000] [--indexes sqlite,json]
+    python benchmark.py e2e [--modes client,gunicorn] [--requests 200] [--payload 64K]
+    python benchmark.py suite [--profile quick|full]
+
+Comparaison avec une exécution précédente (code de sortie 1 si régression):
+    python benchmark.py --output new.json --baseline old.json [--tolerance 0.15] suite
+"""
+
+import argparse
+import asyncio
+import hashlib
+import http.server
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops, ImageStat
+
+
+def make_image(megapixels, fmt, path):
+    """Image synthétique (dégradés + bruit) proche d'une photo pour les encodeurs"""
+    side = int(math.sqrt(megapixels * 1_000_000))
+    base = Image.linear_gradient('L').resize((side, side))
+    noise = Image.effect_noise((side, side), 48)
+    radial = Image.radial_gradient('L').resize((side, side))
+    img = Image.merge('RGB', (base, noise, radial))
+    if fmt in ('JPEG', 'WEBP'):
+        img.save(path, fmt, quality=95)
+    else:
+        img.save(path, fmt, compress_level=1)
+    return side
+
+
+def _import_server(storage_dir):
+    # Le serveur lit sa configuration à l'import: stockage isolé et logs coupés
+    os.environ['STORAGE_DIR'] = storage_dir
+    os.environ.setdefault('STORAGE_BACKEND', 'memory')
+    os.environ.setdefault('LOG_LEVEL', 'OFF')
+    # Mesure du débit brut: pas de limites par clé API
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+    os.environ.setdefault('MAX_CONCURRENT_UPLOADS', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+    return server
+
+
+def _run_in_child(target, args):
+    """Exécute un cas dans un process neuf pour mesurer son pic de RSS isolément"""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child_main, args=(queue, target, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _child_main(queue, target, args):
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        result = target(*args)
+    except Exception as e:
+        result = {'error': str(e)}
+    result['peak_rss_mb'] = peak_rss_mb()
+    queue.put(result)
+
+
+def peak_rss_mb():
+    # VmHWM repart de zéro à l'exec, contrairement à ru_maxrss hérité du parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _downscale_case(path, max_dimension, fast, storage_dir, output_path):
+    server = _import_server(storage_dir)
+    with open(path, 'rb') as f:
+        start = time.perf_counter()
+        content, was_compressed, _ = server.compress_image(
+            f, os.path.basename(path), max_dimension=max_dimension, fast_downscale=fast
+        )
+        elapsed = time.perf_counter() - start
+    if was_compressed:
+        with open(output_path, 'wb') as out:
+            out.write(content)
+    return {'seconds': round(elapsed, 3), 'compressed': was_compressed}
+
+
+def psnr(path_a, path_b):
+    """PSNR (dB) entre deux images de même taille"""
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        a, b = a.convert('RGB'), b.convert('RGB')
+        if a.size != b.size:
+            b = b.resize(a.size, Image.Resampling.LANCZOS)
+        stat = ImageStat.Stat(ImageChops.difference(a, b))
+        mse = sum(rms ** 2 for rms in stat.rms) / len(stat.rms)
+    return round(10 * math.log10(255 ** 2 / mse), 2) if mse else float('inf')
+
+
+def bench_downscale(megapixels, factors, formats):
+    """Réduction classique (LANCZOS plein format) vs rapide (draft + reducing_gap)"""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mp in megapixels:
+            for fmt in formats:
+                source = os.path.join(workdir, f"src_{mp}mp.{fmt.lower()}")
+                side = make_image(mp, fmt, source)
+                for factor in factors:
+                    max_dimension = side // factor
+                    case = {'format': fmt, 'megapixels': mp, 'factor': factor, 'max_dimension': max_dimension}
+                    outputs = {}
+                    for mode, fast in (('classic', False), ('fast', True)):
+                        outputs[mode] = os.path.join(workdir, f"out_{mode}.{fmt.lower()}")
+                        case[mode] = _run_in_child(
+                            _downscale_case, (source, max_dimension, fast, workdir, outputs[mode])
+                        )
+                    if case['classic'].get('compressed') and case['fast'].get('compressed'):
+                        case['speedup'] = round(case['classic']['seconds'] / max(case['fast']['seconds'], 1e-6), 2)
+                        case['psnr_fast_vs_classic_db'] = psnr(outputs['classic'], outputs['fast'])
+                    print(json.dumps(case), file=sys.stderr)
+                    results.append(case)
+    return results
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'max_ms': round(samples[-1] * 1000, 3)}
+
+
+def _expiry_case(count, backend, requests_per_route, expiring, storage_dir):
+    os.environ['STORAGE_BACKEND'] = backend
+    os.environ['REAPER_MAX_SLEEP'] = '1'
+    server = _import_server(storage_dir)
+    from datetime import datetime, timedelta
+    import io as _io
+
+    start = time.perf_counter()
+    ids = [server.store_file(b'bench', f"f{i}.txt").rsplit('/', 1)[1] for i in range(count)]
+    populate = time.perf_counter() - start
+
+    # Coût d'un parcours complet, payé par chaque requête avant l'index d'expiration
+    start = time.perf_counter()
+    now = datetime.now()
+    sum(1 for _, data in server.TEMP_STORAGE.items() if now > data['expiry'])
+    full_scan = time.perf_counter() - start
+
+    client = server.app.test_client()
+    headers = {'X-API-Key': server.PRIMARY_API_KEY}
+    latencies = {'download': [], 'upload': [], 'home': []}
+    for i in range(requests_per_route):
+        start = time.perf_counter()
+        client.get(f"/download/{ids[i % count]}").close()
+        latencies['download'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.post('/upload', headers=headers, content_type='multipart/form-data',
+                    data={'file': (_io.BytesIO(b'upload %d' % i), 'u.txt')})
+        latencies['upload'].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.get('/')
+        latencies['home'].append(time.perf_counter() - start)
+
+    # Retard d'éviction: des fichiers échus pendant que le thread de nettoyage tourne
+    deadline = datetime.now() + timedelta(seconds=0.5)
+    for file_id in ids[:expiring]:
+        data = server.TEMP_STORAGE[file_id]
+        data['expiry'] = deadline
+        server.TEMP_STORAGE[file_id] = data
+        server.EXPIRY_INDEX.schedule(file_id, deadline)
+    timeout = time.monotonic() + 30
+    while server.EXPIRY_INDEX.metrics()['evicted'] < expiring and time.monotonic() < timeout:
+        time.sleep(0.05)
+    metrics = server.EXPIRY_INDEX.metrics()
+
+    return {
+        'populate_seconds': round(populate, 3),
+        'full_scan_ms': round(full_scan * 1000, 3),
+        'latency': {route: _percentiles(samples) for route, samples in latencies.items()},
+        'evicted': metrics['evicted'],
+        'avg_eviction_lag_seconds': metrics['avg_eviction_lag_seconds'],
+        'max_eviction_lag_seconds': metrics['max_eviction_lag_seconds']
+    }
+
+
+def bench_expiry(counts, backend, requests_per_route, expiring):
+    """Latence des routes selon le nombre de fichiers stockés, et retard d'éviction"""
+    results = []
+    for count in counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            case = {'files': count, 'backend': backend}
+            case.update(_run_in_child(_expiry_case, (count, backend, requests_per_route, min(expiring, count), workdir)))
+        print(json.dumps(case), file=sys.stderr)
+        results.append(case)
+    return results
+
+
+def _process_tree_rss_mb(root_pid):
+    """RSS cumulée (MB) d'un process et de ses descendants"""
+    total_kb, pending = 0, [root_pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            continue
+    return round(total_kb / 1024, 1)
+
+
+def _start_gunicorn(worker_class, workers, connections, port, storage_dir):
+    env = dict(os.environ, PORT=str(port), WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers),
+               WORKER_CONNECTIONS=str(connections), STORAGE_DIR=storage_dir, STORAGE_BACKEND='disk',
+               RATE_LIMIT_PER_MINUTE='0', MAX_CONCURRENT_UPLOADS='0')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'server:app', '--config', 'gunicorn.conf.py'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn n'a pas démarré")
+
+
+def _upload_blob(port, size_mb):
+    boundary = 'benchboundary'
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.bin\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + os.urandom(size_mb * 1024 * 1024) + \
+        f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/upload", data=body, method='POST',
+        headers={'Content-Type': f"multipart/form-data; boundary={boundary}",
+                 'X-API-Key': os.environ.get('PRIMARY_API_KEY', 'pk_live_mega_converter_primary_key_2024_super_secure_token_xyz789')}
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())['file_id']
+
+
+async def _slow_client(port, file_id, read_rate, duration, stats):
+    """Client qui lit le téléchargement à read_rate octets/s pendant duration secondes"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+    sock.setblocking(False)
+    start = time.monotonic()
+    received = 0
+    try:
+        await loop.sock_connect(sock, ('127.0.0.1', port))
+        await loop.sock_sendall(sock, f"GET /download/{file_id} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        slice_bytes = max(1024, read_rate // 10)
+        while time.monotonic() - start < duration:
+            try:
+                data = await asyncio.wait_for(loop.sock_recv(sock, slice_bytes), timeout=max(0.01, duration - (time.monotonic() - start)))
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            if not received:
+                stats['ttfb'].append(time.monotonic() - start)
+            received += len(data)
+            await asyncio.sleep(len(data) / read_rate)
+    except OSError:
+        stats['errors'] += 1
+    finally:
+        sock.close()
+        stats['bytes'] += received
+
+
+async def _run_slow_clients(port, file_id, clients, read_rate, duration, server_pid):
+    stats = {'ttfb': [], 'bytes': 0, 'errors': 0}
+    rss = []
+
+    async def sample_rss():
+        while True:
+            rss.append(_process_tree_rss_mb(server_pid))
+            await asyncio.sleep(1)
+
+    sampler = asyncio.create_task(sample_rss())
+    tasks = []
+    for _ in range(clients):
+        tasks.append(asyncio.create_task(_slow_client(port, file_id, read_rate, duration, stats)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    sampler.cancel()
+    return stats, rss
+
+
+def _downloads_case(worker_class, workers, clients, file_mb, read_rate, duration, port):
+    with tempfile.TemporaryDirectory() as storage_dir:
+        server = _start_gunicorn(worker_class, workers, clients + 100, port, storage_dir)
+        try:
+            file_id = _upload_blob(port, file_mb)
+            idle_rss = _process_tree_rss_mb(server.pid)
+            stats, rss = asyncio.run(_run_slow_clients(port, file_id, clients, read_rate, duration, server.pid))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    served = len(stats['ttfb'])
+    case = {
+        'worker_class': worker_class,
+        'workers': workers,
+        'clients': clients,
+        'served_within_duration': served,
+        'errors': stats['errors'],
+        'throughput_mb_s': round(stats['bytes'] / duration / (1024 * 1024), 2),
+        'server_rss_idle_mb': idle_rss,
+        'server_rss_min_mb': min(rss) if rss else None,
+        'server_rss_max_mb': max(rss) if rss else None
+    }
+    if served:
+        case['ttfb'] = _percentiles(stats['ttfb'])
+    return case
+
+
+def bench_downloads(worker_classes, workers, clients, file_mb, read_rate_kb, duration, port):
+    """Milliers de clients lents sur /download: workers gevent vs sync"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    results = []
+    for worker_class in worker_classes:
+        case = _downloads_case(worker_class, workers, clients, file_mb, read_rate_kb * 1024, duration, port)
+        print(json.dumps(case), file=sys.stderr)
+        results.append(case)
+    return results
+
+
+WEBP_MAX_SIDE = 16383
+
+
+def _compress_case(path, storage_dir):
+    server = _import_server(storage_dir)
+    input_size = os.path.getsize(path)
+    timings = {}
+    with open(path, 'rb') as f:
+        start = time.perf_counter()
+        content, was_compressed, output_format = server.compress_image(
+            f, os.path.basename(path), max_dimension=server.COMPRESS_MAX_DIMENSION, timings=timings
+        )
+        elapsed = time.perf_counter() - start
+    case = {'seconds': round(elapsed, 3), 'compressed': was_compressed, 'output_format': output_format,
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}}
+    if was_compressed:
+        case['output_ratio'] = round(len(content) / input_size, 3)
+    return case
+
+
+def bench_compress(megapixels, formats):
+    """compress_image sur un corpus synthétique PNG/JPEG/WebP (réglages du serveur)"""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for mp in megapixels:
+            for fmt in formats:
+                case = {'format': fmt, 'megapixels': mp}
+                source = os.path.join(workdir, f"src_{mp}mp.{fmt.lower()}")
+                if fmt == 'WEBP' and math.sqrt(mp * 1_000_000) > WEBP_MAX_SIDE:
+                    case['skipped'] = f"WebP limité à {WEBP_MAX_SIDE}px de côté"
+                else:
+                    make_image(mp, fmt, source)
+                    case['input_mb'] = round(os.path.getsize(source) / (1024 * 1024), 2)
+                    case.update(_run_in_child(_compress_case, (source, workdir)))
+                    os.unlink(source)
+                print(json.dumps(case), file=sys.stderr)
+                results.append(case)
+    return results
+
+
+def _roundtrip_case(size, backend, storage_dir):
+    os.environ['STORAGE_BACKEND'] = backend
+    server = _import_server(storage_dir)
+    content = os.urandom(size)
+    digest = hashlib.sha256(content).hexdigest()
+
+    start = time.perf_counter()
+    file_id = server.store_file(content, 'roundtrip.bin').rsplit('/', 1)[1]
+    stored = time.perf_counter() - start
+    del content
+
+    client = server.app.test_client()
+    hasher = hashlib.sha256()
+    start = time.perf_counter()
+    response = client.get(f"/download/{file_id}", buffered=False)
+    for chunk in response.response:
+        hasher.update(chunk)
+    response.close()
+    downloaded = time.perf_counter() - start
+
+    megabytes = size / (1024 * 1024)
+    return {
+        'store_seconds': round(stored, 4),
+        'download_seconds': round(downloaded, 4),
+        'store_mb_s': round(megabytes / max(stored, 1e-9), 1),
+        'download_mb_s': round(megabytes / max(downloaded, 1e-9), 1),
+        'intact': hasher.hexdigest() == digest
+    }
+
+
+def bench_roundtrip(sizes, backend):
+    """store_file puis /download (client de test Flask, corps lu en flux)"""
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            case = {'size_bytes': size, 'backend': backend}
+            case.update(_run_in_child(_roundtrip_case, (size, backend, workdir)))
+        print(json.dumps(case), file=sys.stderr)
+        results.append(case)
+    return results
+
+
+def _cleanup_case(count, backend, expired_fraction, repeats, storage_dir):
+    os.environ['STORAGE_BACKEND'] = backend
+    server = _import_server(storage_dir)
+    from datetime import datetime, timedelta
+
+    start = time.perf_counter()
+    ids = [server.store_file(b'%d' % i, f"f{i}.txt").rsplit('/', 1)[1] for i in range(count)]
+    populate = time.perf_counter() - start
+
+    # Rien d'échu: coût payé à chaque passage du thread de nettoyage
+    idle = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        server.cleanup_old_files()
+        idle.append(time.perf_counter() - start)
+
+    expired = int(count * expired_fraction)
+    past = datetime.now() - timedelta(seconds=1)
+    for file_id in ids[:expired]:
+        data = server.TEMP_STORAGE[file_id]
+        data['expiry'] = past
+        server.TEMP_STORAGE[file_id] = data
+        server.EXPIRY_INDEX.schedule(file_id, past)
+    start = time.perf_counter()
+    server.cleanup_old_files()
+    reap = time.perf_counter() - start
+
+    return {
+        'populate_seconds': round(populate, 3),
+        'idle': _percentiles(idle),
+        'expired': expired,
+        'reap_seconds': round(reap, 4),
+        'reap_us_per_file': round(reap / expired * 1e6, 1) if expired else None,
+        'remaining': len(server.TEMP_STORAGE)
+    }
+
+
+def bench_cleanup(counts, backend, expired_fraction, repeats):
+    """cleanup_old_files selon le nombre d'entrées: passage à vide et suppression d'un lot échu"""
+    results = []
+    for count in counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            case = {'files': count, 'backend': backend, 'expired_fraction': expired_fraction}
+            case.update(_run_in_child(_cleanup_case, (count, backend, expired_fraction, repeats, workdir)))
+        print(json.dumps(case), file=sys.stderr)
+        results.append(case)
+    return results
+
+
+def _startup_populate(count, index, storage_dir):
+    os.environ['STORAGE_BACKEND'] = 'disk'
+    os.environ['METADATA_INDEX'] = index
+    server = _import_server(storage_dir)
+    from datetime import datetime, timedelta
+
+    # Identifiants uuid4 et dates mélangées, comme en production: ni l'ordre des
+    # clés ni celui du parcours ne suivent la création (insertions au milieu du listing)
+    rng = random.Random(count)
+    offsets = list(range(count))
+    rng.shuffle(offsets)
+    file_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(count)]
+    blob = server.STORAGE.put(b'bench')
+    now = datetime.now()
+    start = time.perf_counter()
+    for i, file_id in enumerate(file_ids):
+        server.TEMP_STORAGE[file_id] = {
+            'blob': blob, 'sha256': blob, 'filename': f"f{i}.txt", 'original_filename': f"f{i}.txt",
+            'content_type': 'text/plain', 'created': now - timedelta(seconds=offsets[i] + 1),
+            'expiry': now + timedelta(hours=1), 'size': 5, 'owner': 'primary', 'was_compressed': False
+        }
+    return {'populate_seconds': round(time.perf_counter() - start, 3), 'lookup_id': file_ids[count // 2]}
+
+
+def _startup_case(lookup_id, index, storage_dir):
+    os.environ['STORAGE_BACKEND'] = 'disk'
+    os.environ['METADATA_INDEX'] = index
+    start = time.perf_counter()
+    server = _import_server(storage_dir)
+    ready = time.perf_counter() - start
+
+    client = server.app.test_client()
+    start = time.perf_counter()
+    client.get(f"/info/{lookup_id}")
+    first_lookup = time.perf_counter() - start
+
+    # Relecture complète faite au démarrage par le thread de nettoyage
+    start = time.perf_counter()
+    server.EXPIRY_INDEX.rescan()
+    rescan = time.perf_counter() - start
+    return {
+        'ready_seconds': round(ready, 3),
+        'first_lookup_ms': round(first_lookup * 1000, 3),
+        'rescan_seconds': round(rescan, 3),
+        'scheduled': server.EXPIRY_INDEX.metrics()['scheduled']
+    }
+
+
+def bench_startup(counts, indexes):
+    """Redémarrage sur un index existant: import du serveur, première lecture, relecture complète"""
+    results = []
+    for count in counts:
+        for index in indexes:
+            with tempfile.TemporaryDirectory() as workdir:
+                case = {'files': count, 'backend': index}
+                populated = _run_in_child(_startup_populate, (count, index, workdir))
+                lookup_id = populated.pop('lookup_id')
+                case.update(populated)
+                case.update(_run_in_child(_startup_case, (lookup_id, index, workdir)))
+            print(json.dumps(case), file=sys.stderr)
+            results.append(case)
+    return results
+
+
+class _OriginHandler(http.server.BaseHTTPRequestHandler):
+    """Origine locale pour /upload-from-url: GET /blob/<taille>/<n>.bin"""
+    protocol_version = 'HTTP/1.1'
+    payloads = {}
+
+    def do_GET(self):
+        try:
+            _, _, size, name = self.path.split('/', 3)
+            size = int(size)
+        except ValueError:
+            self.send_error(404)
+            return
+        payload = self.payloads.get(size)
+        if payload is None:
+            payload = self.payloads[size] = os.urandom(size)
+        # Préfixe propre à chaque URL: pas de déduplication entre requêtes
+        body = name.encode()[:16].ljust(16, b'_') + payload[16:]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_origin():
+    """Serveur HTTP local (thread) jouant l'origine distante: (serveur, URL de base)"""
+    os.environ['NO_PROXY'] = '127.0.0.1,localhost'
+    origin = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _OriginHandler)
+    origin.daemon_threads = True
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    return origin, f"http://127.0.0.1:{origin.server_address[1]}"
+
+
+def _e2e_summary(latencies, elapsed, errors):
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        'requests': total,
+        'errors': errors,
+        'requests_per_second': round(total / max(elapsed, 1e-9), 1),
+        'latency': {route: _percentiles(samples) for route, samples in latencies.items() if samples}
+    }
+
+
+def _e2e_client_case(requests_count, payload_size, backend, origin_url, storage_dir):
+    os.environ['STORAGE_BACKEND'] = backend
+    server = _import_server(storage_dir)
+    import io as _io
+    client = server.app.test_client()
+    headers = {'X-API-Key': server.PRIMARY_API_KEY}
+    payload = os.urandom(payload_size)
+    latencies = {'upload': [], 'download': [], 'upload_from_url': []}
+    errors = 0
+    started = time.perf_counter()
+    for i in range(requests_count):
+        start = time.perf_counter()
+        response = client.post('/upload', headers=headers, content_type='multipart/form-data',
+                               data={'file': (_io.BytesIO(b'%016d' % i + payload[16:]), 'bench.bin')})
+        latencies['upload'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+            continue
+        start = time.perf_counter()
+        response = client.get(f"/download/{response.json['file_id']}")
+        response.data
+        latencies['download'].append(time.perf_counter() - start)
+        errors += response.status_code != 200
+        start = time.perf_counter()
+        response = client.post('/upload-from-url', headers=headers,
+                               json={'url': f"{origin_url}/blob/{payload_size}/{i}.bin"})
+        latencies['upload_from_url'].append(time.perf_counter() - start)
+        errors += response.status_code != 200
+    return _e2e_summary(latencies, time.perf_counter() - started, errors)
+
+
+def _e2e_gunicorn_case(requests_count, payload_size, concurrency, worker_class, workers, origin_url, port):
+    import requests
+    api_key = os.environ.get('PRIMARY_API_KEY', 'pk_live_mega_converter_primary_key_2024_super_secure_token_xyz789')
+    base = f"http://127.0.0.1:{port}"
+    payload = os.urandom(payload_size)
+    latencies = {'upload': [], 'download': [], 'upload_from_url': []}
+    errors = []
+    sessions = threading.local()
+
+    def one(i):
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+            session.trust_env = False
+        headers = {'X-API-Key': api_key}
+        start = time.perf_counter()
+        response = session.post(f"{base}/upload", headers=headers,
+                                files={'file': ('bench.bin', b'%016d' % i + payload[16:])})
+        latencies['upload'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+            return
+        start = time.perf_counter()
+        response = session.get(f"{base}/download/{response.json()['file_id']}")
+        latencies['download'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+        start = time.perf_counter()
+        response = session.post(f"{base}/upload-from-url", headers=headers,
+                                json={'url': f"{origin_url}/blob/{payload_size}/{i}.bin"})
+        latencies['upload_from_url'].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        server = _start_gunicorn(worker_class, workers, max(100, concurrency * 2), port, storage_dir)
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(one, range(requests_count)))
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    return _e2e_summary(latencies, elapsed, len(errors))
+
+
+def bench_e2e(modes, requests_count, payload_size, backend, concurrency, worker_class, workers, port):
+    """Débit de bout en bout (upload, download, upload-from-url) avec origine HTTP locale"""
+    origin, origin_url = start_origin()
+    results = []
+    try:
+        for mode in modes:
+            case = {'mode': mode, 'payload_bytes': payload_size}
+            if mode == 'client':
+                case['backend'] = backend
+                with tempfile.TemporaryDirectory() as workdir:
+                    case.update(_run_in_child(_e2e_client_case, (requests_count, payload_size, backend, origin_url, workdir)))
+            else:
+                case.update({'worker_class': worker_class, 'workers': workers, 'concurrency': concurrency})
+                case.update(_e2e_gunicorn_case(requests_count, payload_size, concurrency, worker_class, workers, origin_url, port))
+            print(json.dumps(case), file=sys.stderr)
+            results.append(case)
+    finally:
+        origin.shutdown()
+    return results
+
+
+SUITE_PROFILES = {
+    'quick': {
+        'compress': {'megapixels': [1, 16], 'formats': ['PNG', 'JPEG', 'WEBP']},
+        'roundtrip': {'sizes': [1024, 1024 ** 2, 64 * 1024 ** 2], 'backends': ['memory', 'disk']},
+        'cleanup': {'counts': [1000, 10000, 100000]},
+        'e2e': {'requests': 200}
+    },
+    'full': {
+        'compress': {'megapixels': [1, 16, 64, 150, 500], 'formats': ['PNG', 'JPEG', 'WEBP']},
+        'roundtrip': {'sizes': [1024, 1024 ** 2, 64 * 1024 ** 2, 1024 ** 3], 'backends': ['memory', 'disk']},
+        'cleanup': {'counts': [1000, 10000, 100000, 1000000]},
+        'e2e': {'requests': 2000}
+    }
+}
+
+
+def bench_suite(profile, port):
+    """Toutes les mesures de référence, pour comparer deux versions du serveur"""
+    settings = SUITE_PROFILES[profile]
+    roundtrip = []
+    for backend in settings['roundtrip']['backends']:
+        roundtrip.extend(bench_roundtrip(settings['roundtrip']['sizes'], backend))
+    return {
+        'compress': bench_compress(settings['compress']['megapixels'], settings['compress']['formats']),
+        'roundtrip': roundtrip,
+        'cleanup': bench_cleanup(settings['cleanup']['counts'], 'memory', 0.01, 50),
+        'e2e': bench_e2e(['client', 'gunicorn'], settings['e2e']['requests'], 64 * 1024, 'memory', 8, 'sync', 2, port)
+    }
+
+
+# Paramètres d'un cas (clé de rapprochement avec la référence), le reste est mesuré
+CASE_KEYS = ('format', 'megapixels', 'factor', 'max_dimension', 'files', 'backend', 'expired_fraction',
+             'size_bytes', 'worker_class', 'workers', 'clients', 'concurrency', 'mode', 'payload_bytes')
+LOWER_IS_BETTER = ('seconds', '_ms', 'rss', 'lag', 'us_per_file')
+HIGHER_IS_BETTER = ('_mb_s', 'per_second', 'speedup', 'psnr')
+
+
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def _case_key(case):
+    return tuple((key, case[key]) for key in CASE_KEYS if key in case)
+
+
+def compare_results(current, baseline, tolerance):
+    """Écarts relatifs aux cas de même paramètres; régression au-delà de tolerance"""
+    previous = {_case_key(case): dict(_flatten(case)) for case in baseline}
+    regressions, changes = [], []
+    for case in current:
+        key = _case_key(case)
+        if key not in previous:
+            continue
+        for metric, value in _flatten(case):
+            old = previous[key].get(metric)
+            if metric in CASE_KEYS or not old:
+                continue
+            ratio = value / old
+            if any(marker in metric for marker in LOWER_IS_BETTER):
+                worse = ratio > 1 + tolerance
+            elif any(marker in metric for marker in HIGHER_IS_BETTER):
+                worse = ratio < 1 - tolerance
+            else:
+                continue
+            change = {'case': dict(key), 'metric': metric, 'baseline': old, 'current': value, 'ratio': round(ratio, 3)}
+            changes.append(change)
+            if worse:
+                regressions.append(change)
+    return {'compared': len(changes), 'regressions': regressions}
+
+
+def compare_reports(report, baseline, tolerance):
+    if report['benchmark'] != baseline.get('benchmark'):
+        raise SystemExit(f"Référence d'un autre benchmark: {baseline.get('benchmark')}")
+    if isinstance(report['results'], dict):
+        sections = {name: compare_results(results, baseline['results'].get(name, []), tolerance)
+                    for name, results in report['results'].items()}
+        return {'tolerance': tolerance, 'sections': sections,
+                'regressions': sum(len(section['regressions']) for section in sections.values())}
+    comparison = compare_results(report['results'], baseline['results'], tolerance)
+    return {'tolerance': tolerance, 'sections': {report['benchmark']: comparison},
+            'regressions': len(comparison['regressions'])}
+
+
+def _size_list(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    sizes = []
+    for item in value.split(','):
+        item = item.strip().upper()
+        if item:
+            sizes.append(int(item[:-1]) * units[item[-1]] if item[-1] in units else int(item))
+    return sizes
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help="Fichier JSON de sortie (stdout par défaut)")
+    parser.add_argument('--baseline', help="Rapport JSON de référence à comparer")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Écart relatif toléré avant régression")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    downscale = sub.add_parser('downscale', help="compress_image: réduction classique vs rapide")
+    downscale.add_argument('--megapixels', type=_int_list, default=[16, 64])
+    downscale.add_argument('--factors', type=_int_list, default=[2, 4, 8])
+    downscale.add_argument('--formats', default='JPEG,PNG')
+
+    expiry = sub.add_parser('expiry', help="Latence des routes et retard d'éviction selon le nombre de fichiers")
+    expiry.add_argument('--counts', type=_int_list, default=[1000, 10000, 50000])
+    expiry.add_argument('--backend', choices=['memory', 'disk'], default='memory')
+    expiry.add_argument('--requests', type=int, default=200, help="Requêtes mesurées par route")
+    expiry.add_argument('--expiring', type=int, default=500, help="Fichiers échus pour mesurer le retard d'éviction")
+
+    downloads = sub.add_parser('downloads', help="Clients lents simultanés sur /download via gunicorn")
+    downloads.add_argument('--clients', type=int, default=2000)
+    downloads.add_argument('--worker-classes', default='gevent,sync')
+    downloads.add_argument('--workers', type=int, default=2)
+    downloads.add_argument('--file-mb', type=int, default=32)
+    downloads.add_argument('--read-rate-kb', type=int, default=32, help="Débit de lecture de chaque client (KB/s)")
+    downloads.add_argument('--duration', type=float, default=20)
+    downloads.add_argument('--port', type=int, default=18090)
+
+    compress = sub.add_parser('compress', help="compress_image sur des images PNG/JPEG/WebP de 1 à 500 MP")
+    compress.add_argument('--megapixels', type=_int_list, default=[1, 16, 64])
+    compress.add_argument('--formats', default='PNG,JPEG,WEBP')
+
+    roundtrip = sub.add_parser('roundtrip', help="store_file puis /download de 1 KB à 1 GB")
+    roundtrip.add_argument('--sizes', type=_size_list, default=_size_list('1K,1M,64M,256M'))
+    roundtrip.add_argument('--backend', choices=['memory', 'disk'], default='memory')
+
+    cleanup = sub.add_parser('cleanup', help="cleanup_old_files de 10^3 à 10^6 entrées")
+    cleanup.add_argument('--counts', type=_int_list, default=[1000, 10000, 100000])
+    cleanup.add_argument('--backend', choices=['memory', 'disk'], default='memory')
+    cleanup.add_argument('--expired-fraction', type=float, default=0.01)
+    cleanup.add_argument('--repeats', type=int, default=50, help="Passages à vide mesurés")
+
+    startup = sub.add_parser('startup', help="Redémarrage avec 10^4 à 10^5 entrées dans l'index disque")
+    startup.add_argument('--counts', type=_int_list, default=[10000, 100000])
+    startup.add_argument('--indexes', default='sqlite,json')
+
+    e2e = sub.add_parser('e2e', help="Débit de bout en bout: client de test Flask et gunicorn local")
+    e2e.add_argument('--modes', default='client,gunicorn')
+    e2e.add_argument('--requests', type=int, default=200, help="Itérations upload + download + upload-from-url")
+    e2e.add_argument('--payload', type=lambda v: _size_list(v)[0], default=64 * 1024)
+    e2e.add_argument('--backend', choices=['memory', 'disk'], default='memory', help="Backend du mode client")
+    e2e.add_argument('--concurrency', type=int, default=8, help="Clients simultanés du mode gunicorn")
+    e2e.add_argument('--worker-class', default='sync')
+    e2e.add_argument('--workers', type=int, default=2)
+    e2e.add_argument('--port', type=int, default=18091)
+
+    suite = sub.add_parser('suite', help="Toutes les mesures de référence")
+    suite.add_argument('--profile', choices=sorted(SUITE_PROFILES), default='quick')
+    suite.add_argument('--port', type=int, default=18091)
+
+    args = parser.parse_args()
+    if args.command == 'downscale':
+        results = bench_downscale(args.megapixels, args.factors, args.formats.split(','))
+    elif args.command == 'expiry':
+        results = bench_expiry(args.counts, args.backend, args.requests, args.expiring)
+    elif args.command == 'downloads':
+        results = bench_downloads(args.worker_classes.split(','), args.workers, args.clients,
+                                  args.file_mb, args.read_rate_kb, args.duration, args.port)
+    elif args.command == 'compress':
+        results = bench_compress(args.megapixels, args.formats.upper().split(','))
+    elif args.command == 'roundtrip':
+        results = bench_roundtrip(args.sizes, args.backend)
+    elif args.command == 'cleanup':
+        results = bench_cleanup(args.counts, args.backend, args.expired_fraction, args.repeats)
+    elif args.command == 'startup':
+        results = bench_startup(args.counts, args.indexes.split(','))
+    elif args.command == 'e2e':
+        results = bench_e2e(args.modes.split(','), args.requests, args.payload, args.backend,
+                            args.concurrency, args.worker_class, args.workers, args.port)
+    elif args.command == 'suite':
+        results = bench_suite(args.profile, args.port)
+
+    report = {'benchmark': args.command, 'python': sys.version.split()[0],
+              'pillow': Image.__version__, 'cpus': os.cpu_count(), 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare_reports(report, json.load(f), args.tolerance)
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload)
+    else:
+        print(payload)
+    if report.get('comparison', {}).get('regressions'):
+        print(f"{report['comparison']['regressions']} régression(s) au-delà de {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Configuration gunicorn utilisée par le Procfile
+
+WORKER_CLASS=sync (défaut): un worker par requête en cours.
+WORKER_CLASS=gevent: chaque connexion est une greenlet, les téléchargements
+(sendfile) et les requêtes sortantes (requests) ne bloquent plus le worker;
+quelques process servent des milliers de clients lents.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 2000))  # clients simultanés par worker gevent
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
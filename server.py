@@ -1,20 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, Response, send_file
+from flask import Flask, request, jsonify, Response, send_file, has_request_context, g
 from flask_cors import CORS
 import os
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import io
-import base64
+import json
+import hashlib
+import threading
+import heapq
+import time
+import fcntl
+from collections import OrderedDict, Counter
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from functools import wraps
 import mimetypes
 import unicodedata
 import re
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageSequence, UnidentifiedImageError
+from werkzeug.wsgi import wrap_file
+from werkzeug.http import parse_range_header, quote_etag, http_date
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Epilogue, Field, File, Data
 import tempfile
+import shutil
+import subprocess
+import zipfile
+import sqlite3
+import zlib
+import gzip
+import math
+import sys
+import atexit
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from bisect import bisect_left, bisect_right, insort
 
 app = Flask(__name__)
 CORS(app)
@@ -23,17 +51,179 @@ CORS(app)
 PRIMARY_API_KEY = os.environ.get('PRIMARY_API_KEY', 'pk_live_mega_converter_primary_key_2024_super_secure_token_xyz789')
 SECONDARY_API_KEY = os.environ.get('SECONDARY_API_KEY', 'sk_live_mega_converter_secondary_key_2024_ultra_secure_token_abc456')
 
+# Clés supplémentaires: API_KEYS="nom:clé,nom:clé" et/ou fichier JSON API_KEYS_FILE, relu s'il change:
+# {"nom": {"key": "..." ou "sha256": "...", "quota_mb": 1024, "rate_per_minute": 600, "burst": 60, "max_concurrent_uploads": 8}}
+API_KEYS_FILE = os.environ.get('API_KEYS_FILE')
+API_KEYS_RELOAD_SECONDS = 5
+# Limites par clé et par worker (0 = illimité)
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 600))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 60))
+MAX_CONCURRENT_UPLOADS = int(os.environ.get('MAX_CONCURRENT_UPLOADS', 8))
+
 # NOUVELLES LIMITES PLUS GRANDES
 MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE', 500 * 1024 * 1024))  # 500MB par défaut
 MAX_IMAGE_SIZE = int(os.environ.get('MAX_IMAGE_SIZE', 1000 * 1024 * 1024))  # 1GB pour images
 AUTO_COMPRESS_IMAGES = os.environ.get('AUTO_COMPRESS_IMAGES', 'true').lower() == 'true'
 MAX_IMAGE_DIMENSION = int(os.environ.get('MAX_IMAGE_DIMENSION', 80000))  # 80000px max par côté
+# Plus grand côté après compression auto: au-delà, l'image est réduite (décodage JPEG partiel,
+# reduce()). 8192px garde la qualité d'impression et reste sous la limite WebP (16383px)
+COMPRESS_MAX_DIMENSION = int(os.environ.get('COMPRESS_MAX_DIMENSION', 8192))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 500_000_000))  # 500MP max avant décodage
+FAST_DOWNSCALE = os.environ.get('FAST_DOWNSCALE', 'true').lower() == 'true'
+DOWNSCALE_REDUCING_GAP = float(os.environ.get('DOWNSCALE_REDUCING_GAP', 2.0))
+# Format de sortie: auto, original, jpeg, webp, webp_lossless, png, avif
+COMPRESS_TARGET_FORMAT = os.environ.get('COMPRESS_TARGET_FORMAT', 'auto').lower()
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+TRIAL_ENCODE = os.environ.get('TRIAL_ENCODE', 'true').lower() == 'true'
+TRIAL_ENCODE_SIDE = 512  # côté max de la miniature d'essai
+# Détection du contenu: signature et en-tête lus avant tout décodage
+SNIFF_SIZE = 8 * 1024
+COMPRESS_MIN_DIMENSION = int(os.environ.get('COMPRESS_MIN_DIMENSION', 128))  # plus grand côté sous lequel on ne compresse pas
+SKIP_JPEG_QUALITY = int(os.environ.get('SKIP_JPEG_QUALITY', 85))  # JPEG déjà à cette qualité ou moins: gardé tel quel
+
+# Réception en streaming: taille des morceaux lus sur le socket
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB
+MAX_FORM_MEMORY_SIZE = 1024 * 1024  # champs texte du formulaire
+MULTIPART_OVERHEAD = 64 * 1024  # en-têtes et boundaries autour du fichier
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # lecture des plages Range
+
+# Uploads fractionnés et reprenables (/uploads)
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # 8MB par défaut
+CHUNKED_UPLOAD_MIN_CHUNK = 256 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK = int(os.environ.get('CHUNKED_UPLOAD_MAX_CHUNK', 64 * 1024 * 1024))
+UPLOAD_SESSION_HOURS = int(os.environ.get('UPLOAD_SESSION_HOURS', 24))  # abandon d'une session inachevée
+UPLOAD_SESSION_SWEEP_SECONDS = 300
+
+# Récupération d'URLs: pool de connexions partagé
+FETCH_POOL_SIZE = int(os.environ.get('FETCH_POOL_SIZE', 20))  # connexions keep-alive par hôte
+FETCH_PER_HOST_LIMIT = int(os.environ.get('FETCH_PER_HOST_LIMIT', 8))  # requêtes simultanées par hôte
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 10))
+FETCH_READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', 60))
+FETCH_BATCH_WORKERS = int(os.environ.get('FETCH_BATCH_WORKERS', 8))
+FETCH_BATCH_MAX_URLS = int(os.environ.get('FETCH_BATCH_MAX_URLS', 100))
+
+# Compression hors requête (ProcessPoolExecutor)
+ASYNC_COMPRESSION = os.environ.get('ASYNC_COMPRESSION', 'true').lower() == 'true'
+COMPRESS_WORKERS = int(os.environ.get('COMPRESS_WORKERS', os.cpu_count() or 2))
+COMPRESS_QUEUE_SIZE = int(os.environ.get('COMPRESS_QUEUE_SIZE', 16))  # jobs en attente ou en cours
+
+# Conversion PDF (fusion d'images, rasterisation des pages)
+PDF_DPI = int(os.environ.get('PDF_DPI', 150))  # résolution par défaut des pages rendues
+PDF_MAX_DPI = int(os.environ.get('PDF_MAX_DPI', 600))
+MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES', 500))
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 2))
+PDF_PAGES_IN_FLIGHT = int(os.environ.get('PDF_PAGES_IN_FLIGHT', 2 * (os.cpu_count() or 2)))  # pages rendues non encore stockées
 
 FILE_EXPIRY_HOURS = int(os.environ.get('FILE_EXPIRY_HOURS', 24))
+REAPER_MAX_SLEEP = float(os.environ.get('REAPER_MAX_SLEEP', 60))  # réveil max du thread de nettoyage (s)
+EXPIRY_RESCAN_SECONDS = float(os.environ.get('EXPIRY_RESCAN_SECONDS', 600))  # relecture de l'index disque
+
+# Budget global (éviction LRU) et quotas par clé API, en MB (0 = illimité)
+STORAGE_BUDGET_MB = int(os.environ.get('STORAGE_BUDGET_MB', 5120))
+PRIMARY_QUOTA_MB = int(os.environ.get('PRIMARY_QUOTA_MB', 4096))
+SECONDARY_QUOTA_MB = int(os.environ.get('SECONDARY_QUOTA_MB', 1024))
+API_KEY_QUOTA_MB = int(os.environ.get('API_KEY_QUOTA_MB', SECONDARY_QUOTA_MB))  # autres clés
 BASE_URL = os.environ.get('BASE_URL', 'https://pdf-converter-server-production.up.railway.app')
 
-# Stockage temporaire en mémoire
-TEMP_STORAGE = {}
+# Lots: /upload-batch (fichiers traités en parallèle) et /bundle (archive ZIP en flux)
+UPLOAD_BATCH_MAX_FILES = int(os.environ.get('UPLOAD_BATCH_MAX_FILES', 100))
+UPLOAD_BATCH_MAX_SIZE = int(os.environ.get('UPLOAD_BATCH_MAX_SIZE', 2048 * 1024 * 1024))  # 2GB par requête
+UPLOAD_BATCH_WORKERS = int(os.environ.get('UPLOAD_BATCH_WORKERS', COMPRESS_WORKERS))
+BUNDLE_MAX_FILES = int(os.environ.get('BUNDLE_MAX_FILES', 200))
+BUNDLE_COMPRESS_LEVEL = int(os.environ.get('BUNDLE_COMPRESS_LEVEL', 6))
+# Déjà compressés: stockés sans DEFLATE dans les archives
+ALREADY_COMPRESSED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic',
+    'mp4', 'mov', 'avi', 'mkv', 'webm', 'mp3', 'aac', 'ogg', 'm4a',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', 'zst', '7z', 'rar',
+    'pdf', 'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp'
+}
+
+# Compression au repos des fichiers compressibles (texte, CSV, JSON...). gzip par défaut:
+# accepté par quasiment tous les clients (requests, axios, curl --compressed), donc servi
+# sans décompression; zstd (module zstandard) compresse mieux mais se décode souvent côté serveur
+AT_REST_COMPRESSION = os.environ.get('AT_REST_COMPRESSION', 'true').lower() == 'true'
+AT_REST_CODEC = os.environ.get('AT_REST_CODEC', 'gzip').lower()  # gzip, zstd
+AT_REST_MIN_SIZE = int(os.environ.get('AT_REST_MIN_SIZE', 1024))
+AT_REST_MAX_ENTROPY = 7.5  # bits par octet au-delà desquels l'échantillon est jugé incompressible
+AT_REST_SAMPLE_SIZE = 64 * 1024
+AT_REST_MIN_GAIN = 0.1  # gain minimal pour garder la version compressée
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+COMPRESSIBLE_EXTENSIONS = {
+    'txt', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'md', 'svg',
+    'tex', 'rtf', 'css', 'js', 'log', 'yaml', 'yml'
+}
+COMPRESSIBLE_TYPES = {'application/json', 'application/xml', 'application/javascript', 'image/svg+xml'}
+
+# Listing paginé (/files, /status)
+FILES_PAGE_SIZE = 50
+FILES_PAGE_MAX = 500
+
+# Variantes transformées à la volée par /download (width/height/fit/format/quality)
+VARIANT_CACHE_MB = int(os.environ.get('VARIANT_CACHE_MB', 256))  # 0 = illimité
+VARIANT_MAX_DIMENSION = int(os.environ.get('VARIANT_MAX_DIMENSION', 8192))
+VARIANT_FITS = ('contain', 'cover', 'fill')
+VARIANT_FORMATS = {'original': 'original', 'auto': 'auto', 'jpeg': 'jpeg', 'jpg': 'jpeg',
+                   'webp': 'webp', 'png': 'png', 'avif': 'avif'}
+
+# Journalisation: LOG_LEVEL=DEBUG|INFO|WARNING|ERROR|OFF, LOG_FORMAT=text|json
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_QUEUE_SIZE = 10000  # au-delà, les lignes sont abandonnées plutôt que de bloquer une requête
+METRICS_FLUSH_SECONDS = 10  # dépôt des métriques du worker pour /metrics
+
+# Backend de stockage: 'disk' (partagé entre workers gunicorn) ou 'memory'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'disk').lower()
+STORAGE_DIR = os.environ.get('STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'pdf-converter-storage'))
+# Index des métadonnées du backend disque: 'sqlite' (index.db en mode WAL) ou 'json' (un fichier par entrée)
+METADATA_INDEX = os.environ.get('METADATA_INDEX', 'sqlite').lower()
+SQLITE_BUSY_TIMEOUT = 10  # attente max (s) d'un verrou d'écriture tenu par un autre worker
+
+# Le garde-fou de compress_image remplace la limite par défaut de PIL (~179MP)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# AVIF: natif selon le build de Pillow, ou via le plugin optionnel pillow-avif-plugin
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+Image.init()
+AVIF_SUPPORTED = 'AVIF' in Image.SAVE
+
+# zstd: module optionnel zstandard, gzip (zlib) sinon
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+if AT_REST_CODEC != 'zstd' or zstandard is None:
+    AT_REST_CODEC = 'gzip'
+
+# Mode gevent (gunicorn -k gevent): sockets coopératifs, calculs longs sur des threads natifs
+try:
+    import gevent
+    from gevent import monkey
+    GEVENT_MODE = monkey.is_module_patched('socket')
+except ImportError:
+    GEVENT_MODE = False
+
+# Rendu des pages PDF: pypdfium2, PyMuPDF ou pdftoppm (poppler), selon ce qui est installé
+try:
+    import pypdfium2 as pdfium
+    PDF_RASTER_BACKEND = 'pdfium'
+except ImportError:
+    try:
+        import fitz
+        PDF_RASTER_BACKEND = 'pymupdf'
+    except ImportError:
+        PDF_RASTER_BACKEND = 'pdftoppm' if shutil.which('pdftoppm') else None
+
+OUTPUT_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'WEBP': ('webp', 'image/webp'),
+    'AVIF': ('avif', 'image/avif')
+}
 
 # Tous les formats acceptés
 ALLOWED_EXTENSIONS = {
@@ -55,157 +245,3523 @@ ALLOWED_EXTENSIONS = {
     'exe', 'dmg', 'apk', 'deb', 'rpm'
 }
 
-IMAGE_FORMATS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'tif'}
+IMAGE_FORMATS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'tif'}
+
+# ===== JOURNALISATION ET MÉTRIQUES =====
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+class Metrics:
+    """Compteurs et histogrammes du process, exposés au format texte Prometheus
+    
+    Avec le backend disque, chaque worker dépose un instantané dans
+    STORAGE_DIR/metrics; /metrics additionne ceux des workers vivants.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+        self._values = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._families[name] = (kind, help_text, tuple(buckets) if buckets else None)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Comptes par bucket (non cumulés), puis somme et nombre d'observations
+                series = self._values[key] = [0] * len(buckets) + [0.0, 0]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, [list(pair) for pair in labels], value if not isinstance(value, list) else list(value)]
+                    for (name, labels), value in self._values.items()]
+
+    def flush(self, directory):
+        """Dépose l'instantané du process pour les autres workers"""
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+
+    def collect(self, directory=None):
+        """Instantané du process, additionné à ceux des autres workers vivants"""
+        snapshots = [self.snapshot()]
+        if directory and os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if not entry.name.endswith('.json'):
+                    continue
+                pid = int(entry.name[:-5])
+                if pid == os.getpid():
+                    continue
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    os.unlink(entry.path)  # worker arrêté
+                    continue
+                except PermissionError:
+                    pass
+                try:
+                    with open(entry.path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if isinstance(value, list):
+                    current = merged.setdefault(key, [0] * len(value))
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, directory=None, gauges=()):
+        """Texte d'exposition Prometheus; gauges: [(nom, aide, [(labels, valeur)])]"""
+        merged = self.collect(directory)
+        lines = []
+        for name, (kind, help_text, buckets) in self._families.items():
+            series = sorted((labels, value) for (family, labels), value in merged.items() if family == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(buckets, value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+METRICS.describe('http_request_duration_seconds', 'histogram', "Durée de traitement des requêtes par route", LATENCY_BUCKETS)
+METRICS.describe('http_request_bytes_total', 'counter', "Octets reçus (corps des requêtes) par route")
+METRICS.describe('http_response_bytes_total', 'counter', "Octets envoyés (corps de longueur connue) par route")
+METRICS.describe('stage_duration_seconds', 'histogram', "Durée des étapes internes (réception, compression, stockage, fetch)", LATENCY_BUCKETS)
+METRICS.describe('upload_bytes_total', 'counter', "Octets reçus dans le stockage par source")
+METRICS.describe('compression_ratio', 'histogram', "Taille compressée / taille originale", RATIO_BUCKETS)
+METRICS.describe('compression_bytes_saved_total', 'counter', "Octets économisés par la compression")
+METRICS.describe('at_rest_bytes_saved_total', 'counter', "Octets économisés par la compression au repos (zstd/gzip)")
+METRICS.describe('compression_skipped_total', 'counter', "Compressions évitées d'après l'en-tête de l'image, par motif")
+METRICS.describe('compression_jobs_total', 'counter', "Jobs de compression terminés par résultat")
+METRICS.describe('expired_files_total', 'counter', "Fichiers supprimés à expiration")
+METRICS.describe('eviction_lag_seconds', 'histogram', "Retard entre l'échéance et la suppression", LATENCY_BUCKETS)
+METRICS.describe('auth_failures_total', 'counter', "Requêtes refusées pour clé API invalide ou manquante")
+METRICS.describe('rate_limited_total', 'counter', "Requêtes refusées (429) par clé et motif (débit, uploads simultanés)")
+METRICS.describe('budget_evictions_total', 'counter', "Fichiers évincés par le budget de stockage (LRU)")
+METRICS.describe('budget_evicted_bytes_total', 'counter', "Octets évincés par le budget de stockage (LRU)")
+METRICS.describe('variant_requests_total', 'counter', "Demandes de variantes par résultat (hits, misses, coalesced)")
+METRICS.describe('log_records_dropped_total', 'counter', "Lignes de log abandonnées (file pleine)")
+
+@contextmanager
+def timed(stage, timings=None):
+    """Mesure une étape: cumulée dans timings (dict) si fourni, sinon dans les métriques"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+        else:
+            METRICS.observe('stage_duration_seconds', elapsed, stage=stage)
+
+def timed_stage(stage):
+    """Décorateur: durée de la fonction dans stage_duration_seconds"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_timings(timings):
+    """Reporte des durées mesurées ailleurs (process de compression, thread natif)"""
+    for stage, elapsed in (timings or {}).items():
+        METRICS.observe('stage_duration_seconds', elapsed, stage=stage)
+
+LOG_TAG_RE = re.compile(r'^\[([A-Z_]+)\]\s*')
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Dépose les enregistrements dans une file, écrits par le thread du listener
+    
+    Si la file est pleine, l'enregistrement est abandonné et compté.
+    """
+
+    def prepare(self, record):
+        # Message figé ici (les arguments peuvent changer), mise en forme dans le listener
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICS.inc('log_records_dropped_total')
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{record.levelname} {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par événement: ts, level, tag ([UPLOAD] -> upload), msg et champs"""
+
+    def format(self, record):
+        message = record.getMessage()
+        match = LOG_TAG_RE.match(message)
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'tag': match.group(1).lower() if match else None,
+            'msg': message[match.end():] if match else message,
+            'pid': record.process
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def setup_logging():
+    logger = logging.getLogger('pdf_converter')
+    logger.propagate = False
+    if LOG_LEVEL == 'OFF':
+        logger.disabled = True
+        return logger
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(NonBlockingQueueHandler(records))
+    return logger
+
+log = setup_logging()
+
+# ===== STOCKAGE =====
+
+FILE_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+class BlobWriter:
+    """Écrit un blob par morceaux: taille et SHA-256 calculés à la volée"""
+
+    def __init__(self, fileobj, install, discard):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.key = None
+        self.existed = False  # True si le même contenu était déjà stocké
+        self._install = install
+        self._discard = discard
+
+    def write(self, chunk):
+        self.fileobj.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Installe le blob et prend une référence, retourne sa clé"""
+        self.key = self.hasher.hexdigest()
+        self.existed = self._install(self)
+        return self.key
+
+    def abort(self):
+        self._discard(self)
+
+def file_counters(data, sign=1):
+    """Contribution d'une entrée de l'index aux compteurs agrégés (usage du stockage)"""
+    content_type = (data.get('content_type') or 'application/octet-stream').split(';')[0].strip().lower()
+    counters = {'files': sign, 'file_bytes': sign * data['size'], f"type:{content_type}": sign * data['size'],
+                'file_stored_bytes': sign * data.get('stored_size', data['size'])}
+    if data.get('was_compressed'):
+        info = data.get('compression_info') or {}
+        original = info.get('original_size_bytes', round(info.get('original_size_mb', 0) * 1024 * 1024))
+        counters['compressed_files'] = sign
+        counters['bytes_saved'] = sign * max(0, original - data['size'])
+    if data.get('encoding'):
+        counters['encoded_files'] = sign
+        counters['encoded_bytes_saved'] = sign * max(0, data['size'] - data.get('stored_size', data['size']))
+    return counters
+
+def merge_counters(*parts):
+    merged = {}
+    for part in parts:
+        for name, delta in part.items():
+            merged[name] = merged.get(name, 0) + delta
+    return merged
+
+class MemoryStorage:
+    """Blobs bruts en mémoire, adressés par SHA-256 (un seul process)"""
+    name = 'memory'
+
+    def __init__(self):
+        self.index = {}
+        # Empreinte d'un contenu reçu -> blob retenu (éventuellement compressé)
+        self.sources = {}
+        # Renvoi inverse: blob retenu -> {'sources': [empreintes]}, nettoyé avec le blob
+        self.blob_sources = {}
+        self.jobs = {}
+        # Uploads fractionnés: sessions et morceaux reçus ("<upload_id>_<n>")
+        self.upload_sessions = {}
+        self.upload_chunks = {}
+        # Variantes transformées: "<blob>_<transformation>" -> blob de la variante
+        self.variants = {}
+        self.tmp_dir = None
+        self._blobs = {}
+        self._refs = {}
+        self._usage = {'stored_bytes': 0, 'blobs': 0, 'files': 0, 'file_bytes': 0, 'file_stored_bytes': 0, 'chunk_bytes': 0,
+                       'reserved_bytes': 0}
+        self._lock = threading.Lock()
+
+    def put(self, content):
+        """Stocke le contenu et prend une référence sur le blob"""
+        key = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if key not in self._blobs:
+                self._blobs[key] = bytes(content)
+                self._usage['stored_bytes'] += len(content)
+                self._usage['blobs'] += 1
+            self._refs[key] = self._refs.get(key, 0) + 1
+        return key
+
+    def put_file(self, path):
+        """Stocke un fichier temporaire puis le supprime: (clé, taille)"""
+        with open(path, 'rb') as f:
+            content = f.read()
+        os.unlink(path)
+        return self.put(content), len(content)
+
+    def writer(self):
+        return BlobWriter(io.BytesIO(), self._install_writer, lambda writer: writer.fileobj.close())
+
+    def _install_writer(self, writer):
+        content = writer.fileobj.getvalue()
+        writer.fileobj.close()
+        with self._lock:
+            existed = writer.key in self._blobs
+            if not existed:
+                self._blobs[writer.key] = content
+                self._usage['stored_bytes'] += len(content)
+                self._usage['blobs'] += 1
+            self._refs[writer.key] = self._refs.get(writer.key, 0) + 1
+        return existed
+
+    def acquire(self, key):
+        """Prend une référence sur un blob existant (False s'il a disparu)"""
+        with self._lock:
+            if key not in self._blobs:
+                return False
+            self._refs[key] = self._refs.get(key, 0) + 1
+            return True
+
+    def release(self, key):
+        """Libère une référence, supprime le blob à zéro"""
+        with self._lock:
+            refs = self._refs.get(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+            else:
+                self._refs.pop(key, None)
+                content = self._blobs.pop(key, None)
+                if content is not None:
+                    self._usage['stored_bytes'] -= len(content)
+                    self._usage['blobs'] -= 1
+                self._forget_sources(key)
+
+    def _forget_sources(self, key):
+        # Entrée sans renvoi (version précédente): seul le blob non transformé, de même empreinte
+        for source_hash in self.blob_sources.pop(key, {'sources': [key]})['sources']:
+            if self.sources.get(source_hash, {}).get('blob') == key:
+                self.sources.pop(source_hash, None)
+
+    def remember_source(self, source_hash, known):
+        """Associe un contenu reçu au blob retenu, avec le renvoi inverse pour release()"""
+        with self._lock:
+            self.sources[source_hash] = known
+            linked = self.blob_sources.get(known['blob'], {'sources': []})
+            if source_hash not in linked['sources']:
+                self.blob_sources[known['blob']] = {'sources': linked['sources'] + [source_hash]}
+
+    def add_usage(self, deltas):
+        """Met à jour des compteurs d'occupation (ex: octets par clé API)"""
+        with self._lock:
+            for name, delta in deltas.items():
+                self._usage[name] = self._usage.get(name, 0) + delta
+
+    def usage(self):
+        with self._lock:
+            return dict(self._usage)
+
+    def open(self, key):
+        return io.BytesIO(self._blobs[key])
+
+    def read(self, key):
+        return self._blobs[key]
+
+    def size(self, key):
+        return len(self._blobs[key])
+
+    def path(self, key):
+        return None
+
+class DiskIndex(MutableMapping):
+    """Index de métadonnées sur disque: un petit fichier JSON par file_id"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, file_id):
+        if not FILE_ID_RE.match(file_id):
+            raise KeyError(file_id)
+        return os.path.join(self.directory, f"{file_id}.json")
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        raise TypeError(f"Type non sérialisable: {type(value).__name__}")
+
+    @staticmethod
+    def _decode(obj):
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        return obj
+
+    def _load(self, path, file_id):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f, object_hook=self._decode)
+        except (FileNotFoundError, ValueError):
+            raise KeyError(file_id)
+
+    def __getitem__(self, file_id):
+        return self._load(self._entry_path(file_id), file_id)
+
+    def __setitem__(self, file_id, data):
+        path = self._entry_path(file_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, default=self._encode)
+        os.replace(tmp_path, path)
+
+    def __delitem__(self, file_id):
+        try:
+            os.unlink(self._entry_path(file_id))
+        except FileNotFoundError:
+            raise KeyError(file_id)
+
+    def __contains__(self, file_id):
+        try:
+            return os.path.exists(self._entry_path(file_id))
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                yield entry.name[:-5]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        # Un autre worker peut supprimer une entrée pendant le parcours
+        for file_id in self:
+            try:
+                yield file_id, self[file_id]
+            except KeyError:
+                continue
+
+    def values(self):
+        for _, data in self.items():
+            yield data
+
+    def pop(self, file_id, *default):
+        """Retire une entrée de façon atomique (un seul worker la récupère)"""
+        try:
+            path = self._entry_path(file_id)
+            claimed = f"{path}.{uuid.uuid4().hex}.del"
+            os.rename(path, claimed)
+        except (KeyError, FileNotFoundError):
+            if default:
+                return default[0]
+            raise KeyError(file_id)
+        try:
+            return self._load(claimed, file_id)
+        finally:
+            os.unlink(claimed)
+
+class SqliteIndex(MutableMapping):
+    """Index de métadonnées dans une table SQLite en mode WAL, partagée par les workers
+    
+    Même interface que DiskIndex. Les dates created/expiry sont recopiées dans
+    des colonnes: la relecture de l'index (timeline) ne décode aucun JSON en
+    Python (le propriétaire est extrait par SQLite).
+    """
+
+    BATCH = 1000  # entrées lues par requête lors d'un parcours
+
+    def __init__(self, path, table):
+        self.path = path
+        self.name = table
+        self.table = f'"{table}"'  # 'index' est un mot réservé SQL
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Une connexion par process: jamais héritée d'un fork
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                         '(key TEXT PRIMARY KEY, data TEXT NOT NULL, created TEXT, expiry TEXT)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.name}_expiry" ON {self.table} (expiry)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    @staticmethod
+    def _check(key):
+        if not isinstance(key, str) or not FILE_ID_RE.match(key):
+            raise KeyError(key)
+
+    @staticmethod
+    def _loads(data):
+        return json.loads(data, object_hook=DiskIndex._decode)
+
+    @staticmethod
+    def _row(key, data):
+        dates = [data.get(name) for name in ('created', 'expiry')]
+        return (key, json.dumps(data, default=DiskIndex._encode),
+                *(value.isoformat() if isinstance(value, datetime) else None for value in dates))
+
+    def __getitem__(self, key):
+        self._check(key)
+        rows = self._query(f'SELECT data FROM {self.table} WHERE key = ?', (key,))
+        if not rows:
+            raise KeyError(key)
+        return self._loads(rows[0][0])
+
+    def __setitem__(self, key, data):
+        self._check(key)
+        self._query(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)', self._row(key, data))
+
+    def __delitem__(self, key):
+        if self.pop(key, None) is None:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self._check(key)
+        except KeyError:
+            return False
+        return bool(self._query(f'SELECT 1 FROM {self.table} WHERE key = ?', (key,)))
+
+    def _batches(self, columns):
+        # Parcours par lots (clé croissante): aucun verrou tenu entre deux lots
+        last = ''
+        while True:
+            rows = self._query(f'SELECT key, {columns} FROM {self.table} WHERE key > ? ORDER BY key LIMIT ?',
+                               (last, self.BATCH))
+            yield from rows
+            if len(rows) < self.BATCH:
+                return
+            last = rows[-1][0]
+
+    def __iter__(self):
+        for key, _ in self._batches('1'):
+            yield key
+
+    def __len__(self):
+        return self._query(f'SELECT COUNT(*) FROM {self.table}')[0][0]
+
+    def items(self):
+        for key, data in self._batches('data'):
+            yield key, self._loads(data)
+
+    def values(self):
+        for _, data in self.items():
+            yield data
+
+    def timeline(self):
+        """(key, created, expiry, owner) des entrées datées, sans décoder leurs métadonnées"""
+        for key, created, expiry, owner in self._batches("created, expiry, json_extract(data, '$.owner')"):
+            if created and expiry:
+                yield key, datetime.fromisoformat(created), datetime.fromisoformat(expiry), owner
+
+    def pop(self, key, *default):
+        """Retire une entrée de façon atomique (un seul worker la récupère)"""
+        try:
+            self._check(key)
+            rows = self._query(f'DELETE FROM {self.table} WHERE key = ? RETURNING data', (key,))
+        except KeyError:
+            rows = None
+        if rows:
+            return self._loads(rows[0][0])
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def import_json(self, directory):
+        """Reprend les entrées d'un ancien DiskIndex (une transaction) puis supprime ses fichiers"""
+        legacy = DiskIndex(directory)
+        rows = [self._row(key, data) for key, data in legacy.items()]
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(f'INSERT OR IGNORE INTO {self.table} VALUES (?, ?, ?, ?)', rows)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        shutil.rmtree(directory, ignore_errors=True)
+        return len(rows)
+
+class DiskStorage:
+    """Blobs adressés par contenu dans un répertoire local, visibles par tous les workers"""
+    name = 'disk'
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock_path = os.path.join(root, '.lock')
+        self._usage_path = os.path.join(root, 'usage.json')
+        self.index = self._open_index('index')
+        # Empreinte d'un contenu reçu -> blob retenu (éventuellement compressé)
+        self.sources = self._open_index('sources')
+        # Renvoi inverse: blob retenu -> {'sources': [empreintes]}, nettoyé avec le blob
+        self.blob_sources = self._open_index('blob_sources')
+        self.jobs = self._open_index('jobs')
+        # Uploads fractionnés: sessions et morceaux reçus ("<upload_id>_<n>")
+        self.upload_sessions = self._open_index('upload_sessions')
+        self.upload_chunks = self._open_index('upload_chunks')
+        # Variantes transformées: "<blob>_<transformation>" -> blob de la variante
+        self.variants = self._open_index('variants')
+        if len(self.sources) and not len(self.blob_sources):
+            # Empreintes d'une version précédente, sans renvoi inverse: reconstruit une fois
+            for source_hash, known in list(self.sources.items()):
+                self.remember_source(source_hash, known)
+        if not {'blobs', 'files', 'file_stored_bytes', 'chunk_bytes', 'reserved_bytes'} <= self._read_usage().keys():
+            with self._locked():
+                self._init_usage()
+
+    def _open_index(self, name):
+        directory = os.path.join(self.root, name)
+        if METADATA_INDEX == 'json':
+            return DiskIndex(directory)
+        if METADATA_INDEX != 'sqlite':
+            raise ValueError(f"METADATA_INDEX inconnu: {METADATA_INDEX}")
+        index = SqliteIndex(os.path.join(self.root, 'index.db'), name)
+        if os.path.isdir(directory):
+            # Répertoire d'une version précédente (un fichier JSON par entrée): repris une fois
+            with self._locked():
+                if os.path.isdir(directory):
+                    log.info("[STOCKAGE] %d entrees '%s' reprises dans index.db", index.import_json(directory), name)
+        return index
+
+    @contextmanager
+    def _locked(self):
+        """Verrou inter-process pour les compteurs de références"""
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path(self, key):
+        return os.path.join(self.blob_dir, key[:2], key)
+
+    def _init_usage(self):
+        # Répertoire existant sans compteurs (première utilisation ou version précédente)
+        usage = self._read_usage()
+        if 'blobs' not in usage:
+            usage['stored_bytes'] = usage['blobs'] = 0
+            for directory, _, names in os.walk(self.blob_dir):
+                for name in names:
+                    if not name.endswith('.refs'):
+                        usage['stored_bytes'] += os.path.getsize(os.path.join(directory, name))
+                        usage['blobs'] += 1
+        if 'files' not in usage:
+            usage.update(merge_counters({'files': 0, 'file_bytes': 0}, *(file_counters(data) for data in self.index.values())))
+        if 'file_stored_bytes' not in usage:
+            usage['file_stored_bytes'] = sum(data.get('stored_size', data['size']) for data in self.index.values())
+        if 'chunk_bytes' not in usage:
+            usage['chunk_bytes'] = sum(chunk['size'] for chunk in self.upload_chunks.values())
+        if 'reserved_bytes' not in usage:
+            usage['reserved_bytes'] = sum(session.get('reserved', 0) for session in self.upload_sessions.values())
+        self._write_usage(usage)
+
+    def _read_usage(self):
+        try:
+            with open(self._usage_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'stored_bytes': 0}
+
+    def _write_usage(self, usage):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(usage, f)
+        os.replace(tmp_path, self._usage_path)
+
+    def _bump_usage(self, deltas):
+        # Appelé sous self._locked()
+        usage = self._read_usage()
+        for name, delta in deltas.items():
+            usage[name] = usage.get(name, 0) + delta
+        self._write_usage(usage)
+
+    def add_usage(self, deltas):
+        """Met à jour des compteurs d'occupation partagés entre workers"""
+        with self._locked():
+            self._bump_usage(deltas)
+
+    def usage(self):
+        return self._read_usage()
+
+    def _add_ref(self, key, delta):
+        ref_path = self.path(key) + '.refs'
+        try:
+            with open(ref_path, 'r') as f:
+                refs = int(f.read() or 0)
+        except FileNotFoundError:
+            refs = 0
+        refs += delta
+        if refs > 0:
+            with open(ref_path, 'w') as f:
+                f.write(str(refs))
+        elif os.path.exists(ref_path):
+            os.unlink(ref_path)
+        return refs
+
+    def put(self, content):
+        """Écrit le blob (hors verrou) puis l'installe et prend une référence"""
+        writer = self.writer()
+        writer.write(content)
+        return writer.commit()
+
+    def writer(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        writer = BlobWriter(os.fdopen(fd, 'wb'), self._install_writer, self._discard_writer)
+        writer.tmp_path = tmp_path
+        return writer
+
+    def _install_writer(self, writer):
+        writer.fileobj.close()
+        return self._install(writer.tmp_path, writer.key)
+
+    def _discard_writer(self, writer):
+        writer.fileobj.close()
+        try:
+            os.unlink(writer.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def put_file(self, path):
+        """Installe un fichier écrit dans tmp_dir sans le recopier: (clé, taille)"""
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+        key = hasher.hexdigest()
+        self._install(path, key)
+        return key, size
+
+    def adopt(self, tmp_path, key):
+        """Installe un fichier déjà écrit dans tmp_dir (ex: par un process de compression)"""
+        return self._install(tmp_path, key)
+
+    def _install(self, tmp_path, key):
+        blob_path = self.path(key)
+        with self._locked():
+            existed = os.path.exists(blob_path)
+            if existed:
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, blob_path)
+                self._bump_usage({'stored_bytes': size, 'blobs': 1})
+            self._add_ref(key, 1)
+        return existed
+
+    def acquire(self, key):
+        """Prend une référence sur un blob existant (False s'il a disparu)"""
+        with self._locked():
+            if not os.path.exists(self.path(key)):
+                return False
+            self._add_ref(key, 1)
+            return True
+
+    def release(self, key):
+        with self._locked():
+            if self._add_ref(key, -1) <= 0:
+                try:
+                    size = os.path.getsize(self.path(key))
+                    os.unlink(self.path(key))
+                    self._bump_usage({'stored_bytes': -size, 'blobs': -1})
+                except FileNotFoundError:
+                    pass
+                self._forget_sources(key)
+
+    def _forget_sources(self, key):
+        # Entrée sans renvoi (version précédente): seul le blob non transformé, de même empreinte
+        for source_hash in self.blob_sources.pop(key, {'sources': [key]})['sources']:
+            if self.sources.get(source_hash, {}).get('blob') == key:
+                self.sources.pop(source_hash, None)
+
+    def remember_source(self, source_hash, known):
+        """Associe un contenu reçu au blob retenu, avec le renvoi inverse pour release()"""
+        with self._locked():
+            self.sources[source_hash] = known
+            linked = self.blob_sources.get(known['blob'], {'sources': []})
+            if source_hash not in linked['sources']:
+                self.blob_sources[known['blob']] = {'sources': linked['sources'] + [source_hash]}
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+def run_blocking(fn, *args):
+    """Exécute un calcul long hors de la boucle gevent (thread natif), appel direct sinon
+    
+    fn ne doit pas prendre de verrou du module (verrous gevent après monkey-patch).
+    """
+    if GEVENT_MODE:
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+def create_storage():
+    if STORAGE_BACKEND == 'memory':
+        return MemoryStorage()
+    if STORAGE_BACKEND == 'disk':
+        return DiskStorage(STORAGE_DIR)
+    raise ValueError(f"STORAGE_BACKEND inconnu: {STORAGE_BACKEND}")
+
+STORAGE = create_storage()
+
+# Index des métadonnées (file_id -> infos), partagé via le backend
+TEMP_STORAGE = STORAGE.index
+# Instantanés des métriques par worker, additionnés par /metrics
+METRICS_DIR = os.path.join(STORAGE.root, 'metrics') if STORAGE.name == 'disk' else None
+
+# ===== RÉCUPÉRATION D'URLS =====
+
+class Fetcher:
+    """Client HTTP partagé: connexions keep-alive poolées et limite par hôte
+    
+    Le sémaphore d'un hôte n'existe que tant qu'une requête le tient ou
+    l'attend: le nombre d'entrées reste borné par les requêtes en cours.
+    """
+
+    def __init__(self, pool_size, per_host_limit, connect_timeout, read_timeout):
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.per_host_limit = per_host_limit
+        self.timeout = (connect_timeout, read_timeout)
+        self._host_slots = {}  # hôte -> [sémaphore, requêtes qui le tiennent ou l'attendent]
+        self._lock = threading.Lock()
+
+    def _enter(self, host):
+        with self._lock:
+            entry = self._host_slots.get(host)
+            if entry is None:
+                entry = self._host_slots[host] = [threading.BoundedSemaphore(self.per_host_limit), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _leave(self, host):
+        # Dernier utilisateur: sémaphore au repos, l'entrée est retirée
+        with self._lock:
+            entry = self._host_slots[host]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._host_slots[host]
+
+    def get(self, url):
+        """GET en streaming; le créneau de l'hôte est rendu par close()"""
+        host = urlsplit(url).netloc.lower()
+        slot = self._enter(host)
+        if not slot.acquire(timeout=self.timeout[1]):
+            self._leave(host)
+            raise TimeoutError(f"Trop de téléchargements simultanés vers {urlsplit(url).netloc}")
+        try:
+            response = self.session.get(url, timeout=self.timeout, stream=True)
+        except BaseException:
+            slot.release()
+            self._leave(host)
+            raise
+        response.fetch_slot = slot
+        response.fetch_host = host
+        return response
+
+    def close(self, response):
+        """Rend la connexion au pool et libère le créneau (idempotent)"""
+        response.close()
+        slot = getattr(response, 'fetch_slot', None)
+        if slot is not None:
+            response.fetch_slot = None
+            slot.release()
+            self._leave(response.fetch_host)
+
+FETCHER = Fetcher(FETCH_POOL_SIZE, FETCH_PER_HOST_LIMIT, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_BATCH_WORKERS, thread_name_prefix='fetch')
+
+def sanitize_filename(filename):
+    """Nettoie le nom de fichier pour éviter les problèmes"""
+    if '.' in filename:
+        name, ext = filename.rsplit('.', 1)
+    else:
+        name, ext = filename, ''
+    
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join([c for c in name if not unicodedata.combining(c)])
+    name = re.sub(r'[^\w\s-]', '', name)
+    name = re.sub(r'[-\s]+', '_', name)
+    name = name[:50]
+    
+    if ext:
+        return f"{name}.{ext}"
+    return name
+
+def has_alpha(img):
+    """True si l'image a une transparence réellement utilisée"""
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        return img.getchannel('A').getextrema()[0] < 255
+    return img.mode == 'P' and 'transparency' in img.info
+
+def looks_like_photo(img):
+    """Beaucoup de couleurs sur une miniature: photo plutôt que graphique/capture"""
+    # NEAREST: pas de lissage qui inventerait des couleurs intermédiaires
+    scale = max(img.width, img.height) / 256
+    sample = img if scale <= 1 else img.resize(
+        (max(1, int(img.width / scale)), max(1, int(img.height / scale))), Image.Resampling.NEAREST
+    )
+    return sample.convert('RGB').getcolors(4096) is None
+
+def choose_output_format(img, original_format, quality, policy):
+    """Format et options d'encodage selon COMPRESS_TARGET_FORMAT
+    
+    auto: JPEG pour les photos opaques, WebP avec perte pour les photos avec
+    alpha, WebP sans perte pour les graphiques. La transparence est conservée
+    dès que le format cible la supporte.
+    """
+    alpha = has_alpha(img)
+    if policy == 'avif' and not AVIF_SUPPORTED:
+        policy = 'webp'
+    
+    if policy == 'original':
+        save_format = 'JPEG' if original_format in ('JPEG', 'JPG') and not alpha else 'PNG'
+    elif policy == 'auto':
+        if looks_like_photo(img):
+            save_format = 'WEBP' if alpha else 'JPEG'
+        else:
+            save_format = 'WEBP_LOSSLESS'
+    else:
+        save_format = {
+            'jpeg': 'WEBP' if alpha else 'JPEG',
+            'webp': 'WEBP',
+            'webp_lossless': 'WEBP_LOSSLESS',
+            'png': 'PNG',
+            'avif': 'AVIF'
+        }.get(policy, 'PNG')
+    
+    if save_format == 'JPEG':
+        return 'JPEG', {'quality': quality, 'optimize': True}
+    if save_format == 'WEBP':
+        return 'WEBP', {'quality': quality, 'method': 4}
+    if save_format == 'WEBP_LOSSLESS':
+        return 'WEBP', {'lossless': True, 'quality': 50, 'method': 4}
+    if save_format == 'AVIF':
+        return 'AVIF', {'quality': quality, 'speed': 6}
+    return 'PNG', {'compress_level': PNG_COMPRESS_LEVEL}
+
+def prepare_mode(img, save_format):
+    """Convertit le mode de l'image pour le format cible (fond blanc pour JPEG)"""
+    if save_format == 'JPEG':
+        if img.mode in ('RGBA', 'LA', 'P', 'PA'):
+            if img.mode in ('P', 'PA'):
+                img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            return background
+        return img if img.mode in ('RGB', 'L', 'CMYK') else img.convert('RGB')
+    if save_format in ('WEBP', 'AVIF'):
+        if img.mode in ('RGB', 'RGBA'):
+            return img
+        return img.convert('RGBA' if has_alpha(img) else 'RGB')
+    if img.mode in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'):
+        return img
+    return img.convert('RGBA' if has_alpha(img) else 'RGB')
+
+def downscale_image(img, size, fast_downscale=None):
+    """Redimensionne en LANCZOS vers size (largeur, hauteur)
+    
+    En mode rapide, un JPEG est décodé directement à l'échelle 1/2, 1/4 ou 1/8
+    (draft) puis réduit par paliers (reduce + LANCZOS) via reducing_gap.
+    """
+    if fast_downscale is None:
+        fast_downscale = FAST_DOWNSCALE
+    if fast_downscale and size[0] <= img.width and size[1] <= img.height:
+        if DOWNSCALE_REDUCING_GAP:
+            img.draft(None, (int(size[0] * DOWNSCALE_REDUCING_GAP), int(size[1] * DOWNSCALE_REDUCING_GAP)))
+        return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=DOWNSCALE_REDUCING_GAP or None)
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+def predict_encoded_size(img, save_format, options):
+    """Encode une miniature et extrapole la taille complète au prorata des pixels"""
+    # NEAREST sous-échantillonne sans lisser: le grain (et donc le débit) est préservé
+    scale = max(img.width, img.height) / TRIAL_ENCODE_SIDE
+    sample = img.resize((max(1, int(img.width / scale)), max(1, int(img.height / scale))), Image.Resampling.NEAREST)
+    output = io.BytesIO()
+    sample.save(output, format=save_format, **options)
+    return output.tell() * (img.width * img.height) / (sample.width * sample.height)
+
+def compress_image(image_content, filename, quality=85, max_dimension=None, fast_downscale=None, target_format=None, timings=None):
+    """Compresse une image pour réduire sa taille (bytes ou fichier ouvert)
+    
+    Retourne (contenu, compressé ?, format de sortie PIL). Si timings (dict) est
+    fourni, y cumule la durée des étapes décodage/redimensionnement/essai/encodage.
+    """
+    if timings is None:
+        timings = {}
+    if fast_downscale is None:
+        fast_downscale = FAST_DOWNSCALE
+    original_format = None
+    try:
+        log.debug("[COMPRESS] Tentative de compression: %s", filename)
+        
+        # Ouvrir l'image (un fichier est lu par PIL sans copie complète en mémoire)
+        if isinstance(image_content, (bytes, bytearray)):
+            img = Image.open(io.BytesIO(image_content))
+            original_size = len(image_content)
+        else:
+            original_size = image_content.seek(0, os.SEEK_END)
+            image_content.seek(0)
+            img = Image.open(image_content)
+        original_format = img.format or 'PNG'
+        
+        log.debug("[COMPRESS] Format: %s, Taille: %s, %.2fMB", original_format, img.size, original_size/1024/1024)
+        
+        # Garde-fou "decompression bomb": dimensions lues dans l'en-tête, avant tout décodage
+        width, height = img.size
+        if width * height > MAX_IMAGE_PIXELS:
+            log.warning("[COMPRESS] %dx%d depasse %d pixels, image non decodee", width, height, MAX_IMAGE_PIXELS)
+            return image_content, False, original_format
+        
+        # Redimensionner si trop grande
+        resized = False
+        if max_dimension:
+            if width > max_dimension or height > max_dimension:
+                ratio = min(max_dimension / width, max_dimension / height)
+                new_size = (int(width * ratio), int(height * ratio))
+                log.debug("[COMPRESS] Redimensionnement de %s vers %s", img.size, new_size)
+                if fast_downscale:
+                    # Le décodage réduit (draft) est compté dans le redimensionnement
+                    with timed('compress_resize', timings):
+                        img = downscale_image(img, new_size, True)
+                else:
+                    with timed('compress_decode', timings):
+                        img.load()
+                    with timed('compress_resize', timings):
+                        img = downscale_image(img, new_size, False)
+                resized = True
+        
+        if not resized:
+            with timed('compress_decode', timings):
+                img.load()
+        
+        # Format cible (alpha conservé si possible)
+        save_format, save_options = choose_output_format(img, original_format, quality, target_format or COMPRESS_TARGET_FORMAT)
+        img = prepare_mode(img, save_format)
+        
+        # Sans redimensionnement, un essai sur miniature évite un encodage complet inutile
+        if not resized and TRIAL_ENCODE and width * height > TRIAL_ENCODE_SIDE * TRIAL_ENCODE_SIDE:
+            with timed('compress_trial', timings):
+                predicted_size = predict_encoded_size(img, save_format, save_options)
+            if predicted_size > original_size * 0.9:
+                log.info("[COMPRESS] Gain prevu nul en %s (%.2fMB estimes), garde l'original", save_format, predicted_size/1024/1024)
+                return image_content, False, original_format
+        
+        # Sauvegarder compressé
+        output = io.BytesIO()
+        with timed('compress_encode', timings):
+            img.save(output, format=save_format, **save_options)
+        
+        compressed_content = output.getvalue()
+        compressed_size = len(compressed_content)
+        
+        compression_ratio = (1 - compressed_size / original_size) * 100
+        log.info("[COMPRESS] Compressé en %s: %.2fMB (gain: %.1f%%)", save_format, compressed_size/1024/1024, compression_ratio)
+        
+        # Retourner la version compressée seulement si gain > 10%
+        if compression_ratio > 10:
+            return compressed_content, True, save_format
+        else:
+            log.info("[COMPRESS] Compression insuffisante, garde l'original")
+            return image_content, False, original_format
+            
+    except Exception as e:
+        log.error("[COMPRESS] Erreur compression: %s", e)
+        return image_content, False, original_format
+
+# ===== DÉTECTION DU CONTENU =====
+
+# (décalage, signature, extension, type MIME)
+MAGIC_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (0, b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (0, b'GIF87a', 'gif', 'image/gif'),
+    (0, b'GIF89a', 'gif', 'image/gif'),
+    (8, b'WEBP', 'webp', 'image/webp'),
+    (0, b'II*\x00', 'tiff', 'image/tiff'),
+    (0, b'MM\x00*', 'tiff', 'image/tiff'),
+    (0, b'BM', 'bmp', 'image/bmp'),
+    (0, b'%PDF-', 'pdf', 'application/pdf'),
+    (0, b'PK\x03\x04', 'zip', 'application/zip'),
+    (0, b'\x1f\x8b', 'gz', 'application/gzip'),
+    (0, b'(\xb5/\xfd', 'zst', 'application/zstd'),
+    (0, b'7z\xbc\xaf\x27\x1c', '7z', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'rar', 'application/vnd.rar'),
+    (0, b'OggS', 'ogg', 'audio/ogg'),
+    (0, b'ID3', 'mp3', 'audio/mpeg'),
+    (0, b'\x1aE\xdf\xa3', 'webm', 'video/webm'),
+]
+# Marques ISO-BMFF (octets 8-12 après "ftyp"), MP4 par défaut
+FTYP_BRANDS = {b'avif': ('avif', 'image/avif'), b'avis': ('avif', 'image/avif'),
+               b'heic': ('heic', 'image/heic'), b'heix': ('heic', 'image/heic'),
+               b'qt  ': ('mov', 'video/quicktime'), b'M4A ': ('m4a', 'audio/mp4')}
+SNIFFED_TYPES = {mime for *_, mime in MAGIC_SIGNATURES} | {mime for _, mime in FTYP_BRANDS.values()} | {'video/mp4'}
+# Table de quantification luminance de référence (JPEG, annexe K), qualité 50
+JPEG_LUMA_TABLE_SUM = sum((
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99
+))
+
+def sniff_magic(head):
+    """(extension, type MIME) d'après les premiers octets, (None, None) si inconnu"""
+    if head[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(head[8:12], ('mp4', 'video/mp4'))
+    if head[:4] == b'RIFF' and head[8:12] != b'WEBP':
+        return None, None
+    for offset, signature, extension, mime in MAGIC_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return extension, mime
+    return None, None
+
+def estimate_jpeg_quality(quantization):
+    """Qualité (1-100) avec laquelle un JPEG a été encodé, d'après sa table luminance"""
+    table = quantization.get(0)
+    if not table:
+        return None
+    # Échelle libjpeg: qualité < 50 -> 5000/q %, sinon 200 - 2q %
+    scale = sum(table) * 100 / JPEG_LUMA_TABLE_SUM
+    quality = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return max(1, min(100, round(quality)))
+
+def sniff_file(fileobj):
+    """Type réel, dimensions et mode d'un fichier, sans décoder l'image
+    
+    Seuls SNIFF_SIZE octets sont lus pour la signature; pour une image, PIL
+    n'analyse que l'en-tête (pas de load()). Retourne {} si le format est inconnu.
+    """
+    fileobj.seek(0)
+    extension, content_type = sniff_magic(fileobj.read(SNIFF_SIZE))
+    if extension is None:
+        return {}
+    info = {'extension': extension, 'content_type': content_type}
+    if extension not in IMAGE_FORMATS:
+        return info
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            info.update(format=img.format, width=img.width, height=img.height, mode=img.mode)
+            if img.format == 'JPEG':
+                info['jpeg_quality'] = estimate_jpeg_quality(getattr(img, 'quantization', None) or {})
+    except Image.DecompressionBombError:
+        info['too_many_pixels'] = True
+    except Exception as e:
+        # Signature sans image valide derrière (ex: texte commençant par "BM"): type non retenu
+        log.debug("[SNIFF] En-tete d'image illisible (%s): %s", extension, e)
+        return {}
+    return info
+
+@timed_stage('sniff')
+def sniff_upload(upload):
+    """Détecte le contenu d'un upload stocké; le résultat est gardé dans upload['detected']"""
+    if 'detected' not in upload:
+        with STORAGE.open(upload['blob']) as source:
+            upload['detected'] = sniff_file(source)
+    return upload['detected']
+
+def compression_skip_reason(detected):
+    """Raison de ne pas compresser une image d'après son en-tête, None si l'essai vaut le coup"""
+    if detected.get('too_many_pixels'):
+        return 'too_many_pixels'
+    width, height = detected['width'], detected['height']
+    if width * height > MAX_IMAGE_PIXELS:
+        return 'too_many_pixels'
+    if max(width, height) < COMPRESS_MIN_DIMENSION:
+        return 'small'
+    # Réencodé en JPEG à qualité égale ou supérieure: aucun gain sans redimensionnement
+    quality = detected.get('jpeg_quality')
+    if (quality and quality <= SKIP_JPEG_QUALITY and COMPRESS_TARGET_FORMAT in ('auto', 'original', 'jpeg')
+            and max(width, height) <= COMPRESS_MAX_DIMENSION):
+        return 'low_quality_jpeg'
+    return None
+
+def detected_content_type(content_type, detected):
+    """Type MIME à indexer: celui détecté pour les formats sans ambiguïté (images, PDF)"""
+    detected_type = detected.get('content_type')
+    declared = (content_type or '').split(';')[0].strip().lower()
+    if not detected_type:
+        # Type annoncé d'un format reconnaissable mais signature absente: contenu inconnu
+        return 'application/octet-stream' if declared in SNIFFED_TYPES else content_type
+    if detected_type.startswith('image/') or detected_type == 'application/pdf':
+        return detected_type
+    # Conteneurs (zip -> docx, mp4 -> m4v...): le type annoncé reste plus précis
+    return content_type if declared and declared != 'application/octet-stream' else detected_type
+
+# ===== LISTING DES FICHIERS =====
+
+class FileListing:
+    """Fichiers triés par création et par expiration, pour une pagination par curseur
+    
+    Tenu à jour par register_file/delete_file et complété par le rescan de
+    l'index d'expiration (fichiers des autres workers). Une page coûte
+    O(log n + taille de page); les suppressions sont paresseuses (entrées
+    périmées sautées, puis compactées). Une page filtrée par propriétaire
+    saute les fichiers des autres clés.
+    """
+    SORTS = ('created', 'expiry')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}  # file_id -> (création, expiration) en timestamps
+        self._owners = {}  # file_id -> nom de la clé API propriétaire
+        self._orders = {'created': [], 'expiry': []}
+        self._stale = 0
+
+    def add(self, file_id, created, expiry, owner=None):
+        keys = (created.timestamp(), expiry.timestamp())
+        with self._lock:
+            self._owners[file_id] = owner
+            previous = self._keys.get(file_id)
+            if previous == keys:
+                return
+            if previous is not None:
+                self._stale += 1
+            self._keys[file_id] = keys
+            for position, sort in enumerate(self.SORTS):
+                insort(self._orders[sort], (keys[position], file_id))
+
+    def remove(self, file_id):
+        with self._lock:
+            if self._keys.pop(file_id, None) is None:
+                return
+            self._owners.pop(file_id, None)
+            self._stale += 1
+            if self._stale > len(self._keys) + 1000:
+                self._compact()
+
+    def _live(self, sort, item):
+        keys = self._keys.get(item[1])
+        return keys is not None and keys[self.SORTS.index(sort)] == item[0]
+
+    def _compact(self):
+        for sort in self.SORTS:
+            self._orders[sort] = [item for item in self._orders[sort] if self._live(sort, item)]
+        self._stale = 0
+
+    def page(self, sort, limit, cursor=None, descending=False, owner=None):
+        """(file_ids, curseur de la page suivante ou None); ValueError si le curseur est invalide
+        
+        owner: seulement les fichiers de cette clé API (None: tous).
+        """
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            order = self._orders[sort]
+            if descending:
+                position = bisect_left(order, after) if after else len(order)
+            else:
+                position = bisect_right(order, after) if after else 0
+            file_ids, last = [], None
+            while len(file_ids) < limit:
+                if descending:
+                    if position == 0:
+                        break
+                    position -= 1
+                    item = order[position]
+                else:
+                    if position >= len(order):
+                        break
+                    item = order[position]
+                    position += 1
+                if self._live(sort, item) and (owner is None or self._owners.get(item[1]) == owner):
+                    file_ids.append(item[1])
+                    last = item
+            more = position > 0 if descending else position < len(order)
+        return file_ids, encode_cursor(last) if more and last else None
+
+    def __len__(self):
+        return len(self._keys)
+
+def encode_cursor(item):
+    return f"{item[0]:.6f}_{item[1]}"
+
+def decode_cursor(cursor):
+    value, _, file_id = cursor.partition('_')
+    if not file_id or not FILE_ID_RE.match(file_id):
+        raise ValueError(cursor)
+    return float(value), file_id
+
+FILE_LISTING = FileListing()
+
+def list_files_page(sort='created', limit=20, cursor=None, descending=True, owner=None):
+    """Résumé d'une page de fichiers: (fichiers, curseur suivant)"""
+    file_ids, next_cursor = FILE_LISTING.page(sort, limit, cursor, descending, owner)
+    now = datetime.now()
+    files = []
+    for file_id in file_ids:
+        data = TEMP_STORAGE.get(file_id)
+        if data is None:
+            FILE_LISTING.remove(file_id)  # supprimé par un autre worker
+            continue
+        files.append({
+            "id": file_id,
+            "filename": data['filename'],
+            "size_mb": round(data['size'] / (1024 * 1024), 2),
+            "type": data['content_type'],
+            "compressed": data.get('was_compressed', False),
+            "created": data['created'].isoformat(),
+            "expires_in_hours": max(0, (data['expiry'] - now).total_seconds() / 3600)
+        })
+    return files, next_cursor
+
+# ===== EXPIRATION =====
+
+class ExpiryIndex:
+    """Tas (échéance, file_id) vidé par un thread de nettoyage, hors requête
+    
+    Une suppression explicite laisse son entrée dans le tas: elle est ignorée
+    au dépilement car son échéance ne correspond plus à _scheduled.
+    """
+
+    def __init__(self, max_sleep, rescan_seconds):
+        self.max_sleep = max_sleep
+        self.rescan_seconds = rescan_seconds
+        self._heap = []
+        self._scheduled = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'evicted': 0,
+            'total_lag_seconds': 0.0,
+            'max_lag_seconds': 0.0,
+            'last_lag_seconds': 0.0,
+            'sweeps': 0,
+            'last_sweep_ms': 0.0,
+            'rescans': 0
+        }
+
+    def schedule(self, file_id, expiry):
+        """Ajoute ou déplace l'échéance d'un fichier: O(log n)"""
+        deadline = expiry.timestamp()
+        with self._lock:
+            if self._scheduled.get(file_id) == deadline:
+                return
+            self._scheduled[file_id] = deadline
+            heapq.heappush(self._heap, (deadline, file_id))
+            earliest = self._heap[0][1] == file_id
+        if earliest:
+            self._wakeup.set()
+
+    def unschedule(self, file_id):
+        with self._lock:
+            self._scheduled.pop(file_id, None)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, file_id = heapq.heappop(self._heap)
+                if self._scheduled.get(file_id) == deadline:
+                    del self._scheduled[file_id]
+                    due.append(file_id)
+        return due
+
+    def reap(self):
+        """Supprime les fichiers échus: O(k log n) pour k fichiers expirés"""
+        start = time.perf_counter()
+        now = time.time()
+        for file_id in self._pop_due(now):
+            file_data = TEMP_STORAGE.get(file_id)
+            if file_data is None:
+                continue  # déjà supprimé (download, autre worker)
+            deadline = file_data['expiry'].timestamp()
+            if deadline > now:
+                self.schedule(file_id, file_data['expiry'])
+                FILE_LISTING.add(file_id, file_data['created'], file_data['expiry'], file_data.get('owner'))
+                continue
+            if delete_file(file_id):
+                lag = max(0.0, time.time() - deadline)
+                with self._lock:
+                    self._stats['evicted'] += 1
+                    self._stats['total_lag_seconds'] += lag
+                    self._stats['last_lag_seconds'] = lag
+                    self._stats['max_lag_seconds'] = max(self._stats['max_lag_seconds'], lag)
+                METRICS.inc('expired_files_total')
+                METRICS.observe('eviction_lag_seconds', lag)
+                log.info("[DELETE] Fichier expire supprime: %s (retard %.2fs)", file_id, lag)
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['last_sweep_ms'] = (time.perf_counter() - start) * 1000
+
+    def rescan(self):
+        """Charge les échéances de tout l'index (démarrage, fichiers des autres workers)"""
+        if isinstance(TEMP_STORAGE, SqliteIndex):
+            entries = TEMP_STORAGE.timeline()
+        else:
+            # Le dict mémoire peut changer pendant le parcours: copie instantanée
+            items = list(TEMP_STORAGE.items()) if isinstance(TEMP_STORAGE, dict) else TEMP_STORAGE.items()
+            entries = ((file_id, data['created'], data['expiry'], data.get('owner')) for file_id, data in items)
+        discovered = []
+        for file_id, created, expiry, owner in entries:
+            self.schedule(file_id, expiry)
+            FILE_LISTING.add(file_id, created, expiry, owner)
+            discovered.append((created, file_id))
+        STORAGE_BUDGET.adopt(discovered)
+        with self._lock:
+            self._stats['rescans'] += 1
+
+    def start(self):
+        """Démarre le thread à la demande, dans le process qui sert les requêtes"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='expiry-reaper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_scan = None
+        last_sweep = 0.0
+        last_flush = 0.0
+        while True:
+            self._wakeup.clear()
+            try:
+                if last_scan is None or (self.rescan_seconds and time.monotonic() - last_scan >= self.rescan_seconds):
+                    self.rescan()
+                    last_scan = time.monotonic()
+                self.reap()
+                if time.monotonic() - last_sweep >= UPLOAD_SESSION_SWEEP_SECONDS:
+                    sweep_upload_sessions()
+                    VARIANT_CACHE.purge_expired()
+                    last_sweep = time.monotonic()
+                if METRICS_DIR and time.monotonic() - last_flush >= METRICS_FLUSH_SECONDS:
+                    METRICS.flush(METRICS_DIR)
+                    last_flush = time.monotonic()
+            except Exception as e:
+                log.exception("[REAPER] Erreur nettoyage: %s", e)
+            with self._lock:
+                next_deadline = self._heap[0][0] if self._heap else None
+            timeout = min(self.max_sleep, METRICS_FLUSH_SECONDS) if METRICS_DIR else self.max_sleep
+            if next_deadline is not None:
+                timeout = min(max(next_deadline - time.time(), 0.0), timeout)
+            self._wakeup.wait(timeout)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            pending = len(self._scheduled)
+            next_deadline = self._heap[0][0] if self._heap else None
+        evicted = stats.pop('evicted')
+        total_lag = stats.pop('total_lag_seconds')
+        return {
+            "reaper_running": self._thread is not None and self._thread.is_alive(),
+            "scheduled": pending,
+            "next_expiry_in_seconds": round(max(0.0, next_deadline - time.time()), 1) if next_deadline else None,
+            "evicted": evicted,
+            "avg_eviction_lag_seconds": round(total_lag / evicted, 3) if evicted else 0.0,
+            "max_eviction_lag_seconds": round(stats['max_lag_seconds'], 3),
+            "last_eviction_lag_seconds": round(stats['last_lag_seconds'], 3),
+            "sweeps": stats['sweeps'],
+            "last_sweep_ms": round(stats['last_sweep_ms'], 3),
+            "rescans": stats['rescans']
+        }
+
+# Relecture périodique utile seulement si d'autres workers partagent l'index
+EXPIRY_INDEX = ExpiryIndex(REAPER_MAX_SLEEP, EXPIRY_RESCAN_SECONDS if STORAGE.name == 'disk' else 0)
+
+def cleanup_old_files():
+    """Nettoie les fichiers expirés (échéances dues du tas, sans parcourir l'index)"""
+    EXPIRY_INDEX.reap()
+
+def delete_file(file_id):
+    """Retire un fichier de l'index et libère son blob"""
+    file_data = TEMP_STORAGE.pop(file_id, None)
+    if file_data is None:
+        return False
+    STORAGE.add_usage(file_counters(file_data, -1))
+    FILE_LISTING.remove(file_id)
+    EXPIRY_INDEX.unschedule(file_id)
+    STORAGE_BUDGET.forget(file_id)
+    STORAGE_BUDGET.charge(file_data.get('owner'), -file_data['size'])
+    if file_data.get('blob'):
+        STORAGE.release(file_data['blob'])
+    if file_data.get('compression_job'):
+        STORAGE.jobs.pop(file_data['compression_job'], None)
+    return True
+
+def require_api_key(f):
+    """Vérification des clés API (en-tête X-API-Key ou paramètre api_key)
+    
+    La clé n'est jamais cherchée dans le formulaire: une requête refusée
+    (clé, débit, uploads simultanés, quota) l'est avant la lecture du corps.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+        settings = API_KEYS.lookup(api_key)
+        if settings is None:
+            METRICS.inc('auth_failures_total')
+            return jsonify({
+                "error": "Clé API invalide ou manquante",
+                "message": "Passez la clé dans l'en-tête X-API-Key ou le paramètre api_key"
+            }), 401
+        
+        request.api_key_type = settings['name']
+        request.api_key_settings = settings
+        retry_after = API_KEYS.take_token(settings)
+        if retry_after:
+            return rate_limited(settings, 'rate', retry_after)
+        
+        # Refus avant de lire le corps si la taille annoncée dépasse le quota
+        is_upload = request.method in ('POST', 'PUT')
+        if is_upload and request.content_length:
+            rejection = quota_rejection(request.api_key_type, request.content_length - MULTIPART_OVERHEAD)
+            if rejection:
+                return rejection
+        if not is_upload:
+            return f(*args, **kwargs)
+        if not API_KEYS.begin_upload(settings):
+            return rate_limited(settings, 'concurrency', 1)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            API_KEYS.end_upload(settings)
+    return decorated_function
+
+@timed_stage('store')
+def store_file(content, filename, content_type=None, metadata=None):
+    """Stocke n'importe quel fichier et retourne une URL"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    
+    key = STORAGE.put(content)
+    upload = {'blob': key, 'size': len(content), 'sha256': key}
+    metadata = dict(metadata or {}, **store_at_rest(upload, filename, content_type))
+    return register_file(upload['blob'], upload['size'], filename, content_type, metadata)
+
+def listing_owner():
+    """Propriétaire dont la clé en cours peut lister les fichiers (None: tous, clé primary)"""
+    return None if request.api_key_type == 'primary' else request.api_key_type
+
+def register_file(blob, size, filename, content_type=None, metadata=None, original_filename=None, owner=None):
+    """Enregistre un blob déjà écrit dans le stockage et retourne une URL
+    
+    owner (clé API primary/secondary) est déduit de la requête en cours s'il
+    n'est pas fourni; le fichier est décompté de son quota.
+    """
+    if owner is None and has_request_context():
+        owner = getattr(request, 'api_key_type', None)
+    file_id = str(uuid.uuid4())
+    expiry = datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)
+    
+    clean_filename = sanitize_filename(filename)
+    log.debug("[INFO] Nom original: %s", filename)
+    log.debug("[INFO] Nom nettoye: %s", clean_filename)
+    
+    if not content_type:
+        content_type = mimetypes.guess_type(clean_filename)[0] or 'application/octet-stream'
+    
+    storage_data = {
+        'blob': blob,
+        'sha256': blob,
+        'filename': clean_filename,
+        'original_filename': original_filename or filename,
+        'content_type': content_type,
+        'expiry': expiry,
+        'created': datetime.now(),
+        'size': size,
+        'owner': owner
+    }
+    
+    # Ajouter metadata si fournie
+    if metadata:
+        storage_data.update(metadata)
+    
+    TEMP_STORAGE[file_id] = storage_data
+    STORAGE.add_usage(file_counters(storage_data))
+    FILE_LISTING.add(file_id, storage_data['created'], expiry, owner)
+    EXPIRY_INDEX.schedule(file_id, expiry)
+    STORAGE_BUDGET.track(file_id)
+    STORAGE_BUDGET.charge(owner, size)
+    STORAGE_BUDGET.enforce(keep=file_id)
+    
+    return f"{BASE_URL}/download/{file_id}"
+
+def get_file_extension(filename):
+    if not filename or '.' not in filename:
+        return None
+    return filename.rsplit('.', 1)[1].lower()
+
+def max_size_for(filename):
+    """Taille max autorisée selon le type (image ou fichier)"""
+    return MAX_IMAGE_SIZE if get_file_extension(filename) in IMAGE_FORMATS else MAX_FILE_SIZE
+
+# ===== RÉCEPTION DES UPLOADS =====
+
+class UploadTooLarge(Exception):
+    """Levée dès que le flux dépasse la limite, sans lire la suite du corps"""
+    status_code = 413
+
+    def __init__(self, size, max_size, is_image):
+        super().__init__(f"{size} > {max_size}")
+        self.size = size
+        self.max_size = max_size
+        self.is_image = is_image
+
+    def to_dict(self):
+        return {
+            "error": "Fichier trop volumineux",
+            "file_size_mb": round(self.size / (1024 * 1024), 2),
+            "max_size_mb": round(self.max_size / (1024 * 1024), 2),
+            "file_type": "image" if self.is_image else "file"
+        }
+
+def _iter_multipart_events(stream, boundary):
+    """Parse le corps multipart au fil de l'eau (morceaux de UPLOAD_CHUNK_SIZE)"""
+    # Le tampon interne ne dépasse jamais un morceau: les événements sont consommés à chaque lecture
+    decoder = MultipartDecoder(boundary)
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            yield event
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+def _write_upload(writer, chunks, filename, quota=None, owner=None):
+    """Copie les morceaux dans le writer en appliquant les limites au fil de l'eau"""
+    max_size = max_size_for(filename)
+    for chunk in chunks:
+        writer.write(chunk)
+        if writer.size > max_size:
+            raise UploadTooLarge(writer.size, max_size, get_file_extension(filename) in IMAGE_FORMATS)
+        if quota is not None and writer.size > quota:
+            raise QuotaExceeded(writer.size, quota, owner)
+
+@timed_stage('body_read')
+def receive_multipart_files(file_fields=('file',), max_request_size=None):
+    """Reçoit les fichiers d'un POST multipart directement dans le stockage
+    
+    Retourne (uploads, form): chaque upload contient filename, content_type,
+    blob, size et sha256. Lève UploadTooLarge dès que la limite est franchie.
+    """
+    largest = max_request_size or max(MAX_FILE_SIZE, MAX_IMAGE_SIZE)
+    if request.content_length and request.content_length > largest + MULTIPART_OVERHEAD:
+        raise UploadTooLarge(request.content_length, largest, False)
+    
+    uploads = []
+    form = {}
+    writer = None
+    owner = getattr(request, 'api_key_type', None)
+    quota = STORAGE_BUDGET.remaining_for(owner)
+    remaining = lambda: None if quota is None else quota - sum(upload['size'] for upload in uploads)
+    try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return uploads, form
+        
+        current = None
+        field_data = []
+        for event in _iter_multipart_events(request.stream, boundary.encode('latin-1')):
+            if isinstance(event, File) and event.name in file_fields:
+                current = {'field': event.name, 'filename': event.filename,
+                           'content_type': event.headers.get('Content-Type')}
+                writer = STORAGE.writer()
+            elif isinstance(event, (File, Field)):
+                current = {'field': event.name, 'skip': isinstance(event, File)}
+                field_data = []
+            elif isinstance(event, Data):
+                if writer is not None:
+                    _write_upload(writer, (event.data,), current['filename'], remaining(), owner)
+                    if not event.more_data:
+                        uploads.append(_finish_upload(writer, current['field'], current['filename'], current['content_type']))
+                        writer = None
+                elif current is not None and not current.get('skip'):
+                    field_data.append(event.data)
+                    if sum(len(part) for part in field_data) > MAX_FORM_MEMORY_SIZE:
+                        raise UploadTooLarge(MAX_FORM_MEMORY_SIZE + 1, MAX_FORM_MEMORY_SIZE, False)
+                    if not event.more_data:
+                        form[current['field']] = b''.join(field_data).decode('utf-8', 'replace')
+        return uploads, form
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        for upload in uploads:
+            STORAGE.release(upload['blob'])
+        raise
+
+def _finish_upload(writer, field, filename, content_type):
+    writer.commit()
+    METRICS.inc('upload_bytes_total', writer.size, source='url' if field == 'url' else 'multipart')
+    return {
+        'field': field,
+        'filename': filename,
+        'content_type': content_type,
+        'blob': writer.key,
+        'size': writer.size,
+        'sha256': writer.key,
+        'deduplicated': writer.existed
+    }
+
+def open_remote_file(file_url, filename=None):
+    """Ouvre l'URL via le fetcher partagé: (réponse, nom, type, taille annoncée)"""
+    log.info("[URL] Telechargement: %s", file_url)
+    
+    response = FETCHER.get(file_url)
+    try:
+        response.raise_for_status()
+    except Exception:
+        FETCHER.close(response)
+        raise
+    
+    # Nom du fichier (le nom explicite du client est prioritaire)
+    if not filename:
+        filename = 'download'
+        if 'content-disposition' in response.headers:
+            match = re.search(r'filename[^;=\n]*=([\'\"]?)([^\'\"\n]*)\1', response.headers['content-disposition'])
+            if match:
+                filename = match.group(2)
+        
+        if filename == 'download':
+            url_path = file_url.split('?')[0]
+            url_filename = url_path.split('/')[-1]
+            if url_filename and '.' in url_filename:
+                filename = url_filename
+    
+    content_type = response.headers.get('content-type', 'application/octet-stream')
+    declared_size = response.headers.get('content-length')
+    declared_size = int(declared_size) if declared_size and declared_size.isdigit() else None
+    return response, filename, content_type, declared_size
+
+def ingest_url(file_url, filename=None, owner=None):
+    """Télécharge une URL directement dans le stockage: (résultat, code HTTP)"""
+    fetch_start = time.perf_counter()
+    response, filename, content_type, declared_size = open_remote_file(file_url, filename)
+    file_ext = get_file_extension(filename)
+    is_image = file_ext in IMAGE_FORMATS
+    max_size = max_size_for(filename)
+    quota = STORAGE_BUDGET.remaining_for(owner)
+    
+    # Rejet immédiat si l'origine annonce une taille trop grande
+    if declared_size is not None and declared_size > max_size:
+        FETCHER.close(response)
+        return UploadTooLarge(declared_size, max_size, is_image).to_dict(), 413
+    if declared_size is not None and quota is not None and declared_size > quota:
+        FETCHER.close(response)
+        return QuotaExceeded(declared_size, quota, owner).to_dict(), 507
+    
+    # Écriture directe dans le stockage, coupée dès que la limite est franchie
+    writer = STORAGE.writer()
+    try:
+        _write_upload(writer, response.iter_content(UPLOAD_CHUNK_SIZE), filename, quota, owner)
+    except UploadTooLarge as e:
+        writer.abort()
+        log.warning("[URL] Telechargement interrompu a %.2fMB: %s", e.size/1024/1024, file_url)
+        return e.to_dict(), e.status_code
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        FETCHER.close(response)
+        METRICS.observe('stage_duration_seconds', time.perf_counter() - fetch_start, stage='fetch')
+    upload = _finish_upload(writer, 'url', filename, content_type)
+    
+    # Stocker (compression auto si image volumineuse)
+    try:
+        download_url, stored_name, content_type, compression_info, job_id = store_upload(upload, filename, content_type, owner)
+    except CompressionQueueFull:
+        return COMPRESSION_QUEUE_FULL_ERROR, 429
+    
+    result = {
+        "success": True,
+        "source_url": file_url,
+        "filename": sanitize_filename(stored_name),
+        "download_url": download_url,
+        "file_id": download_url.split('/')[-1],
+        "format": get_file_extension(stored_name) or "unknown",
+        "size_bytes": upload['size'],
+        "size_mb": round(upload['size'] / (1024 * 1024), 2),
+        "content_type": content_type,
+        "deduplicated": upload['deduplicated'],
+        "uploaded_at": datetime.now().isoformat(),
+        "expires_at": (datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)).isoformat()
+    }
+    
+    if compression_info:
+        result["compression"] = compression_info
+    elif job_id:
+        result["compression"] = pending_compression(job_id)
+    
+    return result, 200
+
+def _ingest_url_safe(file_url, filename=None, owner=None):
+    """ingest_url pour le pool de threads: les erreurs deviennent un résultat"""
+    try:
+        return ingest_url(file_url, filename, owner)
+    except Exception as e:
+        log.error("[ERROR] upload-from-urls %s: %s", file_url, e)
+        return {"success": False, "source_url": file_url, "error": str(e)}, 502
+
+def proxy_remote_stream(response, max_size, source_url):
+    """Relaie le corps distant morceau par morceau, coupe au-delà de max_size
+    
+    La connexion n'est pas fermée ici: l'appelant enregistre FETCHER.close
+    avec Response.call_on_close, appelé même si le flux n'est jamais lu.
+    """
+    sent = 0
+    for chunk in response.iter_content(UPLOAD_CHUNK_SIZE):
+        sent += len(chunk)
+        if sent > max_size:
+            # Les en-têtes sont déjà partis: on coupe la connexion
+            log.warning("[URL] Proxy interrompu a %.2fMB: %s", sent/1024/1024, source_url)
+            FETCHER.close(response)
+            return
+        yield chunk
+
+def reuse_known_upload(upload):
+    """Contenu déjà reçu: reprend le blob retenu la première fois, sans retraitement
+    
+    Retourne les infos de compression d'origine, ou None si le contenu est inconnu.
+    """
+    source_hash = upload['sha256']
+    known = STORAGE.sources.get(source_hash)
+    if known is None:
+        return None
+    if known['blob'] != upload['blob']:
+        if not STORAGE.acquire(known['blob']):
+            STORAGE.sources.pop(source_hash, None)
+            return None
+        STORAGE.release(upload['blob'])
+        upload['blob'] = known['blob']
+        upload['size'] = known['size']
+    upload['deduplicated'] = True
+    log.info("[DEDUP] Contenu deja connu %s, compression ignoree", source_hash[:12])
+    return known.get('compression_info') or {}
+
+def compress_stored_image(upload, filename):
+    """Compresse une image déjà stockée et remplace son blob si le gain suffit"""
+    compression_info = reuse_known_upload(upload)
+    if compression_info is not None:
+        return compression_info
+    
+    compression_info = _compress_stored_image(upload, filename)
+    remember_upload(upload, compression_info)
+    return compression_info
+
+def remember_upload(upload, compression_info, at_rest=None):
+    """Mémorise le résultat (même un échec) pour ne plus recompresser ce contenu"""
+    known = {
+        'blob': upload['blob'],
+        'size': upload['size'],
+        'compression_info': compression_info
+    }
+    if at_rest is not None:
+        known['at_rest'] = at_rest
+    STORAGE.remember_source(upload['sha256'], known)
+
+def _compression_info(original_size, compressed_size, output_format):
+    extension, content_type = OUTPUT_FORMATS[output_format]
+    return {
+        "compressed": True,
+        "original_size_mb": round(original_size / (1024 * 1024), 2),
+        "original_size_bytes": original_size,
+        "compressed_size_mb": round(compressed_size / (1024 * 1024), 2),
+        "compression_ratio": round((1 - compressed_size / original_size) * 100, 1),
+        "format": extension,
+        "content_type": content_type
+    }
+
+def record_compression(original_size, compressed_size):
+    METRICS.observe('compression_ratio', compressed_size / original_size if original_size else 1.0)
+    METRICS.inc('compression_bytes_saved_total', max(0, original_size - compressed_size))
+
+def output_name_and_type(filename, content_type, compression_info):
+    """Nom et type MIME du fichier stocké après un éventuel changement de format"""
+    extension = compression_info.get('format') if compression_info else None
+    current = get_file_extension(filename)
+    if not extension or current == extension or (extension == 'jpg' and current == 'jpeg'):
+        return filename, content_type
+    base = filename.rsplit('.', 1)[0] if '.' in filename else filename
+    return f"{base}.{extension}", compression_info['content_type']
+
+def _compress_stored_image(upload, filename):
+    timings = {}
+    with STORAGE.open(upload['blob']) as source:
+        content, was_compressed, output_format = run_blocking(
+            compress_image,
+            source,
+            filename,
+            85,
+            COMPRESS_MAX_DIMENSION,
+            None,
+            None,
+            timings
+        )
+    record_timings(timings)
+    if not was_compressed:
+        return {}
+    
+    original_size = upload['size']
+    record_compression(original_size, len(content))
+    new_blob = STORAGE.put(content)
+    STORAGE.release(upload['blob'])
+    upload['blob'] = new_blob
+    upload['size'] = len(content)
+    return _compression_info(original_size, len(content), output_format)
+
+@timed_stage('store')
+def store_upload(upload, filename, content_type, owner=None):
+    """Indexe un upload reçu, avec compression auto des grosses images
+    
+    La compression part en job d'arrière-plan (ASYNC_COMPRESSION) sauf si le
+    contenu est déjà connu. Retourne (download_url, nom stocké, type stocké,
+    compression_info, job_id) et lève CompressionQueueFull si la file est pleine.
+    """
+    # Le contenu réel (signature, en-tête) prime sur l'extension et le type annoncés
+    detected = sniff_upload(upload)
+    is_image = detected.get('extension') in IMAGE_FORMATS
+    content_type = detected_content_type(content_type, detected)
+    compression_info = {}
+    needs_job = False
+    
+    if is_image and AUTO_COMPRESS_IMAGES and upload['size'] > 5 * 1024 * 1024:  # > 5MB
+        skip_reason = compression_skip_reason(detected)
+        known = None if skip_reason else reuse_known_upload(upload)
+        if skip_reason:
+            METRICS.inc('compression_skipped_total', reason=skip_reason)
+            log.info("[UPLOAD] Compression ignoree (%s): %s", skip_reason, filename)
+        elif known is not None:
+            compression_info = known
+        elif ASYNC_COMPRESSION:
+            if not COMPRESSION_JOBS.reserve():
+                STORAGE.release(upload['blob'])
+                raise CompressionQueueFull()
+            needs_job = True
+        else:
+            log.info("[UPLOAD] Image volumineuse, tentative de compression...")
+            compression_info = compress_stored_image(upload, filename)
+        if compression_info:
+            log.info("[UPLOAD] Compression reussie: %s", compression_info)
+    
+    metadata = {'was_compressed': bool(compression_info)}
+    if detected:
+        metadata['detected'] = detected
+    if compression_info:
+        metadata['compression_info'] = compression_info
+    elif not needs_job:
+        metadata.update(store_at_rest(upload, filename, content_type))
+    job_id = None
+    if needs_job:
+        job_id = str(uuid.uuid4())
+        metadata['compression_status'] = 'pending'
+        metadata['compression_job'] = job_id
+    
+    stored_name, stored_type = output_name_and_type(filename, content_type, compression_info)
+    download_url = register_file(upload['blob'], upload['size'], stored_name, stored_type, metadata, filename, owner)
+    
+    if needs_job:
+        COMPRESSION_JOBS.submit(job_id, download_url.split('/')[-1], upload, filename)
+    return download_url, stored_name, stored_type, compression_info, job_id
+
+def finish_file_upload(upload, owner=None):
+    """Stocke un upload complet comme /upload et retourne la réponse (dict)
+    
+    Lève CompressionQueueFull si la file de compression est pleine (le blob
+    de l'upload est alors libéré).
+    """
+    owner = owner or request.api_key_type
+    filename = upload['filename']
+    is_image = sniff_upload(upload).get('extension') in IMAGE_FORMATS
+    original_size = upload['size']
+    
+    log.info("[UPLOAD] Fichier: %s, Taille: %.2fMB, Image: %s", filename, original_size/1024/1024, is_image)
+    
+    # Stocker le fichier (compression automatique des images si activée)
+    download_url, stored_name, stored_type, compression_info, job_id = store_upload(upload, filename, upload['content_type'], owner)
+    was_compressed = bool(compression_info)
+    
+    # Infos de retour
+    file_info = {
+        "success": True,
+        "filename": sanitize_filename(stored_name),
+        "original_filename": filename,
+        "download_url": download_url,
+        "file_id": download_url.split('/')[-1],
+        "format": get_file_extension(stored_name) or "unknown",
+        "size_bytes": upload['size'],
+        "size_mb": round(upload['size'] / (1024 * 1024), 2),
+        "content_type": stored_type or mimetypes.guess_type(stored_name)[0],
+        "uploaded_at": datetime.now().isoformat(),
+        "expires_at": (datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)).isoformat(),
+        "expiry_hours": FILE_EXPIRY_HOURS,
+        "api_key_used": owner,
+        "is_image": is_image,
+        "detected": upload['detected'] or None,
+        "deduplicated": upload['deduplicated']
+    }
+    
+    if was_compressed:
+        file_info["compression"] = compression_info
+        file_info["message"] = f"[OK] Image compressée et uploadée! Gain: {compression_info['compression_ratio']}%"
+    elif job_id:
+        file_info["compression"] = pending_compression(job_id)
+        file_info["message"] = "[OK] Image uploadée! Compression en cours, l'URL reste valide"
+    else:
+        file_info["message"] = f"[OK] Fichier uploadé! URL valide pendant {FILE_EXPIRY_HOURS}h"
+    
+    return file_info
+
+COMPRESSION_QUEUE_FULL_ERROR = {
+    "error": "File de compression pleine",
+    "message": "Trop d'images en cours de compression, réessayez dans quelques secondes"
+}
+
+def compression_queue_full():
+    response = jsonify(COMPRESSION_QUEUE_FULL_ERROR)
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+def pending_compression(job_id):
+    """Bloc 'compression' des réponses quand un job est en cours"""
+    return {
+        "status": "pending",
+        "job_id": job_id,
+        "job_url": f"{BASE_URL}/jobs/{job_id}"
+    }
+
+# ===== COMPRESSION AU REPOS =====
+
+def sample_entropy(sample):
+    """Entropie de Shannon d'un échantillon, en bits par octet (8 = aléatoire)"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(n / total * math.log2(n / total) for n in Counter(sample).values())
+
+def at_rest_codec(filename, content_type, sample):
+    """Codec à utiliser pour stocker ce fichier, ou None s'il n'y gagnerait rien"""
+    if not AT_REST_COMPRESSION:
+        return None
+    extension = get_file_extension(filename)
+    if extension in ALREADY_COMPRESSED_EXTENSIONS:
+        return None
+    mime = (content_type or '').split(';')[0].strip().lower()
+    if extension not in COMPRESSIBLE_EXTENSIONS and not mime.startswith('text/') and mime not in COMPRESSIBLE_TYPES:
+        return None
+    if sample_entropy(sample) > AT_REST_MAX_ENTROPY:
+        return None
+    return AT_REST_CODEC
+
+def _encode_blob(writer, key, encoding):
+    """Recopie un blob compressé (zstd ou gzip) dans writer, morceau par morceau"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: en-tête gzip
+    with STORAGE.open(key) as source:
+        for data in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+            writer.write(compressor.compress(data))
+    writer.write(compressor.flush())
+
+def encode_at_rest(upload, filename, content_type):
+    """Compresse au repos le blob d'un upload (texte, CSV, JSON...) si le gain suffit
+    
+    Remplace upload['blob']; upload['size'] reste la taille d'origine. Retourne
+    les métadonnées à indexer ({'encoding', 'stored_size'}) ou {}.
+    """
+    if upload['size'] < AT_REST_MIN_SIZE:
+        return {}
+    with STORAGE.open(upload['blob']) as source:
+        sample = source.read(AT_REST_SAMPLE_SIZE)
+    encoding = at_rest_codec(filename, content_type, sample)
+    if encoding is None:
+        return {}
+    
+    writer = STORAGE.writer()
+    try:
+        with timed('at_rest_encode'):
+            run_blocking(_encode_blob, writer, upload['blob'], encoding)
+        if writer.size > upload['size'] * (1 - AT_REST_MIN_GAIN):
+            writer.abort()
+            return {}
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    STORAGE.release(upload['blob'])
+    upload['blob'] = writer.key
+    METRICS.inc('at_rest_bytes_saved_total', upload['size'] - writer.size, encoding=encoding)
+    log.info("[STOCKAGE] %s compresse au repos (%s): %d -> %d octets", filename, encoding, upload['size'], writer.size)
+    return {'encoding': encoding, 'stored_size': writer.size}
+
+def store_at_rest(upload, filename, content_type):
+    """encode_at_rest avec déduplication: un contenu déjà reçu reprend son blob encodé
+    
+    Seules les entrées posées ici ('at_rest') sont reprises, pour ne pas
+    confondre avec le blob d'une image recompressée.
+    """
+    known = STORAGE.sources.get(upload['sha256'])
+    if known is not None and 'at_rest' in known and reuse_known_upload(upload) is not None:
+        return dict(known['at_rest'])
+    at_rest = encode_at_rest(upload, filename, content_type)
+    if at_rest:
+        remember_upload(upload, {}, at_rest)
+    return at_rest
+
+def decoded_reader(fileobj, encoding):
+    """Lecteur du contenu d'origine d'un blob compressé au repos (ne ferme pas fileobj)
+    
+    seek() vers l'avant décompresse et jette les octets sautés.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return fileobj
+
+def iter_decoded(fileobj, encoding, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Lit un blob en flux, décompressé s'il est compressé au repos (ferme fileobj)"""
+    try:
+        reader = decoded_reader(fileobj, encoding)
+        for data in iter(lambda: reader.read(chunk_size), b''):
+            yield data
+    finally:
+        fileobj.close()
+
+# ===== CLÉS API =====
+
+class TokenBucket:
+    """Seau à jetons: `rate` requêtes par seconde en régime établi, rafales jusqu'à `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consomme un jeton; retourne 0 si accordé, sinon l'attente en secondes"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+def _key_digest(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).digest()
+
+class ApiKeyStore:
+    """Clés API indexées par leur SHA-256 (recherche en temps constant)
+    
+    Sources: PRIMARY_API_KEY/SECONDARY_API_KEY et API_KEYS (env), puis
+    API_KEYS_FILE, relu quand il change. Chaque clé a un nom (propriétaire
+    des fichiers, quota), un seau à jetons et une limite d'uploads simultanés,
+    tenus par worker.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._buckets = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = time.monotonic()
+        self._keys = self._load()
+
+    def _settings(self, name, quota_mb=None, rate_per_minute=None, burst=None, max_concurrent_uploads=None):
+        return {
+            'name': name,
+            'quota': (API_KEY_QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024,
+            'rate_per_minute': RATE_LIMIT_PER_MINUTE if rate_per_minute is None else rate_per_minute,
+            'burst': RATE_LIMIT_BURST if burst is None else burst,
+            'max_concurrent_uploads': MAX_CONCURRENT_UPLOADS if max_concurrent_uploads is None else max_concurrent_uploads
+        }
+
+    def _load(self):
+        keys = {
+            _key_digest(PRIMARY_API_KEY): self._settings('primary', PRIMARY_QUOTA_MB),
+            _key_digest(SECONDARY_API_KEY): self._settings('secondary', SECONDARY_QUOTA_MB)
+        }
+        for item in filter(None, os.environ.get('API_KEYS', '').split(',')):
+            name, _, api_key = item.strip().partition(':')
+            if FILE_ID_RE.match(name) and api_key:
+                keys[_key_digest(api_key)] = self._settings(name)
+        if not self.path:
+            return keys
+        try:
+            self._mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            log.error("[AUTH] Fichier de cles illisible %s: %s", self.path, e)
+            return keys
+        for name, entry in entries.items():
+            if not FILE_ID_RE.match(name) or not isinstance(entry, dict):
+                log.warning("[AUTH] Entree ignoree: %s", name)
+                continue
+            try:
+                digest = _key_digest(entry['key']) if entry.get('key') else bytes.fromhex(entry['sha256'])
+                settings = self._settings(name, entry.get('quota_mb'), entry.get('rate_per_minute'),
+                                          entry.get('burst'), entry.get('max_concurrent_uploads'))
+            except (KeyError, TypeError, ValueError):
+                log.warning("[AUTH] Entree ignoree: %s", name)
+                continue
+            # Un nom redéfini dans le fichier remplace la clé de l'environnement
+            keys = {d: s for d, s in keys.items() if s['name'] != name}
+            keys[digest] = settings
+        return keys
+
+    def _refresh(self):
+        """Relit le fichier de clés s'il a changé (au plus toutes les API_KEYS_RELOAD_SECONDS)"""
+        if not self.path or time.monotonic() - self._checked < API_KEYS_RELOAD_SECONDS:
+            return
+        self._checked = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        keys = self._load()
+        with self._lock:
+            self._keys = keys
+            self._buckets.clear()
+        STORAGE_BUDGET.set_quotas(self.quotas())
+        log.info("[AUTH] %d cles API rechargees depuis %s", len(keys), self.path)
+
+    def lookup(self, api_key):
+        """Réglages de la clé (dict), None si elle est inconnue"""
+        if not api_key:
+            return None
+        self._refresh()
+        return self._keys.get(_key_digest(api_key))
+
+    def quotas(self):
+        return {settings['name']: settings['quota'] for settings in self._keys.values()}
+
+    def names(self):
+        return sorted({settings['name'] for settings in self._keys.values()})
+
+    def take_token(self, settings):
+        """0 si la requête passe la limite de débit, sinon l'attente en secondes"""
+        if not settings['rate_per_minute']:
+            return 0
+        with self._lock:
+            bucket = self._buckets.get(settings['name'])
+            if bucket is None:
+                bucket = self._buckets[settings['name']] = TokenBucket(
+                    settings['rate_per_minute'] / 60, max(1, settings['burst']))
+            return bucket.take()
+
+    def remaining_tokens(self, settings):
+        bucket = self._buckets.get(settings['name'])
+        return int(bucket.tokens) if bucket else max(1, settings['burst'])
+
+    def begin_upload(self, settings):
+        """Réserve une place d'upload pour cette clé, False si sa limite est atteinte"""
+        name, limit = settings['name'], settings['max_concurrent_uploads']
+        with self._lock:
+            if limit and self._uploads.get(name, 0) >= limit:
+                return False
+            self._uploads[name] = self._uploads.get(name, 0) + 1
+            return True
+
+    def end_upload(self, settings):
+        with self._lock:
+            self._uploads[settings['name']] -= 1
+
+    def metrics(self):
+        with self._lock:
+            uploads = {name: count for name, count in self._uploads.items() if count}
+        return {
+            "keys": len(self._keys),
+            "source": self.path or "env",
+            "rate_limit_per_minute": RATE_LIMIT_PER_MINUTE or None,
+            "rate_limit_burst": RATE_LIMIT_BURST,
+            "max_concurrent_uploads": MAX_CONCURRENT_UPLOADS or None,
+            "uploads_in_progress": uploads
+        }
+
+API_KEYS = ApiKeyStore(API_KEYS_FILE)
+
+def rate_limited(settings, reason, retry_after):
+    """Réponse 429: débit ('rate') ou uploads simultanés ('concurrency') de la clé dépassés"""
+    METRICS.inc('rate_limited_total', key=settings['name'], reason=reason)
+    if reason == 'rate':
+        message = f"Limite de {settings['rate_per_minute']} requetes/minute atteinte pour cette clé"
+    else:
+        message = f"Maximum {settings['max_concurrent_uploads']} uploads simultanés pour cette clé"
+    response = jsonify({"error": "Trop de requêtes", "message": message, "api_key": settings['name']})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+# ===== BUDGET ET QUOTAS =====
+
+class QuotaExceeded(UploadTooLarge):
+    """Upload au-delà du quota de la clé API ou du budget global (507)"""
+    status_code = 507
+
+    def __init__(self, size, remaining, owner):
+        super().__init__(size, remaining, False)
+        self.owner = owner
+
+    def to_dict(self):
+        return {
+            "error": "Quota de stockage dépassé",
+            "api_key": self.owner,
+            "file_size_mb": round(self.size / (1024 * 1024), 2),
+            "remaining_mb": round(self.max_size / (1024 * 1024), 2)
+        }
+
+class StorageBudget:
+    """Budget global en octets stockés, éviction LRU, quotas par clé API
+    
+    L'ordre LRU (dernier téléchargement) est propre à chaque process; les
+    fichiers découverts à la relecture de l'index passent en tête, par date
+    de création. Les compteurs d'octets sont tenus par le backend.
+    """
+
+    def __init__(self, budget_bytes, quotas):
+        self.budget_bytes = budget_bytes
+        self.set_quotas(quotas)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'evicted': 0, 'evicted_bytes': 0}
+
+    def set_quotas(self, quotas):
+        self.quotas = {owner: quota for owner, quota in quotas.items() if quota}
+
+    def track(self, file_id):
+        with self._lock:
+            self._lru[file_id] = None
+
+    def touch(self, file_id):
+        with self._lock:
+            if file_id in self._lru:
+                self._lru.move_to_end(file_id)
+            else:
+                self._lru[file_id] = None
+
+    def forget(self, file_id):
+        with self._lock:
+            self._lru.pop(file_id, None)
+
+    def adopt(self, entries):
+        """Ajoute en tête (les plus anciens) des fichiers enregistrés ailleurs: [(created, file_id)]"""
+        with self._lock:
+            for _, file_id in sorted((e for e in entries if e[1] not in self._lru), reverse=True):
+                self._lru[file_id] = None
+                self._lru.move_to_end(file_id, last=False)
+
+    def charge(self, owner, delta):
+        if owner and delta:
+            STORAGE.add_usage({f"owner:{owner}": delta})
+
+    def used_by(self, owner, usage=None):
+        return (usage or STORAGE.usage()).get(f"owner:{owner}", 0)
+
+    def remaining_for(self, owner):
+        """Octets encore acceptables pour cette clé (None si aucune limite)
+        
+        Les tailles réservées par les uploads fractionnés ouverts comptent
+        dans le quota de leur clé (owner:<clé>) et dans le budget global.
+        """
+        usage = STORAGE.usage()
+        limits = []
+        if owner in self.quotas:
+            limits.append(self.quotas[owner] - self.used_by(owner, usage))
+        if self.budget_bytes:
+            # Une éviction LRU libère la place, pas une réservation: un fichier seul ne peut dépasser le reste
+            limits.append(self.budget_bytes - max(0, usage.get('reserved_bytes', 0)))
+        return max(0, min(limits)) if limits else None
+
+    @staticmethod
+    def budgeted_bytes(usage):
+        """Octets soumis au budget: les morceaux des uploads fractionnés en cours n'en font pas partie
+
+        Ils ne sont pas dans l'ordre LRU: les compter ferait évincer des fichiers
+        terminés sans rapport, pour une place que l'éviction ne libère pas.
+        """
+        return max(0, usage.get('stored_bytes', 0) - max(0, usage.get('chunk_bytes', 0)))
+
+    def enforce(self, keep=None):
+        """Évince les fichiers les moins récemment téléchargés tant que le budget est dépassé"""
+        if not self.budget_bytes:
+            return
+        while self.budgeted_bytes(STORAGE.usage()) > self.budget_bytes:
+            with self._lock:
+                victim = next((file_id for file_id in self._lru if file_id != keep), None)
+                if victim is None:
+                    return
+                del self._lru[victim]
+            file_data = TEMP_STORAGE.get(victim)
+            if file_data is not None and delete_file(victim):
+                with self._lock:
+                    self._stats['evicted'] += 1
+                    self._stats['evicted_bytes'] += file_data['size']
+                METRICS.inc('budget_evictions_total')
+                METRICS.inc('budget_evicted_bytes_total', file_data['size'])
+                log.info("[BUDGET] Fichier evince (LRU): %s", victim)
+
+    def headers(self, owner):
+        """En-têtes de capacité restante pour la clé utilisée"""
+        usage = STORAGE.usage()
+        headers = {}
+        if owner in self.quotas:
+            used = self.used_by(owner, usage)
+            headers['X-Quota-Limit'] = str(self.quotas[owner])
+            headers['X-Quota-Used'] = str(used)
+            headers['X-Quota-Remaining'] = str(max(0, self.quotas[owner] - used))
+        if self.budget_bytes:
+            reserved = max(0, usage.get('reserved_bytes', 0))
+            headers['X-Storage-Budget-Remaining'] = str(max(0, self.budget_bytes - self.budgeted_bytes(usage) - reserved))
+        return headers
+
+    def metrics(self):
+        usage = STORAGE.usage()
+        stored = self.budgeted_bytes(usage)
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "budget_mb": round(self.budget_bytes / (1024 * 1024), 2) if self.budget_bytes else None,
+            "used_mb": round(stored / (1024 * 1024), 2),
+            "usage_percent": round(stored * 100 / self.budget_bytes, 1) if self.budget_bytes else None,
+            "evicted": stats['evicted'],
+            "evicted_mb": round(stats['evicted_bytes'] / (1024 * 1024), 2),
+            "pending_chunks_mb": round(max(0, usage.get('chunk_bytes', 0)) / (1024 * 1024), 2),
+            "reserved_mb": round(max(0, usage.get('reserved_bytes', 0)) / (1024 * 1024), 2),
+            "quotas": {
+                owner: {
+                    "quota_mb": round(quota / (1024 * 1024), 2),
+                    "used_mb": round(self.used_by(owner, usage) / (1024 * 1024), 2)
+                }
+                for owner, quota in self.quotas.items()
+            }
+        }
+
+STORAGE_BUDGET = StorageBudget(STORAGE_BUDGET_MB * 1024 * 1024, API_KEYS.quotas())
+
+@timed_stage('size_check')
+def quota_rejection(owner, size):
+    """Réponse 507 immédiate si la taille annoncée ne tient pas dans le quota"""
+    remaining = STORAGE_BUDGET.remaining_for(owner)
+    if remaining is None or size <= remaining:
+        return None
+    log.warning("[BUDGET] Refus %s: %.2fMB > %.2fMB restants", owner, size/1024/1024, remaining/1024/1024)
+    return jsonify(QuotaExceeded(size, remaining, owner).to_dict()), 507
+
+# ===== COMPRESSION EN ARRIÈRE-PLAN =====
+
+class CompressionQueueFull(Exception):
+    """File de compression pleine: le client doit réessayer (429)"""
+
+def _compression_task(source, filename, output_dir):
+    """Exécuté dans un process du pool: compresse l'image et écrit le résultat
+    
+    source est un chemin de blob (disque) ou des bytes (mémoire). Retourne
+    (résultat, durées des étapes); le résultat vaut None si le gain est
+    insuffisant, sinon (chemin, sha256, taille, format) ou (bytes, format).
+    """
+    timings = {}
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            content, was_compressed, output_format = compress_image(f, filename, quality=85, max_dimension=COMPRESS_MAX_DIMENSION, timings=timings)
+    else:
+        content, was_compressed, output_format = compress_image(source, filename, quality=85, max_dimension=COMPRESS_MAX_DIMENSION, timings=timings)
+    if not was_compressed:
+        return None, timings
+    if output_dir is None:
+        return (content, output_format), timings
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    return (tmp_path, hashlib.sha256(content).hexdigest(), len(content), output_format), timings
+
+class CompressionJobs:
+    """Compression hors requête dans un ProcessPoolExecutor, avec back-pressure
+    
+    Les jobs sont enregistrés dans le backend (STORAGE.jobs) pour que
+    /jobs/<id> réponde depuis n'importe quel worker.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._futures = {}
+        self._slots = 0
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Créé à la demande, dans le worker gunicorn (jamais avant le fork)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def reserve(self):
+        """Réserve une place dans la file, False si elle est pleine"""
+        with self._lock:
+            if self._slots >= self.queue_size:
+                return False
+            self._slots += 1
+            return True
+
+    def _free_slot(self):
+        with self._lock:
+            self._slots -= 1
+
+    def depth(self):
+        return self._slots
+
+    def submit(self, job_id, file_id, upload, filename):
+        """Lance la compression d'un fichier déjà indexé (place réservée)"""
+        now = datetime.now()
+        STORAGE.jobs[job_id] = {
+            'id': job_id,
+            'file_id': file_id,
+            'filename': filename,
+            'status': 'queued',
+            'original_size': upload['size'],
+            'created': now,
+            'updated': now
+        }
+        # Le job garde sa propre référence sur le blob source
+        STORAGE.acquire(upload['blob'])
+        job = {'id': job_id, 'file_id': file_id, 'upload': dict(upload)}
+        try:
+            output_dir = STORAGE.tmp_dir if STORAGE.path(upload['blob']) else None
+            source = STORAGE.path(upload['blob']) or STORAGE.read(upload['blob'])
+            future = self._pool().submit(_compression_task, source, filename, output_dir)
+        except Exception as e:
+            self._finish(job, None, e)
+            return
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._done(job, f))
+        log.info("[COMPRESS] Job %s en file (profondeur %d/%d)", job_id, self.depth(), self.queue_size)
+
+    def _done(self, job, future):
+        with self._lock:
+            self._futures.pop(job['id'], None)
+        try:
+            result, timings = future.result()
+        except Exception as e:
+            self._finish(job, None, e)
+        else:
+            record_timings(timings)
+            self._finish(job, result, None)
+
+    def _finish(self, job, result, error):
+        upload = job['upload']
+        source_blob = upload['blob']
+        try:
+            compression_info = {}
+            if error is None and result is not None:
+                if len(result) == 4:
+                    tmp_path, key, size, output_format = result
+                    STORAGE.adopt(tmp_path, key)
+                else:
+                    content, output_format = result
+                    key, size = STORAGE.put(content), len(content)
+                compression_info = _compression_info(upload['size'], size, output_format)
+                record_compression(upload['size'], size)
+                upload['blob'], upload['size'] = key, size
+            if error is None:
+                remember_upload(upload, compression_info)
+            self._apply(job['file_id'], source_blob, upload, compression_info, error)
+            
+            record = STORAGE.jobs.get(job['id'])
+            if record is not None:
+                record['status'] = 'failed' if error else ('done' if compression_info else 'skipped')
+                record['updated'] = datetime.now()
+                if compression_info:
+                    record['compression_info'] = compression_info
+                if error:
+                    record['error'] = str(error)
+                STORAGE.jobs[job['id']] = record
+            METRICS.inc('compression_jobs_total', result=record['status'] if record else 'orphan')
+            log.info("[COMPRESS] Job %s termine: %s", job['id'], record['status'] if record else 'orphelin')
+        except Exception as e:
+            log.exception("[COMPRESS] Erreur fin de job %s: %s", job['id'], e)
+        finally:
+            STORAGE.release(source_blob)
+            self._free_slot()
+
+    def _apply(self, file_id, source_blob, upload, compression_info, error):
+        """Remplace le blob du fichier par la variante compressée si elle existe"""
+        file_data = TEMP_STORAGE.get(file_id)
+        if file_data is None or file_data['blob'] != source_blob:
+            # Fichier supprimé entre-temps: la variante n'a plus de propriétaire
+            if compression_info:
+                STORAGE.release(upload['blob'])
+            return
+        file_data['compression_status'] = 'failed' if error else 'done'
+        previous_counters = file_counters(file_data, -1)
+        if compression_info:
+            STORAGE_BUDGET.charge(file_data.get('owner'), upload['size'] - file_data['size'])
+            file_data['filename'], file_data['content_type'] = output_name_and_type(
+                file_data['filename'], file_data['content_type'], compression_info
+            )
+            file_data.update({
+                'blob': upload['blob'],
+                'sha256': upload['blob'],
+                'size': upload['size'],
+                'was_compressed': True,
+                'compression_info': compression_info
+            })
+        TEMP_STORAGE[file_id] = file_data
+        if compression_info:
+            STORAGE.add_usage(merge_counters(previous_counters, file_counters(file_data)))
+            STORAGE.release(source_blob)
+
+    def status(self, job_id):
+        record = STORAGE.jobs.get(job_id)
+        if record is None:
+            return None
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.running():
+            record['status'] = 'running'
+        record['progress'] = {'queued': 0, 'running': 50}.get(record['status'], 100)
+        return record
+
+COMPRESSION_JOBS = CompressionJobs(COMPRESS_WORKERS, COMPRESS_QUEUE_SIZE)
+
+# ===== CONVERSION PDF =====
+
+class PdfConversionError(Exception):
+    """Entrée refusée par une conversion PDF (400)"""
+
+@contextmanager
+def local_blob_path(key):
+    """Chemin local d'un blob (copie temporaire pour le backend mémoire)"""
+    path = STORAGE.path(key)
+    if path:
+        yield path
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(STORAGE.read(key))
+        yield tmp_path
+    finally:
+        os.unlink(tmp_path)
+
+def images_to_pdf_file(uploads, resolution):
+    """Assemble les images en PDF page par page: (chemin du PDF, nombre de pages)
+    
+    Chaque page est encodée puis ajoutée au fichier (mode append de Pillow),
+    une seule image décodée à la fois quel que soit le nombre de pages. Une
+    image illisible (tronquée, corrompue) lève PdfConversionError à son nom.
+    """
+    fd, pdf_path = tempfile.mkstemp(dir=STORAGE.tmp_dir, suffix='.pdf')
+    os.close(fd)
+    pages = 0
+    try:
+        for upload in uploads:
+            try:
+                with STORAGE.open(upload['blob']) as source, Image.open(source) as img:
+                    for frame in ImageSequence.Iterator(img):
+                        if frame.width * frame.height > MAX_IMAGE_PIXELS:
+                            raise PdfConversionError(
+                                f"{upload['filename']}: {frame.width}x{frame.height} dépasse {MAX_IMAGE_PIXELS} pixels"
+                            )
+                        page = prepare_mode(frame, 'JPEG')
+                        page.save(pdf_path, 'PDF', append=pages > 0, resolution=resolution)
+                        pages += 1
+                        del page
+            except (UnidentifiedImageError, OSError, SyntaxError) as e:
+                # errno renseigné: erreur système (disque plein...), pas une image invalide
+                if isinstance(e, OSError) and e.errno is not None:
+                    raise
+                raise PdfConversionError(f"{upload['filename']}: image illisible ou corrompue") from e
+    except Exception:
+        os.unlink(pdf_path)
+        raise
+    return pdf_path, pages
+
+def count_pdf_pages(pdf_path):
+    if PDF_RASTER_BACKEND == 'pdfium':
+        doc = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    if PDF_RASTER_BACKEND == 'pymupdf':
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    from PIL import PdfParser
+    parser = PdfParser.PdfParser(pdf_path)
+    try:
+        return len(parser.pages)
+    finally:
+        parser.close()
+
+def _check_page_pixels(width_pt, height_pt, dpi):
+    # Garde-fou avant rendu: la taille en points est connue sans rasteriser
+    pixels = (width_pt * dpi / 72) * (height_pt * dpi / 72)
+    if pixels > MAX_IMAGE_PIXELS:
+        raise ValueError(f"page de {int(pixels)} pixels à {dpi} dpi (max {MAX_IMAGE_PIXELS})")
+
+def _render_pdf_page(backend, pdf_path, page_number, fmt, dpi, output_dir):
+    """Exécuté dans un process du pool: rend une page (numérotée à partir de 1) dans un fichier"""
+    save_format = 'PNG' if fmt == 'png' else 'JPEG'
+    fd, out_path = tempfile.mkstemp(dir=output_dir, suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        if backend == 'pdfium':
+            doc = pdfium.PdfDocument(pdf_path)
+            try:
+                page = doc[page_number - 1]
+                _check_page_pixels(*page.get_size(), dpi)
+                img = page.render(scale=dpi / 72).to_pil()
+                page.close()
+            finally:
+                doc.close()
+        elif backend == 'pymupdf':
+            with fitz.open(pdf_path) as doc:
+                page = doc[page_number - 1]
+                _check_page_pixels(page.rect.width, page.rect.height, dpi)
+                pix = page.get_pixmap(dpi=dpi, alpha=False)
+                img = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+        else:
+            prefix = out_path[:-len(fmt) - 1]
+            subprocess.run(
+                ['pdftoppm', '-f', str(page_number), '-l', str(page_number), '-r', str(dpi),
+                 '-png' if fmt == 'png' else '-jpeg', '-singlefile', pdf_path, prefix],
+                check=True, capture_output=True, timeout=300
+            )
+            rendered = f"{prefix}.{'png' if fmt == 'png' else 'jpg'}"
+            os.replace(rendered, out_path)
+            return out_path
+        if save_format == 'PNG':
+            img.save(out_path, 'PNG', optimize=False, compress_level=PNG_COMPRESS_LEVEL)
+        else:
+            img.convert('RGB').save(out_path, 'JPEG', quality=90, optimize=True)
+        return out_path
+    except Exception:
+        if os.path.exists(out_path):
+            os.unlink(out_path)
+        raise
+
+_PDF_EXECUTOR = None
+_PDF_EXECUTOR_LOCK = threading.Lock()
+
+def pdf_executor():
+    # Créé à la demande, dans le worker gunicorn (jamais avant le fork)
+    global _PDF_EXECUTOR
+    with _PDF_EXECUTOR_LOCK:
+        if _PDF_EXECUTOR is None:
+            _PDF_EXECUTOR = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _PDF_EXECUTOR
+
+@timed_stage('pdf_rasterize')
+def rasterize_pdf(pdf_path, page_numbers, fmt, dpi, base_name):
+    """Rend les pages en parallèle et stocke chacune dès qu'elle est prête
+    
+    Au plus PDF_PAGES_IN_FLIGHT pages rendues attendent d'être stockées, ce qui
+    borne l'espace temporaire quel que soit le nombre de pages. Retourne la
+    liste des pages dans l'ordre, chacune avec son file_id ou son erreur.
+    """
+    pool = pdf_executor()
+    extension = 'png' if fmt == 'png' else 'jpg'
+    content_type = 'image/png' if fmt == 'png' else 'image/jpeg'
+    output_dir = STORAGE.tmp_dir or tempfile.gettempdir()
+    remaining = iter(page_numbers)
+    in_flight = {}
+    results = {}
+
+    def submit_next():
+        page_number = next(remaining, None)
+        if page_number is not None:
+            future = pool.submit(_render_pdf_page, PDF_RASTER_BACKEND, pdf_path, page_number, fmt, dpi, output_dir)
+            in_flight[future] = page_number
+
+    for _ in range(PDF_PAGES_IN_FLIGHT):
+        submit_next()
+    try:
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                page_number = in_flight.pop(future)
+                try:
+                    blob, size = STORAGE.put_file(future.result())
+                except ValueError as e:
+                    # Garde-fou de taille (_check_page_pixels): message destiné au client
+                    log.warning("[PDF] Page %d refusee: %s", page_number, e)
+                    results[page_number] = {"page": page_number, "error": str(e)}
+                except Exception as e:
+                    log.error("[PDF] Erreur rendu page %d: %s", page_number, e)
+                    results[page_number] = {"page": page_number, "error": "Rendu de la page impossible"}
+                else:
+                    download_url = register_file(
+                        blob, size, f"{base_name}_page{page_number:03d}.{extension}", content_type,
+                        {'source_page': page_number}
+                    )
+                    results[page_number] = {
+                        "page": page_number,
+                        "file_id": download_url.split('/')[-1],
+                        "download_url": download_url,
+                        "size_bytes": size
+                    }
+                submit_next()
+    finally:
+        for future in in_flight:
+            future.cancel()
+    return [results[page_number] for page_number in sorted(results)]
+
+# ===== UPLOADS FRACTIONNÉS =====
+
+def _chunk_key(upload_id, number):
+    return f"{upload_id}_{number}"
+
+def expected_chunk_size(session, number):
+    """Taille attendue du morceau n (numéroté à partir de 1, le dernier est plus court)"""
+    if number < session['total_chunks']:
+        return session['chunk_size']
+    return session['size'] - session['chunk_size'] * (session['total_chunks'] - 1)
+
+def received_chunks(upload_id, session):
+    if session.get('assembled'):
+        return list(range(1, session['total_chunks'] + 1))
+    return [n for n in range(1, session['total_chunks'] + 1) if _chunk_key(upload_id, n) in STORAGE.upload_chunks]
+
+@timed_stage('chunk_receive')
+def receive_chunk(upload_id, session, number, stream, expected_sha256=None):
+    """Écrit un morceau dans le stockage en vérifiant taille et SHA-256
+    
+    Retourne (infos du morceau, None) ou (None, (erreur, code HTTP)).
+    """
+    expected_size = expected_chunk_size(session, number)
+    writer = STORAGE.writer()
+    try:
+        for data in iter(lambda: stream.read(min(UPLOAD_CHUNK_SIZE, expected_size + 1 - writer.size)), b''):
+            writer.write(data)
+            if writer.size > expected_size:
+                break
+        if writer.size != expected_size:
+            writer.abort()
+            return None, ({"error": "Taille de morceau invalide", "chunk": number,
+                           "expected_bytes": expected_size, "received_bytes": writer.size}, 400)
+        if expected_sha256 and writer.hasher.hexdigest() != expected_sha256.lower():
+            writer.abort()
+            return None, ({"error": "Somme SHA-256 du morceau invalide", "chunk": number,
+                           "expected_sha256": expected_sha256, "sha256": writer.hasher.hexdigest()}, 422)
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    METRICS.inc('upload_bytes_total', writer.size, source='chunk')
+    
+    chunk = {'blob': writer.key, 'sha256': writer.key, 'size': writer.size, 'received': datetime.now()}
+    # Morceau renvoyé: l'ancien blob est remplacé
+    previous = STORAGE.upload_chunks.pop(_chunk_key(upload_id, number), None)
+    STORAGE.upload_chunks[_chunk_key(upload_id, number)] = chunk
+    STORAGE.add_usage({'chunk_bytes': writer.size - (previous['size'] if previous else 0)})
+    if previous:
+        STORAGE.release(previous['blob'])
+    return chunk, None
+
+def _copy_blob(writer, source):
+    for data in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b''):
+        writer.write(data)
+
+@timed_stage('chunk_assemble')
+def assemble_chunks(upload_id, session):
+    """Concatène les morceaux dans un nouveau blob (lecture en flux): BlobWriter validé
+    
+    L'index et les blobs sont ouverts ici (verrous coopératifs sous gevent):
+    le thread natif ne reçoit qu'un fichier ouvert à recopier.
+    """
+    chunks = [STORAGE.upload_chunks[_chunk_key(upload_id, number)]
+              for number in range(1, session['total_chunks'] + 1)]
+    writer = STORAGE.writer()
+    try:
+        for chunk in chunks:
+            with STORAGE.open(chunk['blob']) as source:
+                run_blocking(_copy_blob, writer, source)
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer
+
+def reserve_upload(session):
+    """Réserve la taille annoncée sur le quota de la clé et le budget global"""
+    session['reserved'] = session['size']
+    STORAGE_BUDGET.charge(session['owner'], session['size'])
+    STORAGE.add_usage({'reserved_bytes': session['size']})
+
+def release_reservation(session):
+    """Rend la réservation d'une session (sans effet si elle est déjà rendue)"""
+    reserved = session.pop('reserved', 0)
+    if reserved:
+        STORAGE_BUDGET.charge(session['owner'], -reserved)
+        STORAGE.add_usage({'reserved_bytes': -reserved})
+
+def discard_chunks(upload_id, session):
+    """Libère les morceaux d'une session, le fichier assemblé mis de côté et la réservation"""
+    release_reservation(session)
+    freed = 0
+    for number in range(1, session['total_chunks'] + 1):
+        chunk = STORAGE.upload_chunks.pop(_chunk_key(upload_id, number), None)
+        if chunk:
+            STORAGE.release(chunk['blob'])
+            freed += chunk['size']
+    assembled = session.pop('assembled', None)
+    if assembled:
+        STORAGE.release(assembled['blob'])
+        freed += assembled['size']
+    if freed:
+        STORAGE.add_usage({'chunk_bytes': -freed})
+
+def sweep_upload_sessions():
+    """Supprime les sessions abandonnées et leurs morceaux"""
+    now = datetime.now()
+    sessions = list(STORAGE.upload_sessions.items())
+    for upload_id, session in sessions:
+        if now > session['expiry'] and STORAGE.upload_sessions.pop(upload_id, None):
+            discard_chunks(upload_id, session)
+            log.info("[CHUNKS] Session abandonnee supprimee: %s", upload_id)
+
+def owned_upload_session(upload_id):
+    """Session d'upload de la clé appelante (None si inconnue ou ouverte par une autre clé)"""
+    session = STORAGE.upload_sessions.get(upload_id)
+    if session is None or session.get('owner') != request.api_key_type:
+        return None
+    return session
+
+def upload_session_status(upload_id, session):
+    received = received_chunks(upload_id, session)
+    received_bytes = sum(expected_chunk_size(session, n) for n in received)
+    return {
+        "upload_id": upload_id,
+        "filename": session['filename'],
+        "size_bytes": session['size'],
+        "chunk_size": session['chunk_size'],
+        "total_chunks": session['total_chunks'],
+        "received_chunks": received,
+        "missing_chunks": session['total_chunks'] - len(received),
+        "received_bytes": received_bytes,
+        "progress": round(received_bytes * 100 / session['size'], 1),
+        "expires_at": session['expiry'].isoformat(),
+        "chunk_url": f"{BASE_URL}/uploads/{upload_id}/chunks/{{n}}",
+        "complete_url": f"{BASE_URL}/uploads/{upload_id}/complete"
+    }
+
+# ===== TÉLÉCHARGEMENT =====
+
+def _parse_byte_ranges(range_header, length):
+    """Intervalles [start, stop) satisfiables de l'en-tête Range
+    
+    None: pas de Range exploitable (réponse complète), []: rien de satisfiable (416).
+    """
+    parsed = parse_range_header(range_header)
+    if parsed is None or parsed.units != 'bytes':
+        return None
+    ranges = []
+    for begin, end in parsed.ranges:
+        if begin < 0:
+            start, stop = max(length + begin, 0), length
+        else:
+            start, stop = begin, length if end is None else min(end, length)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+def _iter_blob_ranges(blob, ranges, part_headers=None, closing=b'', encoding=None):
+    """Lit les intervalles demandés par morceaux (multipart/byteranges si part_headers)
+    
+    Avec encoding, les intervalles portent sur le contenu décompressé: chacun
+    redécompresse le blob depuis le début jusqu'à son premier octet.
+    """
+    with blob:
+        for i, (start, stop) in enumerate(ranges):
+            if part_headers:
+                yield part_headers[i]
+            if encoding:
+                blob.seek(0)
+                source = decoded_reader(blob, encoding)
+            else:
+                source = blob
+            source.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = source.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        if closing:
+            yield closing
+
+def serve_stored_file(file_data):
+    """Réponse HTTP pour un fichier stocké: ETag, requêtes conditionnelles et Range
+    
+    Un fichier compressé au repos part tel quel avec Content-Encoding si le
+    client accepte ce codage, sinon il est décompressé en flux. Une requête
+    Range (reprise de téléchargement) porte toujours sur le contenu d'origine:
+    elle est servie décompressée.
+    """
+    etag = file_data.get('sha256') or file_data['blob']
+    last_modified = datetime.fromtimestamp(int(file_data['created'].timestamp()), timezone.utc)
+    size = file_data['size']
+    encoding = file_data.get('encoding')
+    range_header = request.headers.get('Range')
+    decode = False
+    if encoding:
+        if not range_header and request.accept_encodings[encoding] > 0:
+            etag, size = f"{etag}-{encoding}", file_data['stored_size']
+        elif encoding == 'zstd' and zstandard is None:
+            return jsonify({"error": "Fichier stocké en zstd, module zstandard non installé"}), 406
+        else:
+            decode = True
+    headers = {
+        'Content-Disposition': f'attachment; filename="{file_data["filename"]}"',
+        'Cache-Control': 'public, max-age=3600',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes'
+    }
+    if encoding:
+        headers['Vary'] = 'Accept-Encoding'
+        if not decode:
+            headers['Content-Encoding'] = encoding
+    
+    # If-None-Match prime sur If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if not_modified:
+        return Response(status=304, headers=headers)
+    
+    ranges = None
+    if range_header:
+        # L'ETag de la version compressée (premier téléchargement) désigne le même contenu
+        if_range = request.if_range
+        if 'If-Range' not in request.headers or (
+            if_range.etag in (etag, f"{etag}-{encoding}")
+            or (if_range.date is not None and last_modified <= if_range.date)
+        ):
+            ranges = _parse_byte_ranges(range_header, size)
+    
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+    
+    try:
+        blob = STORAGE.open(file_data['blob'])
+    except (KeyError, FileNotFoundError):
+        return jsonify({"error": "Fichier non trouvé ou expiré"}), 404
+    
+    if decode and not ranges:
+        headers['Content-Length'] = str(size)
+        return Response(
+            iter_decoded(blob, encoding),
+            mimetype=file_data['content_type'],
+            headers=headers,
+            direct_passthrough=True
+        )
+    
+    if not ranges:
+        # Disque: wsgi.file_wrapper -> sendfile() côté gunicorn, sans copie en Python
+        headers['Content-Length'] = str(size)
+        return Response(
+            wrap_file(request.environ, blob),
+            mimetype=file_data['content_type'],
+            headers=headers,
+            direct_passthrough=True
+        )
+    
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(
+            _iter_blob_ranges(blob, ranges, encoding=encoding if decode else None),
+            status=206,
+            mimetype=file_data['content_type'],
+            headers=headers,
+            direct_passthrough=True
+        )
+    
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f"\r\n--{boundary}\r\n"
+         f"Content-Type: {file_data['content_type']}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('latin-1')
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+    headers['Content-Length'] = str(
+        sum(len(part) for part in part_headers) + sum(stop - start for start, stop in ranges) + len(closing)
+    )
+    return Response(
+        _iter_blob_ranges(blob, ranges, part_headers, closing, encoding if decode else None),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+        headers=headers,
+        direct_passthrough=True
+    )
+
+# ===== VARIANTES D'IMAGES =====
+
+class VariantError(Exception):
+    """Transformation invalide (400) ou image impossible à transformer (422)"""
+    status_code = 400
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        if status_code:
+            self.status_code = status_code
 
-def sanitize_filename(filename):
-    """Nettoie le nom de fichier pour éviter les problèmes"""
-    if '.' in filename:
-        name, ext = filename.rsplit('.', 1)
+def parse_transform(args):
+    """Paramètres width/height/fit/format/quality de /download, None sans transformation"""
+    if not any(name in args for name in ('width', 'height', 'fit', 'format', 'quality')):
+        return None
+    transform = {}
+    for name in ('width', 'height'):
+        value = args.get(name, '')
+        if value and not (value.isdigit() and 1 <= int(value) <= VARIANT_MAX_DIMENSION):
+            raise VariantError(f"{name} doit être compris entre 1 et {VARIANT_MAX_DIMENSION}")
+        transform[name] = int(value) if value else None
+    transform['fit'] = args.get('fit', 'contain').lower()
+    if transform['fit'] not in VARIANT_FITS:
+        raise VariantError(f"fit invalide (valeurs: {', '.join(VARIANT_FITS)})")
+    if transform['fit'] != 'contain' and not (transform['width'] and transform['height']):
+        raise VariantError(f"fit={transform['fit']} demande width et height")
+    transform['format'] = VARIANT_FORMATS.get(args.get('format', 'original').lower())
+    if transform['format'] is None:
+        raise VariantError(f"format invalide (valeurs: {', '.join(sorted(VARIANT_FORMATS))})")
+    if transform['format'] == 'avif' and not AVIF_SUPPORTED:
+        raise VariantError("AVIF non supporté par ce serveur")
+    quality = args.get('quality', '85')
+    if not (quality.isdigit() and 1 <= int(quality) <= 100):
+        raise VariantError("quality doit être compris entre 1 et 100")
+    transform['quality'] = int(quality)
+    return transform
+
+def variant_key(blob, transform):
+    """Clé d'index: empreinte du contenu source + transformation normalisée"""
+    return (f"{blob}_w{transform['width'] or 0}_h{transform['height'] or 0}"
+            f"_{transform['fit']}_{transform['format']}_q{transform['quality']}")
+
+def _variant_size(size, transform):
+    """Dimensions finales (avant recadrage pour cover), sans agrandissement pour contain"""
+    width, height = size
+    target_width, target_height = transform['width'], transform['height']
+    if transform['fit'] == 'fill':
+        return target_width, target_height
+    if transform['fit'] == 'cover':
+        scale = max(target_width / width, target_height / height)
     else:
-        name, ext = filename, ''
-    
-    name = unicodedata.normalize('NFKD', name)
-    name = ''.join([c for c in name if not unicodedata.combining(c)])
-    name = re.sub(r'[^\w\s-]', '', name)
-    name = re.sub(r'[-\s]+', '_', name)
-    name = name[:50]
-    
-    if ext:
-        return f"{name}.{ext}"
-    return name
+        scale = min(target_width / width if target_width else 1.0, target_height / height if target_height else 1.0, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
 
-def compress_image(image_content, filename, quality=85, max_dimension=None):
-    """Compresse une image pour réduire sa taille"""
+def render_variant(source, transform):
+    """Redimensionne et réencode une image (bytes ou fichier ouvert): (contenu, format PIL)
+    
+    Mêmes briques que compress_image (downscale_image, choose_output_format,
+    prepare_mode); exécuté via run_blocking, sans verrou du module.
+    """
     try:
-        print(f"[COMPRESS] Tentative de compression: {filename}")
-        
-        # Ouvrir l'image
-        img = Image.open(io.BytesIO(image_content))
+        img = Image.open(source)
+        width, height = img.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise VariantError(f"Image trop grande pour être transformée ({width}x{height})", 422)
         original_format = img.format or 'PNG'
-        original_size = len(image_content)
-        
-        print(f"[COMPRESS] Format: {original_format}, Taille: {img.size}, {original_size/1024/1024:.2f}MB")
-        
-        # Redimensionner si trop grande
-        if max_dimension:
-            width, height = img.size
-            if width > max_dimension or height > max_dimension:
-                ratio = min(max_dimension / width, max_dimension / height)
-                new_size = (int(width * ratio), int(height * ratio))
-                print(f"[COMPRESS] Redimensionnement de {img.size} vers {new_size}")
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+        new_size = _variant_size(img.size, transform)
+        if new_size != img.size:
+            img = downscale_image(img, new_size)
+        if transform['fit'] == 'cover':
+            target_width, target_height = transform['width'], transform['height']
+            left, top = (img.width - target_width) // 2, (img.height - target_height) // 2
+            img = img.crop((left, top, left + target_width, top + target_height))
         
-        # Convertir en RGB si nécessaire (pour JPEG)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        
-        # Sauvegarder compressé
+        policy = transform['format']
+        if policy == 'original':
+            # WebP/AVIF restent dans leur format, le reste suit la politique 'original' (JPEG ou PNG)
+            policy = {'WEBP': 'webp', 'AVIF': 'avif'}.get(original_format, 'original')
+        save_format, save_options = choose_output_format(img, original_format, transform['quality'], policy)
+        img = prepare_mode(img, save_format)
         output = io.BytesIO()
-        save_format = 'JPEG' if original_format in ('JPEG', 'JPG') else 'PNG'
-        
-        if save_format == 'JPEG':
-            img.save(output, format=save_format, quality=quality, optimize=True)
-        else:
-            img.save(output, format=save_format, optimize=True, compress_level=9)
-        
-        compressed_content = output.getvalue()
-        compressed_size = len(compressed_content)
-        
-        compression_ratio = (1 - compressed_size / original_size) * 100
-        print(f"[COMPRESS] Compressé: {compressed_size/1024/1024:.2f}MB (gain: {compression_ratio:.1f}%)")
-        
-        # Retourner la version compressée seulement si gain > 10%
-        if compression_ratio > 10:
-            return compressed_content, True
-        else:
-            print(f"[COMPRESS] Compression insuffisante, garde l'original")
-            return image_content, False
-            
-    except Exception as e:
-        print(f"[COMPRESS] Erreur compression: {e}")
-        return image_content, False
+        img.save(output, format=save_format, **save_options)
+        return output.getvalue(), save_format
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise VariantError("Image illisible ou format non supporté", 422)
 
-def cleanup_old_files():
-    """Nettoie les fichiers expirés"""
-    current_time = datetime.now()
-    expired_keys = []
+class VariantCache:
+    """Variantes transformées, mémorisées par (empreinte du contenu, transformation)
     
-    for key, data in TEMP_STORAGE.items():
-        if current_time > data['expiry']:
-            expired_keys.append(key)
-    
-    for key in expired_keys:
-        del TEMP_STORAGE[key]
-        print(f"[DELETE] Fichier expire supprime: {key}")
+    Chaque variante est un blob du stockage indexé dans STORAGE.variants
+    (partagé entre workers avec le backend disque). Elle expire avec le plus
+    durable de ses fichiers parents et la taille totale est bornée par une
+    éviction LRU. Les demandes simultanées d'une même variante dans un process
+    attendent le premier calcul au lieu de le refaire.
+    """
 
-def require_api_key(f):
-    """Vérification des clés API"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        api_key = request.headers.get('X-API-Key')
-        if not api_key:
-            api_key = request.args.get('api_key')
-        if not api_key and request.form:
-            api_key = request.form.get('api_key')
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evicted': 0}
+
+    def _count(self, result):
+        with self._lock:
+            self._stats[result] += 1
+        METRICS.inc('variant_requests_total', result=result)
+
+    def get(self, file_data, transform):
+        """Variante du fichier (calculée au besoin), lève VariantError"""
+        key = variant_key(file_data['blob'], transform)
+        entry = self._lookup(key, file_data)
+        if entry is not None:
+            self._count('hits')
+            return entry
         
-        if api_key not in [PRIMARY_API_KEY, SECONDARY_API_KEY]:
-            return jsonify({
-                "error": "Clé API invalide ou manquante",
-                "message": "Utilisez une des deux clés API valides"
-            }), 401
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = self._inflight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            self._count('coalesced')
+            return pending.result()
         
-        request.api_key_type = "primary" if api_key == PRIMARY_API_KEY else "secondary"
-        return f(*args, **kwargs)
-    return decorated_function
+        self._count('misses')
+        try:
+            entry = self._create(key, file_data, transform)
+            pending.set_result(entry)
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return entry
 
-def store_file(content, filename, content_type=None, metadata=None):
-    """Stocke n'importe quel fichier et retourne une URL"""
-    cleanup_old_files()
-    
-    file_id = str(uuid.uuid4())
-    expiry = datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)
-    
-    clean_filename = sanitize_filename(filename)
-    print(f"[INFO] Nom original: {filename}")
-    print(f"[INFO] Nom nettoye: {clean_filename}")
-    
-    if not content_type:
-        content_type = mimetypes.guess_type(clean_filename)[0] or 'application/octet-stream'
-    
-    storage_data = {
-        'content': base64.b64encode(content).decode('utf-8') if isinstance(content, bytes) else content,
-        'filename': clean_filename,
-        'original_filename': filename,
-        'content_type': content_type,
-        'expiry': expiry,
-        'created': datetime.now(),
-        'size': len(content)
+    def _lookup(self, key, file_data):
+        entry = STORAGE.variants.get(key)
+        if entry is None:
+            return None
+        now = datetime.now()
+        if entry['expiry'] < now:
+            self._drop(key)
+            return None
+        # Écriture limitée: prolongation d'expiration ou accès LRU vieux de plus d'une minute
+        if file_data['expiry'] > entry['expiry'] or (now - entry['last_access']).total_seconds() > 60:
+            entry['expiry'] = max(entry['expiry'], file_data['expiry'])
+            entry['last_access'] = now
+            STORAGE.variants[key] = entry
+        return entry
+
+    def _create(self, key, file_data, transform):
+        with STORAGE.open(file_data['blob']) as source, timed('variant_render'):
+            content, save_format = run_blocking(render_variant, source, transform)
+        extension, content_type = OUTPUT_FORMATS[save_format]
+        now = datetime.now()
+        entry = {
+            'blob': STORAGE.put(content),
+            'size': len(content),
+            'format': extension,
+            'content_type': content_type,
+            'source': file_data['blob'],
+            'created': now,
+            'last_access': now,
+            'expiry': file_data['expiry']
+        }
+        # Un autre worker a pu produire la même variante entre-temps
+        previous = STORAGE.variants.pop(key, None)
+        STORAGE.variants[key] = entry
+        if previous:
+            STORAGE.release(previous['blob'])
+        STORAGE.add_usage({'variant_bytes': entry['size'] - (previous['size'] if previous else 0)})
+        log.info("[VARIANT] %s: %s, %.1fKB", key[:12], key[65:], entry['size'] / 1024)
+        self.enforce(keep=key)
+        return entry
+
+    def _drop(self, key):
+        entry = STORAGE.variants.pop(key, None)
+        if entry is not None:
+            STORAGE.release(entry['blob'])
+            STORAGE.add_usage({'variant_bytes': -entry['size']})
+        return entry
+
+    def enforce(self, keep=None):
+        """Évince les variantes les moins récemment servies au-delà de la taille maximale"""
+        usage = STORAGE.usage().get('variant_bytes', 0)
+        if not self.max_bytes or usage <= self.max_bytes:
+            return
+        candidates = sorted((entry['last_access'], key) for key, entry in STORAGE.variants.items() if key != keep)
+        for _, key in candidates:
+            if usage <= self.max_bytes:
+                break
+            entry = self._drop(key)
+            if entry is not None:
+                usage -= entry['size']
+                with self._lock:
+                    self._stats['evicted'] += 1
+
+    def purge_expired(self):
+        """Supprime les variantes dont tous les parents ont expiré (thread de nettoyage)"""
+        now = datetime.now()
+        for key, entry in list(STORAGE.variants.items()):
+            if entry['expiry'] < now:
+                self._drop(key)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['stored_mb'] = round(STORAGE.usage().get('variant_bytes', 0) / (1024 * 1024), 2)
+        stats['max_mb'] = round(self.max_bytes / (1024 * 1024), 2) if self.max_bytes else None
+        return stats
+
+VARIANT_CACHE = VariantCache(VARIANT_CACHE_MB * 1024 * 1024)
+
+def variant_file_data(file_data, variant):
+    """Métadonnées de la variante au format attendu par serve_stored_file"""
+    base = file_data['filename'].rsplit('.', 1)[0] if '.' in file_data['filename'] else file_data['filename']
+    return {
+        'blob': variant['blob'],
+        'sha256': variant['blob'],
+        'size': variant['size'],
+        'filename': f"{base}.{variant['format']}",
+        'content_type': variant['content_type'],
+        'created': variant['created']
     }
-    
-    # Ajouter metadata si fournie
-    if metadata:
-        storage_data.update(metadata)
-    
-    TEMP_STORAGE[file_id] = storage_data
-    
-    return f"{BASE_URL}/download/{file_id}"
 
-def get_file_extension(filename):
-    if not filename or '.' not in filename:
-        return None
-    return filename.rsplit('.', 1)[1].lower()
+# ===== LOTS ET ARCHIVES =====
+
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=UPLOAD_BATCH_WORKERS, thread_name_prefix='batch')
+
+def _finish_upload_safe(upload, owner):
+    """finish_file_upload pour le pool de threads: (résultat, code HTTP)"""
+    try:
+        return finish_file_upload(upload, owner), 200
+    except CompressionQueueFull:
+        return dict(COMPRESSION_QUEUE_FULL_ERROR, success=False, original_filename=upload['filename']), 429
+    except Exception as e:
+        log.exception("[ERROR] upload-batch %s: %s", upload['filename'], e)
+        return {"success": False, "original_filename": upload['filename'], "error": str(e)}, 500
+
+class _ZipStream(io.RawIOBase):
+    """Sortie non positionnable pour zipfile: les octets écrits sont repris par drain()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def bundle_entry_names(files):
+    """Noms uniques dans l'archive ("photo.jpg", "photo (2).jpg", ...)"""
+    names, seen = [], set()
+    for file_data in files:
+        name = file_data['filename']
+        base, dot, extension = name.rpartition('.')
+        if not dot:
+            base, extension = name, ''
+        candidate, counter = name, 1
+        while candidate in seen:
+            counter += 1
+            candidate = f"{base} ({counter}).{extension}" if extension else f"{base} ({counter})"
+        seen.add(candidate)
+        names.append(candidate)
+    return names
+
+def iter_zip(files):
+    """Archive ZIP produite au fil de la lecture des blobs, sans la construire en mémoire
+    
+    Les formats déjà compressés sont stockés tels quels (ZIP_STORED), les
+    autres sont compressés en DEFLATE. L'appelant tient une référence sur
+    chaque blob jusqu'à la fin de l'envoi. Les entrées sont datées de la
+    création de l'archive (ZipFile.open par nom, seul moyen public de fixer
+    le niveau de compression d'une entrée écrite en flux).
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compresslevel=BUNDLE_COMPRESS_LEVEL, allowZip64=True) as archive:
+        for name, file_data in zip(bundle_entry_names(files), files):
+            if get_file_extension(name) in ALREADY_COMPRESSED_EXTENSIONS:
+                archive.compression = zipfile.ZIP_STORED
+            else:
+                archive.compression = zipfile.ZIP_DEFLATED
+            content = iter_decoded(STORAGE.open(file_data['blob']), file_data.get('encoding'), UPLOAD_CHUNK_SIZE)
+            # Taille inconnue de zipfile à l'ouverture par nom: ZIP64 annoncé d'avance si besoin
+            force_zip64 = file_data['size'] * 1.05 > zipfile.ZIP64_LIMIT
+            with archive.open(name, 'w', force_zip64=force_zip64) as entry:
+                for data in content:
+                    entry.write(data)
+                    yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()
 
 # ===== ROUTES =====
 
+@app.before_request
+def start_background_tasks():
+    # Après le fork des workers gunicorn: un thread de nettoyage par process
+    EXPIRY_INDEX.start()
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def add_quota_headers(response):
+    owner = getattr(request, 'api_key_type', None)
+    if owner:
+        response.headers.update(STORAGE_BUDGET.headers(owner))
+        settings = request.api_key_settings
+        if settings['rate_per_minute']:
+            response.headers['X-RateLimit-Limit'] = str(settings['rate_per_minute'])
+            response.headers['X-RateLimit-Remaining'] = str(API_KEYS.remaining_tokens(settings))
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    # Réponses en flux: durée jusqu'à l'envoi des en-têtes, taille si annoncée
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    start = g.get('request_start')
+    if start is not None:
+        METRICS.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        route=route, method=request.method, status=str(response.status_code))
+    if request.content_length:
+        METRICS.inc('http_request_bytes_total', request.content_length, route=route)
+    if response.content_length:
+        METRICS.inc('http_response_bytes_total', response.content_length, route=route)
+    return response
+
 @app.route('/')
 def home():
     """Page d'accueil"""
-    cleanup_old_files()
-    
     return jsonify({
         "service": "[FILE] Storage API - Stockage GROS FICHIERS avec compression",
         "version": "2.0",
@@ -218,17 +3774,37 @@ def home():
             "max_dimension": f"[OK] Max {MAX_IMAGE_DIMENSION}px par côté",
             "all_formats": "[OK] Images, PDF, videos, documents, etc.",
             "url_download": "[OK] Telechargement depuis URL externe",
+            "url_batch": f"[OK] Lots de {FETCH_BATCH_MAX_URLS} URLs en parallele",
             "return_binary": "[OK] Option retour binaire direct",
+            "image_variants": f"[OK] Variantes a la volee (cache {VARIANT_CACHE_MB or 'illimite'}MB)",
+            "pdf_conversion": f"[{'OK' if PDF_RASTER_BACKEND else 'OFF'}] Images -> PDF et PDF -> images ({PDF_RASTER_BACKEND or 'aucun moteur'})",
             "dual_api_keys": "[OK] Primary & Secondary keys",
+            "content_sniffing": "[OK] Type reel detecte (signature + en-tete), compression evitee si inutile",
+            "rate_limits": f"[{'OK' if RATE_LIMIT_PER_MINUTE else 'OFF'}] {RATE_LIMIT_PER_MINUTE} req/min et {MAX_CONCURRENT_UPLOADS or 'illimite'} uploads simultanes par cle",
+            "storage_budget": f"[{'OK' if STORAGE_BUDGET_MB else 'OFF'}] Budget {STORAGE_BUDGET_MB}MB, eviction LRU",
+            "api_key_quotas": f"[OK] Quotas primary {PRIMARY_QUOTA_MB}MB / secondary {SECONDARY_QUOTA_MB}MB (0 = illimite)",
             "auto_cleanup": f"[OK] Suppression apres {FILE_EXPIRY_HOURS}h"
         },
         "endpoints": {
             "POST /upload": "Upload un fichier (compression auto si image)",
+            "POST /upload-batch": f"Upload de {UPLOAD_BATCH_MAX_FILES} fichiers max en une requete (traitement parallele)",
+            "GET|POST /bundle?ids=": "Archive ZIP en flux de plusieurs fichiers",
+            "POST /convert/images-to-pdf": "Fusionner des images en un PDF multipage",
+            "POST /convert/pdf-to-images": "Rendre les pages d'un PDF en PNG/JPEG",
+            "POST /uploads": "Ouvrir un upload fractionne et reprenable",
+            "PUT /uploads/{id}/chunks/{n}": "Envoyer le morceau n (ordre libre, en parallele)",
+            "GET /uploads/{id}": "Morceaux deja recus",
+            "POST /uploads/{id}/complete": "Assembler et stocker comme /upload",
             "POST /upload-from-url": "Telecharger depuis URL",
+            "POST /upload-from-urls": "Telecharger une liste d'URLs en parallele",
             "GET /download/{id}": "Telecharger un fichier",
+            "GET /download/{id}?width=&height=&fit=&format=&quality=": "Variante redimensionnee/convertie (mise en cache)",
             "GET /info/{id}": "Infos sur un fichier",
+            "GET /files": "Liste paginee (?sort=created|expiry&order=&limit=&cursor=)",
+            "GET /jobs/{id}": "Avancement d'une compression en arriere-plan",
             "GET /health": "Verification sante",
-            "GET /status": "Statut du service"
+            "GET /status": "Statut du service",
+            "GET /metrics": "Metriques Prometheus (latences, etapes, octets, compression)"
         }
     })
 
@@ -238,106 +3814,409 @@ def health():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "storage_count": len(TEMP_STORAGE),
+        "storage_count": STORAGE.usage().get('files', 0),
+        "storage_backend": STORAGE.name,
+        "serving_mode": "gevent" if GEVENT_MODE else "sync",
         "max_file_size_mb": MAX_FILE_SIZE / (1024 * 1024),
         "max_image_size_mb": MAX_IMAGE_SIZE / (1024 * 1024)
     })
 
+@app.route('/metrics')
+def metrics():
+    """Métriques au format texte Prometheus (tous les workers avec le backend disque)"""
+    usage = STORAGE.usage()
+    gauges = [
+        ('storage_stored_bytes', "Octets stockés (blobs dédupliqués)", [({}, usage.get('stored_bytes', 0))]),
+        ('storage_files', "Fichiers indexés", [({}, usage.get('files', 0))]),
+        ('storage_file_bytes', "Taille cumulée des fichiers indexés", [({}, usage.get('file_bytes', 0))]),
+        ('storage_content_type_bytes', "Taille cumulée des fichiers par type MIME",
+         [({'type': name[5:]}, size) for name, size in sorted(usage.items()) if name.startswith('type:') and size]),
+        ('storage_compressed_files', "Fichiers stockés compressés", [({}, usage.get('compressed_files', 0))]),
+        ('storage_bytes_saved', "Octets économisés par la compression des fichiers stockés", [({}, usage.get('bytes_saved', 0))]),
+        ('storage_encoded_files', "Fichiers compressés au repos", [({}, usage.get('encoded_files', 0))]),
+        ('storage_encoded_bytes_saved', "Octets économisés par la compression au repos", [({}, usage.get('encoded_bytes_saved', 0))]),
+        ('storage_quota_used_bytes', "Octets comptés sur le quota de chaque clé API",
+         [({'key': owner}, STORAGE_BUDGET.used_by(owner, usage)) for owner in API_KEYS.names()]),
+        ('compression_queue_depth', "Jobs de compression en file", [({}, COMPRESSION_JOBS.depth())])
+    ]
+    return Response(METRICS.render(METRICS_DIR, gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 @app.route('/convert', methods=['POST'])
 @require_api_key
 def upload_file():
     """Upload n'importe quel fichier avec compression automatique pour images"""
     try:
-        if 'file' not in request.files:
+        try:
+            uploads, _ = receive_multipart_files()
+        except UploadTooLarge as e:
+            log.warning("[UPLOAD] Refusé à %.2fMB (max %.2fMB)", e.size/1024/1024, e.max_size/1024/1024)
+            return jsonify(e.to_dict()), e.status_code
+        
+        if not uploads:
             return jsonify({"error": "Aucun fichier fourni"}), 400
         
-        file = request.files['file']
-        if file.filename == '':
+        upload = uploads[0]
+        for extra in uploads[1:]:
+            STORAGE.release(extra['blob'])
+        if upload['filename'] == '':
+            STORAGE.release(upload['blob'])
             return jsonify({"error": "Nom de fichier vide"}), 400
         
-        filename = file.filename
-        file_ext = get_file_extension(filename)
-        is_image = file_ext in IMAGE_FORMATS
+        try:
+            return jsonify(finish_file_upload(upload))
+        except CompressionQueueFull:
+            return compression_queue_full()
+        
+    except Exception as e:
+        log.exception("[ERROR] Erreur upload: %s", e)
+        return jsonify({"error": f"Erreur: {str(e)}"}), 500
+
+@app.route('/upload-batch', methods=['POST'])
+@require_api_key
+def upload_batch():
+    """Upload de plusieurs fichiers (champs 'files' ou 'file'), traités en parallèle comme /upload"""
+    try:
+        uploads, _ = receive_multipart_files(('files', 'file'), UPLOAD_BATCH_MAX_SIZE)
+    except UploadTooLarge as e:
+        log.warning("[UPLOAD] Lot refusé à %.2fMB (max %.2fMB)", e.size/1024/1024, e.max_size/1024/1024)
+        return jsonify(e.to_dict()), e.status_code
+    
+    if not uploads:
+        return jsonify({"error": "Aucun fichier fourni"}), 400
+    if len(uploads) > UPLOAD_BATCH_MAX_FILES:
+        for upload in uploads:
+            STORAGE.release(upload['blob'])
+        return jsonify({"error": f"Maximum {UPLOAD_BATCH_MAX_FILES} fichiers par requête"}), 400
+    
+    owner = request.api_key_type
+    futures = []
+    for upload in uploads:
+        if upload['filename'] == '':
+            STORAGE.release(upload['blob'])
+            futures.append(({"success": False, "original_filename": '', "error": "Nom de fichier vide"}, 400))
+        else:
+            futures.append(BATCH_EXECUTOR.submit(_finish_upload_safe, upload, owner))
+    
+    files = []
+    for future in futures:
+        result, status_code = future if isinstance(future, tuple) else future.result()
+        result["status_code"] = status_code
+        files.append(result)
+    
+    succeeded = sum(1 for result in files if result["success"])
+    log.info("[UPLOAD] Lot termine: %d/%d fichiers", succeeded, len(files))
+    
+    return jsonify({
+        "success": succeeded == len(files),
+        "count": len(files),
+        "succeeded": succeeded,
+        "failed": len(files) - succeeded,
+        "file_ids": [result["file_id"] for result in files if result["success"]],
+        "files": files
+    })
+
+@app.route('/uploads', methods=['POST'])
+@require_api_key
+def create_upload_session():
+    """Ouvre un upload fractionné: JSON {filename, size, content_type?, chunk_size?}"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    try:
+        size = int(data.get('size', 0))
+        chunk_size = int(data.get('chunk_size') or CHUNKED_UPLOAD_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({"error": "size et chunk_size doivent être des entiers"}), 400
+    if not filename or size <= 0:
+        return jsonify({"error": "filename et size (octets) sont requis",
+                        "example": {"filename": "video.mp4", "size": 524288000}}), 400
+    if not CHUNKED_UPLOAD_MIN_CHUNK <= chunk_size <= CHUNKED_UPLOAD_MAX_CHUNK:
+        return jsonify({"error": f"chunk_size doit être entre {CHUNKED_UPLOAD_MIN_CHUNK} et {CHUNKED_UPLOAD_MAX_CHUNK}"}), 400
+    
+    max_size = max_size_for(filename)
+    if size > max_size:
+        return jsonify(UploadTooLarge(size, max_size, get_file_extension(filename) in IMAGE_FORMATS).to_dict()), 413
+    rejection = quota_rejection(request.api_key_type, size)
+    if rejection:
+        return rejection
+    
+    upload_id = str(uuid.uuid4())
+    session = {
+        'filename': filename,
+        'content_type': data.get('content_type'),
+        'size': size,
+        'chunk_size': chunk_size,
+        'total_chunks': -(-size // chunk_size),
+        'owner': request.api_key_type,
+        'created': datetime.now(),
+        'expiry': datetime.now() + timedelta(hours=UPLOAD_SESSION_HOURS)
+    }
+    # Taille annoncée retenue dès l'ouverture: les morceaux reçus ne comptent pas dans le budget
+    reserve_upload(session)
+    STORAGE.upload_sessions[upload_id] = session
+    log.info("[CHUNKS] Session %s: %s, %.2fMB en %d morceaux", upload_id, filename, size/1024/1024, session['total_chunks'])
+    return jsonify(upload_session_status(upload_id, session)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@require_api_key
+def get_upload_session(upload_id):
+    """Morceaux déjà reçus (pour reprendre après une coupure)"""
+    session = owned_upload_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Session d'upload inconnue ou expirée"}), 404
+    return jsonify(upload_session_status(upload_id, session))
+
+@app.route('/uploads/<upload_id>/chunks/<int:number>', methods=['PUT'])
+@require_api_key
+def put_upload_chunk(upload_id, number):
+    """Reçoit le morceau n (corps brut), vérifié avec l'en-tête X-Chunk-SHA256 s'il est fourni"""
+    session = owned_upload_session(upload_id)
+    if session is None:
+        return jsonify({"error": "Session d'upload inconnue ou expirée"}), 404
+    if not 1 <= number <= session['total_chunks']:
+        return jsonify({"error": f"Numéro de morceau entre 1 et {session['total_chunks']}"}), 400
+    expected_size = expected_chunk_size(session, number)
+    if request.content_length is not None and request.content_length != expected_size:
+        return jsonify({"error": "Taille de morceau invalide", "chunk": number,
+                        "expected_bytes": expected_size, "received_bytes": request.content_length}), 400
+    
+    chunk, error = receive_chunk(upload_id, session, number, request.stream, request.headers.get('X-Chunk-SHA256'))
+    if error:
+        return jsonify(error[0]), error[1]
+    return jsonify({"success": True, "upload_id": upload_id, "chunk": number,
+                    "size_bytes": chunk['size'], "sha256": chunk['sha256']})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+@require_api_key
+def complete_upload_session(upload_id):
+    """Assemble les morceaux et stocke le fichier exactement comme /upload"""
+    try:
+        # Retrait atomique: un seul finalize par session
+        session = owned_upload_session(upload_id) and STORAGE.upload_sessions.pop(upload_id, None)
+        if session is None:
+            return jsonify({"error": "Session d'upload inconnue, expirée ou déjà finalisée"}), 404
         
-        # Lire le fichier
-        file_content = file.read()
-        original_size = len(file_content)
+        assembled = session.pop('assembled', None)
+        if assembled is None:
+            missing = [n for n in range(1, session['total_chunks'] + 1)
+                       if _chunk_key(upload_id, n) not in STORAGE.upload_chunks]
+            if missing:
+                STORAGE.upload_sessions[upload_id] = session
+                return jsonify({"error": "Morceaux manquants", "missing_chunks": missing[:100],
+                                "missing_count": len(missing)}), 409
+            
+            try:
+                writer = assemble_chunks(upload_id, session)
+            except BaseException:
+                STORAGE.upload_sessions[upload_id] = session
+                raise
+            expected_sha256 = (request.get_json(silent=True) or {}).get('sha256')
+            if expected_sha256 and expected_sha256.lower() != writer.key:
+                STORAGE.release(writer.key)
+                STORAGE.upload_sessions[upload_id] = session
+                return jsonify({"error": "Somme SHA-256 du fichier invalide",
+                                "expected_sha256": expected_sha256, "sha256": writer.key}), 422
+            # Morceaux libérés avant l'indexation: ils ne pèsent plus sur le budget (enforce)
+            discard_chunks(upload_id, session)
+            assembled = {'blob': writer.key, 'size': writer.size, 'existed': writer.existed}
+        else:
+            STORAGE.add_usage({'chunk_bytes': -assembled['size']})
+        # Le fichier est compté pour sa taille réelle par finish_file_upload
+        release_reservation(session)
         
-        print(f"[UPLOAD] Fichier: {filename}, Taille: {original_size/1024/1024:.2f}MB, Image: {is_image}")
+        upload = {
+            'field': 'file',
+            'filename': session['filename'],
+            'content_type': session['content_type'],
+            'blob': assembled['blob'],
+            'size': assembled['size'],
+            'sha256': assembled['blob'],
+            'deduplicated': assembled['existed']
+        }
+        # Référence de réserve: store_upload libère le blob si la file de compression est pleine
+        STORAGE.acquire(assembled['blob'])
+        try:
+            file_info = finish_file_upload(upload, session['owner'])
+        except CompressionQueueFull:
+            # Fichier assemblé conservé (compté avec les morceaux): le client peut relancer la finalisation
+            session['assembled'] = assembled
+            reserve_upload(session)
+            STORAGE.upload_sessions[upload_id] = session
+            STORAGE.add_usage({'chunk_bytes': assembled['size']})
+            return compression_queue_full()
+        except BaseException:
+            STORAGE.release(assembled['blob'])
+            raise
+        STORAGE.release(assembled['blob'])
+        file_info["upload_id"] = upload_id
+        file_info["chunks"] = session['total_chunks']
+        return jsonify(file_info)
         
-        # Vérifier la taille selon le type
-        max_size = MAX_IMAGE_SIZE if is_image else MAX_FILE_SIZE
+    except Exception as e:
+        log.exception("[ERROR] Erreur finalisation upload %s: %s", upload_id, e)
+        return jsonify({"error": f"Erreur: {str(e)}"}), 500
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+@require_api_key
+def abort_upload_session(upload_id):
+    """Abandonne un upload fractionné et libère ses morceaux"""
+    session = owned_upload_session(upload_id) and STORAGE.upload_sessions.pop(upload_id, None)
+    if session is None:
+        return jsonify({"error": "Session d'upload inconnue ou expirée"}), 404
+    discard_chunks(upload_id, session)
+    return jsonify({"success": True, "upload_id": upload_id, "message": "Upload abandonné"})
+
+@app.route('/convert/images-to-pdf', methods=['POST'])
+@require_api_key
+def convert_images_to_pdf():
+    """Fusionne une ou plusieurs images (champs file/files) en un PDF multipage"""
+    try:
+        try:
+            uploads, form = receive_multipart_files(file_fields=('file', 'files'))
+        except UploadTooLarge as e:
+            return jsonify(e.to_dict()), e.status_code
         
-        if original_size > max_size:
-            return jsonify({
-                "error": "Fichier trop volumineux",
-                "file_size_mb": round(original_size / (1024 * 1024), 2),
-                "max_size_mb": round(max_size / (1024 * 1024), 2),
-                "file_type": "image" if is_image else "file"
-            }), 413
-        
-        # Compression automatique pour les images si activée
-        was_compressed = False
-        compression_info = {}
-        
-        if is_image and AUTO_COMPRESS_IMAGES and original_size > 5 * 1024 * 1024:  # > 5MB
-            print(f"[UPLOAD] Image volumineuse, tentative de compression...")
-            file_content, was_compressed = compress_image(
-                file_content, 
-                filename,
-                quality=85,
-                max_dimension=MAX_IMAGE_DIMENSION
-            )
+        try:
+            images = [upload for upload in uploads if upload['filename']]
+            if not images:
+                return jsonify({"error": "Aucune image fournie"}), 400
+            rejected = [u['filename'] for u in images if get_file_extension(u['filename']) not in IMAGE_FORMATS]
+            if rejected:
+                return jsonify({
+                    "error": "Format non supporté",
+                    "files": rejected,
+                    "allowed_formats": sorted(IMAGE_FORMATS)
+                }), 400
+            # L'extension ne suffit pas: un x.jpg vide ou en texte est refusé avant décodage
+            not_images = [u['filename'] for u in images if sniff_upload(u).get('extension') not in IMAGE_FORMATS]
+            if not_images:
+                return jsonify({
+                    "error": "Contenu non reconnu comme image",
+                    "files": not_images,
+                    "allowed_formats": sorted(IMAGE_FORMATS)
+                }), 400
+            try:
+                resolution = float(form.get('resolution', 72))
+            except ValueError:
+                return jsonify({"error": "resolution invalide"}), 400
             
-            if was_compressed:
-                new_size = len(file_content)
-                compression_info = {
-                    "compressed": True,
-                    "original_size_mb": round(original_size / (1024 * 1024), 2),
-                    "compressed_size_mb": round(new_size / (1024 * 1024), 2),
-                    "compression_ratio": round((1 - new_size / original_size) * 100, 1)
-                }
-                print(f"[UPLOAD] Compression reussie: {compression_info}")
-        
-        # Stocker le fichier
-        metadata = {'was_compressed': was_compressed}
-        if compression_info:
-            metadata['compression_info'] = compression_info
+            log.info("[PDF] Fusion de %d image(s) en PDF", len(images))
+            try:
+                with timed('pdf_assemble'):
+                    pdf_path, pages = run_blocking(images_to_pdf_file, images, resolution)
+            except (PdfConversionError, Image.DecompressionBombError) as e:
+                # Journalisé ici: images_to_pdf_file tourne sur un thread natif (run_blocking)
+                log.warning("[PDF] Image refusee: %s (%s)", e, e.__cause__ or '-')
+                return jsonify({"error": f"Image refusée: {e}"}), 400
+        finally:
+            for upload in uploads:
+                STORAGE.release(upload['blob'])
         
-        download_url = store_file(file_content, filename, file.content_type, metadata)
+        first_name = images[0]['filename']
+        output_name = form.get('filename') or f"{first_name.rsplit('.', 1)[0]}.pdf"
+        if get_file_extension(output_name) != 'pdf':
+            output_name += '.pdf'
+        blob, size = STORAGE.put_file(pdf_path)
+        download_url = register_file(blob, size, output_name, 'application/pdf', {
+            'pages': pages,
+            'converted_from': [image['filename'] for image in images]
+        })
         
-        # Infos de retour
-        file_info = {
+        return jsonify({
             "success": True,
-            "filename": sanitize_filename(filename),
-            "original_filename": filename,
+            "filename": sanitize_filename(output_name),
             "download_url": download_url,
             "file_id": download_url.split('/')[-1],
-            "format": file_ext or "unknown",
-            "size_bytes": len(file_content),
-            "size_mb": round(len(file_content) / (1024 * 1024), 2),
-            "content_type": file.content_type or mimetypes.guess_type(filename)[0],
-            "uploaded_at": datetime.now().isoformat(),
+            "pages": pages,
+            "size_bytes": size,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "content_type": "application/pdf",
             "expires_at": (datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)).isoformat(),
-            "expiry_hours": FILE_EXPIRY_HOURS,
             "api_key_used": request.api_key_type,
-            "is_image": is_image
-        }
+            "message": f"[OK] PDF de {pages} page(s) créé"
+        })
         
-        if was_compressed:
-            file_info["compression"] = compression_info
-            file_info["message"] = f"[OK] Image compressée et uploadée! Gain: {compression_info['compression_ratio']}%"
-        else:
-            file_info["message"] = f"[OK] Fichier uploadé! URL valide pendant {FILE_EXPIRY_HOURS}h"
+    except Exception as e:
+        log.exception("[ERROR] Erreur conversion PDF: %s", e)
+        return jsonify({"error": "Erreur interne pendant la conversion PDF"}), 500
+
+@app.route('/convert/pdf-to-images', methods=['POST'])
+@require_api_key
+def convert_pdf_to_images():
+    """Rend chaque page d'un PDF en PNG ou JPEG (un fichier par page)"""
+    if PDF_RASTER_BACKEND is None:
+        return jsonify({
+            "error": "Rendu PDF indisponible",
+            "message": "Installez pypdfium2, PyMuPDF ou poppler (pdftoppm)"
+        }), 501
+    try:
+        try:
+            uploads, form = receive_multipart_files()
+        except UploadTooLarge as e:
+            return jsonify(e.to_dict()), e.status_code
+        if not uploads:
+            return jsonify({"error": "Aucun fichier fourni"}), 400
         
-        return jsonify(file_info)
+        upload = uploads[0]
+        for extra in uploads[1:]:
+            STORAGE.release(extra['blob'])
+        try:
+            with STORAGE.open(upload['blob']) as f:
+                if not f.read(5) == b'%PDF-':
+                    return jsonify({"error": "Le fichier n'est pas un PDF"}), 400
+            
+            fmt = form.get('format', 'png').lower()
+            fmt = 'jpg' if fmt == 'jpeg' else fmt
+            if fmt not in ('png', 'jpg'):
+                return jsonify({"error": "format doit être png ou jpeg"}), 400
+            try:
+                dpi = int(form.get('dpi', PDF_DPI))
+                first_page = int(form.get('first_page', 1))
+                last_page = int(form['last_page']) if form.get('last_page') else None
+            except ValueError:
+                return jsonify({"error": "dpi, first_page et last_page doivent être des entiers"}), 400
+            if not 1 <= dpi <= PDF_MAX_DPI:
+                return jsonify({"error": f"dpi doit être entre 1 et {PDF_MAX_DPI}"}), 400
+            
+            with local_blob_path(upload['blob']) as pdf_path:
+                try:
+                    page_count = count_pdf_pages(pdf_path)
+                except Exception as e:
+                    log.warning("[PDF] PDF illisible %s: %s", upload['filename'], e)
+                    return jsonify({"error": "PDF illisible ou corrompu", "file": upload['filename']}), 400
+                last_page = min(last_page or page_count, page_count)
+                first_page = max(first_page, 1)
+                if first_page > last_page:
+                    return jsonify({"error": "Plage de pages vide", "page_count": page_count}), 400
+                if last_page - first_page + 1 > MAX_PDF_PAGES:
+                    return jsonify({
+                        "error": "Trop de pages",
+                        "page_count": page_count,
+                        "max_pages": MAX_PDF_PAGES
+                    }), 413
+                
+                log.info("[PDF] Rendu pages %d-%d/%d en %s à %d dpi (%s)", first_page, last_page, page_count, fmt, dpi, PDF_RASTER_BACKEND)
+                base_name = sanitize_filename(upload['filename'] or 'document').rsplit('.', 1)[0]
+                pages = rasterize_pdf(pdf_path, range(first_page, last_page + 1), fmt, dpi, base_name)
+        finally:
+            STORAGE.release(upload['blob'])
+        
+        failed = [page for page in pages if 'error' in page]
+        return jsonify({
+            "success": not failed,
+            "original_filename": upload['filename'],
+            "page_count": page_count,
+            "format": fmt,
+            "dpi": dpi,
+            "pages": pages,
+            "failed_pages": len(failed),
+            "expires_at": (datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)).isoformat(),
+            "api_key_used": request.api_key_type
+        })
         
     except Exception as e:
-        print(f"[ERROR] Erreur upload: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Erreur: {str(e)}"}), 500
+        log.exception("[ERROR] Erreur rendu PDF: %s", e)
+        return jsonify({"error": "Erreur interne pendant le rendu PDF"}), 500
 
 @app.route('/upload-from-url', methods=['POST'])
 @require_api_key
@@ -361,137 +4240,213 @@ def upload_from_url():
         if not file_url.startswith(('http://', 'https://')):
             return jsonify({"error": "URL invalide"}), 400
         
-        print(f"[URL] Telechargement: {file_url}")
-        
-        # Télécharger
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        response = requests.get(file_url, headers=headers, timeout=60, stream=True)
-        response.raise_for_status()
-        
-        # Nom du fichier
-        filename = 'download'
-        if 'content-disposition' in response.headers:
-            match = re.search(r'filename[^;=\n]*=([\'\"]?)([^\'\"\n]*)\1', response.headers['content-disposition'])
-            if match:
-                filename = match.group(2)
-        
-        if filename == 'download':
-            url_path = file_url.split('?')[0]
-            url_filename = url_path.split('/')[-1]
-            if url_filename and '.' in url_filename:
-                filename = url_filename
-        
-        if 'filename' in data and data['filename']:
-            filename = data['filename']
-        
-        # Lire le contenu
-        content = response.content
-        file_ext = get_file_extension(filename)
-        is_image = file_ext in IMAGE_FORMATS
-        max_size = MAX_IMAGE_SIZE if is_image else MAX_FILE_SIZE
-        
-        if len(content) > max_size:
-            return jsonify({
-                "error": "Fichier trop volumineux",
-                "file_size_mb": round(len(content) / (1024 * 1024), 2),
-                "max_size_mb": round(max_size / (1024 * 1024), 2)
-            }), 413
-        
-        content_type = response.headers.get('content-type', 'application/octet-stream')
-        
-        # Retour binaire direct si demandé
+        # Retour binaire direct si demandé: proxy du flux, mémoire constante
         if return_binary:
-            return Response(
-                content,
+            response, filename, content_type, declared_size = open_remote_file(file_url, data.get('filename'))
+            max_size = max_size_for(filename)
+            if declared_size is not None and declared_size > max_size:
+                FETCHER.close(response)
+                is_image = get_file_extension(filename) in IMAGE_FORMATS
+                return jsonify(UploadTooLarge(declared_size, max_size, is_image).to_dict()), 413
+            
+            headers = {'Content-Disposition': f'attachment; filename="{sanitize_filename(filename)}"'}
+            # iter_content décode gzip/deflate: la taille annoncée ne vaut que sans Content-Encoding
+            if declared_size is not None and not response.headers.get('content-encoding'):
+                headers['Content-Length'] = str(declared_size)
+            proxied = Response(
+                proxy_remote_stream(response, max_size, file_url),
                 mimetype=content_type,
-                headers={
-                    'Content-Disposition': f'attachment; filename="{sanitize_filename(filename)}"',
-                    'Content-Length': str(len(content))
-                }
+                headers=headers
             )
+            # Créneau de l'hôte et connexion rendus à la fermeture de la réponse (FETCHER.close est idempotent)
+            proxied.call_on_close(lambda: FETCHER.close(response))
+            return proxied
         
-        # Compression auto si image volumineuse
-        was_compressed = False
-        compression_info = {}
-        original_size = len(content)
-        
-        if is_image and AUTO_COMPRESS_IMAGES and original_size > 5 * 1024 * 1024:
-            content, was_compressed = compress_image(content, filename, max_dimension=MAX_IMAGE_DIMENSION)
-            if was_compressed:
-                compression_info = {
-                    "compressed": True,
-                    "original_size_mb": round(original_size / (1024 * 1024), 2),
-                    "compressed_size_mb": round(len(content) / (1024 * 1024), 2),
-                    "compression_ratio": round((1 - len(content) / original_size) * 100, 1)
-                }
-        
-        # Stocker
-        metadata = {'was_compressed': was_compressed}
-        if compression_info:
-            metadata['compression_info'] = compression_info
-        
-        download_url = store_file(content, filename, content_type, metadata)
-        
-        result = {
-            "success": True,
-            "source_url": file_url,
-            "filename": sanitize_filename(filename),
-            "download_url": download_url,
-            "file_id": download_url.split('/')[-1],
-            "format": file_ext or "unknown",
-            "size_bytes": len(content),
-            "size_mb": round(len(content) / (1024 * 1024), 2),
-            "content_type": content_type,
-            "uploaded_at": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(hours=FILE_EXPIRY_HOURS)).isoformat()
-        }
-        
-        if was_compressed:
-            result["compression"] = compression_info
-        
-        return jsonify(result)
+        result, status_code = ingest_url(file_url, data.get('filename'), request.api_key_type)
+        return jsonify(result), status_code
         
     except Exception as e:
-        print(f"[ERROR] upload-from-url: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("[ERROR] upload-from-url: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload-from-urls', methods=['POST'])
+@require_api_key
+def upload_from_urls():
+    """Télécharge une liste d'URLs en parallèle (connexions réutilisées par hôte)"""
+    data = request.get_json(silent=True) or {}
+    items = data.get('urls')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Liste d'URLs manquante", "example": {"urls": ["https://...", {"url": "https://...", "filename": "doc.pdf"}]}}), 400
+    
+    if len(items) > FETCH_BATCH_MAX_URLS:
+        return jsonify({"error": f"Maximum {FETCH_BATCH_MAX_URLS} URLs par requête"}), 400
+    
+    futures = []
+    for item in items:
+        if isinstance(item, dict):
+            file_url, filename = item.get('url'), item.get('filename')
+        else:
+            file_url, filename = item, None
+        
+        if not isinstance(file_url, str) or not file_url.startswith(('http://', 'https://')):
+            futures.append(({"success": False, "source_url": file_url, "error": "URL invalide"}, 400))
+        else:
+            futures.append(FETCH_EXECUTOR.submit(_ingest_url_safe, file_url, filename, request.api_key_type))
+    
+    files = []
+    for future in futures:
+        result, status_code = future if isinstance(future, tuple) else future.result()
+        result.setdefault("success", status_code == 200)
+        result["status_code"] = status_code
+        files.append(result)
+    
+    succeeded = sum(1 for result in files if result["success"])
+    log.info("[URL] Lot termine: %d/%d fichiers", succeeded, len(files))
+    
+    return jsonify({
+        "success": succeeded == len(files),
+        "count": len(files),
+        "succeeded": succeeded,
+        "failed": len(files) - succeeded,
+        "file_ids": [result["file_id"] for result in files if result["success"]],
+        "files": files
+    })
+
 @app.route('/download/<file_id>')
 def download(file_id):
-    """Télécharge un fichier stocké"""
-    cleanup_old_files()
+    """Télécharge un fichier stocké, ou une variante (?width=&height=&fit=&format=&quality=)"""
+    try:
+        transform = parse_transform(request.args)
+    except VariantError as e:
+        return jsonify({"error": str(e)}), e.status_code
     
-    if file_id not in TEMP_STORAGE:
+    file_data = TEMP_STORAGE.get(file_id)
+    if file_data is None:
         return jsonify({"error": "Fichier non trouvé ou expiré"}), 404
     
-    file_data = TEMP_STORAGE[file_id]
-    
     if datetime.now() > file_data['expiry']:
-        del TEMP_STORAGE[file_id]
+        delete_file(file_id)
         return jsonify({"error": "Fichier expiré"}), 404
     
-    content = base64.b64decode(file_data['content'])
+    STORAGE_BUDGET.touch(file_id)
+    if transform is None:
+        return serve_stored_file(file_data)
+    
+    if get_file_extension(file_data['filename']) not in IMAGE_FORMATS:
+        return jsonify({"error": "Transformation réservée aux images",
+                        "allowed_formats": sorted(IMAGE_FORMATS)}), 400
+    try:
+        variant = VARIANT_CACHE.get(file_data, transform)
+    except VariantError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    return serve_stored_file(variant_file_data(file_data, variant))
+
+@app.route('/bundle', methods=['GET', 'POST'])
+@require_api_key
+def bundle():
+    """Archive ZIP en flux de plusieurs fichiers: ?ids=a,b,c ou JSON {"ids": [...]}
+    
+    Seuls les fichiers de la clé appelante (tous pour la clé primary) sont servis.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form.to_dict()
+        ids = data.get('ids') or []
+    else:
+        ids = request.args.get('ids', '')
+    if isinstance(ids, str):
+        ids = [file_id.strip() for file_id in ids.split(',') if file_id.strip()]
+    if not isinstance(ids, list) or not ids or not all(isinstance(file_id, str) for file_id in ids):
+        return jsonify({"error": "Liste d'identifiants manquante", "example": "/bundle?ids=<id1>,<id2>"}), 400
+    if len(ids) > BUNDLE_MAX_FILES:
+        return jsonify({"error": f"Maximum {BUNDLE_MAX_FILES} fichiers par archive"}), 400
+    
+    # Une référence par blob avant le premier octet: ni l'expiration ni le
+    # budget ne peuvent tronquer l'archive en cours d'envoi
+    files, missing = [], []
+    now = datetime.now()
+    owner = listing_owner()
+    for file_id in dict.fromkeys(ids):
+        file_data = TEMP_STORAGE.get(file_id) if FILE_ID_RE.match(file_id) else None
+        if (file_data is None or now > file_data['expiry'] or (owner is not None and file_data.get('owner') != owner)
+                or not STORAGE.acquire(file_data['blob'])):
+            missing.append(file_id)
+        else:
+            STORAGE_BUDGET.touch(file_id)
+            files.append(file_data)
+    
+    def release_blobs():
+        for file_data in files:
+            STORAGE.release(file_data['blob'])
+    
+    if missing:
+        release_blobs()
+        return jsonify({"error": "Fichier(s) non trouvé(s) ou expiré(s)", "missing": missing}), 404
     
     response = Response(
-        content,
-        mimetype=file_data['content_type'],
-        headers={
-            'Content-Disposition': f'attachment; filename="{file_data["filename"]}"',
-            'Content-Length': str(len(content)),
-            'Cache-Control': 'public, max-age=3600'
-        }
+        iter_zip(files),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="bundle-{now.strftime("%Y%m%d-%H%M%S")}.zip"'}
     )
-    
+    response.call_on_close(release_blobs)
     return response
 
+@app.route('/files')
+@require_api_key
+def list_files():
+    """Liste paginée des fichiers (?sort=created|expiry&order=asc|desc&limit=&cursor=)
+    
+    La clé primary voit tous les fichiers, les autres clés seulement les leurs.
+    """
+    sort = request.args.get('sort', 'created')
+    if sort not in FileListing.SORTS:
+        return jsonify({"error": "sort invalide", "allowed": list(FileListing.SORTS)}), 400
+    order = request.args.get('order', 'desc' if sort == 'created' else 'asc')
+    if order not in ('asc', 'desc'):
+        return jsonify({"error": "order invalide", "allowed": ['asc', 'desc']}), 400
+    limit = request.args.get('limit', str(FILES_PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= FILES_PAGE_MAX:
+        return jsonify({"error": f"limit doit être compris entre 1 et {FILES_PAGE_MAX}"}), 400
+    
+    try:
+        files, next_cursor = list_files_page(sort, int(limit), request.args.get('cursor'), order == 'desc', listing_owner())
+    except ValueError:
+        return jsonify({"error": "Curseur invalide"}), 400
+    return jsonify({
+        "sort": sort,
+        "order": order,
+        "files": files,
+        "next_cursor": next_cursor
+    })
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Avancement d'un job de compression"""
+    record = COMPRESSION_JOBS.status(job_id)
+    if record is None:
+        return jsonify({"error": "Job non trouvé"}), 404
+    
+    info = {
+        "job_id": record['id'],
+        "file_id": record['file_id'],
+        "filename": record['filename'],
+        "status": record['status'],
+        "progress": record['progress'],
+        "created": record['created'].isoformat(),
+        "updated": record['updated'].isoformat(),
+        "download_url": f"{BASE_URL}/download/{record['file_id']}"
+    }
+    if record.get('compression_info'):
+        info["compression_info"] = record['compression_info']
+    if record.get('error'):
+        info["error"] = record['error']
+    return jsonify(info)
+
 @app.route('/info/<file_id>')
 def file_info(file_id):
     """Retourne les infos sur un fichier"""
-    if file_id not in TEMP_STORAGE:
+    file_data = TEMP_STORAGE.get(file_id)
+    if file_data is None or datetime.now() > file_data['expiry']:
         return jsonify({"error": "Fichier non trouvé"}), 404
-    
-    file_data = TEMP_STORAGE[file_id]
     time_left = file_data['expiry'] - datetime.now()
     
     info = {
@@ -509,42 +4464,68 @@ def file_info(file_id):
     if file_data.get('was_compressed'):
         info["was_compressed"] = True
         info["compression_info"] = file_data.get('compression_info', {})
+    if file_data.get('compression_status'):
+        info["compression_status"] = file_data['compression_status']
+        info["compression_job"] = file_data.get('compression_job')
+    if file_data.get('detected'):
+        info["detected"] = file_data['detected']
+    if file_data.get('encoding'):
+        info["stored_encoding"] = file_data['encoding']
+        info["stored_size_bytes"] = file_data['stored_size']
     
     return jsonify(info)
 
 @app.route('/status')
 def status():
-    """Statut du service"""
-    cleanup_old_files()
-    
-    total_size = sum(data['size'] for data in TEMP_STORAGE.values())
-    
-    files_list = []
-    for file_id, data in list(TEMP_STORAGE.items())[:20]:
-        time_left = data['expiry'] - datetime.now()
-        files_list.append({
-            "id": file_id,
-            "filename": data['filename'],
-            "size_mb": round(data['size'] / (1024 * 1024), 2),
-            "type": data['content_type'],
-            "compressed": data.get('was_compressed', False),
-            "expires_in_hours": max(0, time_left.total_seconds() / 3600)
-        })
+    """Statut du service (compteurs agrégés + 20 fichiers les plus récents, sans parcours de l'index)"""
+    # Taille logique (somme des fichiers) vs physique (blobs uniques, variantes comprises)
+    usage = STORAGE.usage()
+    total_size = usage.get('file_bytes', 0)
+    stored_size = usage.get('stored_bytes', 0)
+    # Déduplication: octets stockés par fichier (après compression) vs blobs uniques
+    # des fichiers, hors variantes et morceaux en attente; la compression est comptée à part
+    file_blob_bytes = stored_size - usage.get('variant_bytes', 0) - usage.get('chunk_bytes', 0)
+    file_stored_bytes = usage.get('file_stored_bytes', 0)
+    files_list, next_cursor = list_files_page('created', 20)
+    by_type = {name[5:]: round(size / (1024 * 1024), 2)
+               for name, size in sorted(usage.items()) if name.startswith('type:') and size}
     
     return jsonify({
         "status": "operational",
         "version": "2.0",
         "storage": {
-            "files_count": len(TEMP_STORAGE),
+            "backend": STORAGE.name,
+            "files_count": usage.get('files', 0),
             "total_size_mb": round(total_size / (1024 * 1024), 2),
-            "files": files_list
+            "stored_size_mb": round(stored_size / (1024 * 1024), 2),
+            "unique_blobs": usage.get('blobs', 0),
+            "dedup_ratio": round(file_stored_bytes / file_blob_bytes, 2) if file_blob_bytes > 0 else 1.0,
+            "compressed_files": usage.get('compressed_files', 0),
+            "bytes_saved_mb": round(usage.get('bytes_saved', 0) / (1024 * 1024), 2),
+            "encoded_files": usage.get('encoded_files', 0),
+            "encoded_bytes_saved_mb": round(usage.get('encoded_bytes_saved', 0) / (1024 * 1024), 2),
+            "at_rest_codec": AT_REST_CODEC if AT_REST_COMPRESSION else None,
+            "size_mb_by_content_type": by_type,
+            "files": files_list,
+            "files_next_cursor": next_cursor
         },
         "limits": {
             "max_file_size_mb": MAX_FILE_SIZE / (1024 * 1024),
             "max_image_size_mb": MAX_IMAGE_SIZE / (1024 * 1024),
             "max_image_dimension": MAX_IMAGE_DIMENSION,
+            "compress_max_dimension": COMPRESS_MAX_DIMENSION,
             "auto_compress": AUTO_COMPRESS_IMAGES
         },
+        "expiry": EXPIRY_INDEX.metrics(),
+        "budget": STORAGE_BUDGET.metrics(),
+        "api_keys": API_KEYS.metrics(),
+        "variants": VARIANT_CACHE.metrics(),
+        "compression_queue": {
+            "async": ASYNC_COMPRESSION,
+            "workers": COMPRESSION_JOBS.workers,
+            "depth": COMPRESSION_JOBS.depth(),
+            "max_depth": COMPRESSION_JOBS.queue_size
+        },
         "timestamp": datetime.now().isoformat()
     })
 
@@ -565,10 +4546,13 @@ if __name__ == '__main__':
     print(f"[OK] Port: {port}")
     print(f"[OK] Taille max fichiers: {MAX_FILE_SIZE/(1024*1024)} MB")
     print(f"[OK] Taille max images: {MAX_IMAGE_SIZE/(1024*1024)} MB")
-    print(f"[OK] Dimension max images: {MAX_IMAGE_DIMENSION}px")
+    print(f"[OK] Dimension max images: {MAX_IMAGE_DIMENSION}px (réduites à {COMPRESS_MAX_DIMENSION}px)")
     print(f"[OK] Compression auto: {'OUI' if AUTO_COMPRESS_IMAGES else 'NON'}")
     print(f"[OK] Expiration: {FILE_EXPIRY_HOURS} heures")
     print(f"[OK] URL de base: {BASE_URL}")
+    print(f"[OK] Stockage: {STORAGE.name}" + (f" ({STORAGE_DIR})" if STORAGE.name == 'disk' else ''))
+    print(f"[OK] Budget stockage: {STORAGE_BUDGET_MB or 'illimite'} MB (quotas {PRIMARY_QUOTA_MB}/{SECONDARY_QUOTA_MB} MB)")
+    print(f"[OK] Rendu PDF: {PDF_RASTER_BACKEND or 'indisponible'}")
     print("="*60)
     print("[KEY] CLES API:")
     print(f"   Primary: {PRIMARY_API_KEY[:30]}...{PRIMARY_API_KEY[-3:]}")
@@ -0,0 +1,85 @@
+"""Configuration commune: serveur importé une fois sur un stockage disque temporaire
+
+L'environnement est fixé avant l'import de server (les réglages sont lus au
+chargement du module). Chaque test repart d'un stockage vide. La compression
+d'images est synchrone par défaut: test_jobs.py active ASYNC_COMPRESSION.
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='pdf-converter-tests-')
+LIMITED_API_KEY = 'test_limited_key'
+
+with open(os.path.join(WORKDIR, 'api_keys.json'), 'w', encoding='utf-8') as f:
+    json.dump({'limited': {'key': LIMITED_API_KEY, 'quota_mb': 1, 'rate_per_minute': 60, 'burst': 3}}, f)
+
+os.environ.update({
+    'STORAGE_DIR': os.path.join(WORKDIR, 'storage'),
+    'STORAGE_BACKEND': 'disk',
+    'METADATA_INDEX': 'sqlite',
+    'API_KEYS_FILE': os.path.join(WORKDIR, 'api_keys.json'),
+    'LOG_LEVEL': 'OFF',
+    'RATE_LIMIT_PER_MINUTE': '0',
+    'MAX_CONCURRENT_UPLOADS': '0',
+    'STORAGE_BUDGET_MB': '0',
+    'ASYNC_COMPRESSION': 'false',
+    'AT_REST_CODEC': 'gzip',
+})
+sys.path.insert(0, ROOT)
+
+import server as server_module  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    return server_module
+
+
+@pytest.fixture
+def client():
+    return server_module.app.test_client()
+
+
+@pytest.fixture
+def primary():
+    return {'X-API-Key': server_module.PRIMARY_API_KEY}
+
+
+@pytest.fixture
+def secondary():
+    return {'X-API-Key': server_module.SECONDARY_API_KEY}
+
+
+@pytest.fixture
+def limited():
+    return {'X-API-Key': LIMITED_API_KEY}
+
+
+@pytest.fixture
+def upload(client, primary):
+    """upload(contenu, nom, headers=primary) -> réponse JSON de /upload (code vérifié)"""
+    def _upload(content, filename, headers=None, status=200):
+        response = client.post('/upload', data={'file': (io.BytesIO(content), filename)},
+                               headers=headers or primary, content_type='multipart/form-data')
+        assert response.status_code == status, response.get_json()
+        return response.get_json()
+    return _upload
+
+
+@pytest.fixture(autouse=True)
+def clean_storage():
+    yield
+    storage = server_module.STORAGE
+    for file_id in list(server_module.TEMP_STORAGE):
+        server_module.delete_file(file_id)
+    for upload_id, session in list(storage.upload_sessions.items()):
+        if storage.upload_sessions.pop(upload_id, None):
+            server_module.discard_chunks(upload_id, session)
+    with server_module.API_KEYS._lock:
+        server_module.API_KEYS._buckets.clear()
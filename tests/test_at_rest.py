@@ -0,0 +1,73 @@
+"""Compression au repos: encodage, Content-Encoding, déduplication et Range sur le contenu d'origine"""
+import gzip
+import os
+
+
+def csv_content(rows=20000):
+    return "".join(f"ligne,{i},valeur de test\n" for i in range(rows)).encode()
+
+
+def test_compressible_file_round_trips_at_rest(server, client, upload):
+    content = csv_content()
+    info = upload(content, 'data.csv')
+    stored = server.TEMP_STORAGE[info['file_id']]
+
+    assert stored['encoding'] == 'gzip'
+    assert stored['stored_size'] < len(content) // 2
+    assert info['size_bytes'] == len(content)
+
+    identity = client.get(f"/download/{info['file_id']}", headers={'Accept-Encoding': ''})
+    assert identity.headers.get('Content-Encoding') is None
+    assert identity.data == content
+
+    encoded = client.get(f"/download/{info['file_id']}", headers={'Accept-Encoding': 'gzip'})
+    assert encoded.headers['Content-Encoding'] == 'gzip'
+    assert encoded.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(encoded.data) == content
+
+
+def test_incompressible_file_is_stored_as_is(server, upload):
+    info = upload(os.urandom(50000), 'random.txt')
+    assert 'encoding' not in server.TEMP_STORAGE[info['file_id']]
+
+
+def test_dedup_survives_at_rest_encoding(server, upload):
+    content = csv_content()
+    first = upload(content, 'a.csv')
+    second = upload(content, 'b.csv')
+    url = server.store_file(content, 'c.csv')
+
+    blobs = {server.TEMP_STORAGE[file_id]['blob'] for file_id in (first['file_id'], second['file_id'], url.split('/')[-1])}
+    assert second['deduplicated'] is True
+    assert len(blobs) == 1
+    assert server.STORAGE.usage()['blobs'] == 1
+
+
+def test_status_separates_dedup_from_compression(client, upload):
+    content = csv_content()
+    upload(content, 'a.csv')
+    storage = client.get('/status').get_json()['storage']
+    assert storage['dedup_ratio'] == 1.0
+    assert storage['encoded_bytes_saved_mb'] > 0
+
+    upload(content, 'b.csv')
+    assert client.get('/status').get_json()['storage']['dedup_ratio'] == 2.0
+
+
+def test_range_on_file_compressed_at_rest_uses_original_bytes(client, upload):
+    content = csv_content(30000)
+    file_id = upload(content, 'data.csv')['file_id']
+    full = client.get(f'/download/{file_id}', headers={'Accept-Encoding': 'gzip'})
+    assert full.headers['Content-Encoding'] == 'gzip'
+
+    for accept in ('', 'gzip'):
+        response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=200000-200099', 'Accept-Encoding': accept})
+        assert response.status_code == 206
+        assert response.headers.get('Content-Encoding') is None
+        assert response.headers['Content-Range'] == f'bytes 200000-200099/{len(content)}'
+        assert response.data == content[200000:200100]
+
+    # Reprise après un premier téléchargement compressé: If-Range avec l'ETag de cette version
+    resumed = client.get(f'/download/{file_id}', headers={'Range': 'bytes=100-', 'If-Range': full.headers['ETag']})
+    assert resumed.status_code == 206
+    assert resumed.data == content[100:]
@@ -0,0 +1,60 @@
+"""Clés API: authentification, rechargement, débit et limites par clé"""
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+
+@pytest.mark.parametrize('method, path', [
+    ('post', '/upload'),
+    ('get', '/files'),
+    ('get', '/bundle?ids=x'),
+    ('post', '/uploads'),
+    ('post', '/convert/images-to-pdf'),
+])
+def test_routes_require_a_key(client, method, path):
+    assert getattr(client, method)(path).status_code == 401
+    assert getattr(client, method)(path, headers={'X-API-Key': 'wrong'}).status_code == 401
+
+
+def test_key_accepted_as_query_parameter(server, client):
+    response = client.get(f'/files?api_key={server.PRIMARY_API_KEY}')
+    assert response.status_code == 200
+
+
+def test_keys_file_applies_rate_limit(client, limited):
+    statuses = [client.get('/files', headers=limited).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    response = client.get('/files', headers=limited)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['api_key'] == 'limited'
+
+
+def test_concurrent_upload_limit(server, client, primary, monkeypatch):
+    settings = dict(server.API_KEYS.lookup(server.PRIMARY_API_KEY), max_concurrent_uploads=1)
+    assert server.API_KEYS.begin_upload(settings)
+    try:
+        monkeypatch.setattr(server.API_KEYS, 'lookup', lambda api_key: settings)
+        response = client.post('/upload', data={}, headers=primary)
+        assert response.status_code == 429
+    finally:
+        server.API_KEYS.end_upload(settings)
+
+
+def test_keys_file_is_reloaded_when_it_changes(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'API_KEYS_RELOAD_SECONDS', 0)
+    monkeypatch.setattr(server.STORAGE_BUDGET, 'quotas', dict(server.STORAGE_BUDGET.quotas))
+    path = tmp_path / 'keys.json'
+    path.write_text(json.dumps({'team': {'sha256': hashlib.sha256(b'first-key').hexdigest(), 'quota_mb': 2}}))
+    store = server.ApiKeyStore(str(path))
+    assert store.lookup('first-key')['name'] == 'team'
+    assert store.lookup(server.PRIMARY_API_KEY)['name'] == 'primary'
+
+    path.write_text(json.dumps({'team': {'key': 'second-key'}}))
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert store.lookup('first-key') is None
+    assert store.lookup('second-key')['name'] == 'team'
@@ -0,0 +1,30 @@
+"""Budget global (éviction LRU) et quotas par clé API"""
+import os
+
+
+def test_budget_evicts_least_recently_downloaded(server, client, upload, monkeypatch):
+    monkeypatch.setattr(server.STORAGE_BUDGET, 'budget_bytes', 250000)
+    old = upload(os.urandom(100000), 'old.bin')
+    recent = upload(os.urandom(100000), 'recent.bin')
+    assert client.get(f"/download/{old['file_id']}").status_code == 200
+
+    newest = upload(os.urandom(100000), 'newest.bin')
+
+    assert client.get(f"/download/{recent['file_id']}").status_code == 404
+    assert client.get(f"/download/{old['file_id']}").status_code == 200
+    assert client.get(f"/download/{newest['file_id']}").status_code == 200
+    assert server.STORAGE.usage()['stored_bytes'] <= 250000
+
+
+def test_quota_rejects_upload_before_reading_body(client, limited, upload):
+    response = upload(os.urandom(2 * 1024 * 1024), 'big.bin', headers=limited, status=507)
+    assert response['api_key'] == 'limited'
+
+
+def test_quota_counts_stored_files(server, client, limited, upload):
+    upload(os.urandom(600 * 1024), 'a.bin', headers=limited)
+    assert server.STORAGE_BUDGET.used_by('limited') == 600 * 1024
+
+    response = client.post('/uploads', json={'filename': 'b.bin', 'size': 600 * 1024}, headers=limited)
+    assert response.status_code == 507
+    assert int(client.get('/files', headers=limited).headers['X-Quota-Remaining']) == 1024 * 1024 - 600 * 1024
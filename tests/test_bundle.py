@@ -0,0 +1,50 @@
+"""Archives ZIP en flux (/bundle): contenu, références des blobs, fichiers manquants"""
+import io
+import os
+import zipfile
+
+
+def test_bundle_streams_zip(client, primary, upload):
+    text = b'hello world ' * 1000
+    first = upload(text, 'a.txt')['file_id']
+    second = upload(text + b'!', 'a.txt')['file_id']
+    with client.get(f'/bundle?ids={first},{second}', headers=primary) as response:
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    assert archive.namelist() == ['a.txt', 'a (2).txt']
+    assert archive.read('a.txt') == text
+    assert archive.getinfo('a.txt').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_bundle_keeps_blobs_until_sent(server, client, primary, upload):
+    content = os.urandom(300000)
+    file_id = upload(content, 'a.bin')['file_id']
+    response = client.get(f'/bundle?ids={file_id}', headers=primary, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+
+    server.delete_file(file_id)
+    data = first + b''.join(chunks)
+    response.close()
+
+    assert zipfile.ZipFile(io.BytesIO(data)).read('a.bin') == content
+    assert server.STORAGE.usage()['blobs'] == 0
+
+
+def test_bundle_reports_missing_files(client, primary, upload):
+    file_id = upload(b'x' * 100, 'a.txt')['file_id']
+    response = client.get(f'/bundle?ids={file_id},nope', headers=primary)
+    assert response.status_code == 404
+    assert response.get_json()['missing'] == ['nope']
+
+
+def test_bundle_only_serves_own_files(client, primary, secondary, upload):
+    mine = upload(b'secondary file', 's.txt', headers=secondary)['file_id']
+    other = upload(b'primary file', 'p.txt')['file_id']
+
+    response = client.get(f'/bundle?ids={mine},{other}', headers=secondary)
+    assert response.status_code == 404
+    assert response.get_json()['missing'] == [other]
+    with client.get(f'/bundle?ids={mine},{other}', headers=primary) as response:
+        assert response.status_code == 200
@@ -0,0 +1,76 @@
+"""Déduplication par contenu: blob partagé, compteurs et index des empreintes"""
+import hashlib
+import io
+import os
+
+from PIL import Image
+
+
+def csv_content(rows=20000):
+    return "".join(f"ligne,{i},valeur de test\n" for i in range(rows)).encode()
+
+
+def test_same_content_is_stored_once(server, upload):
+    content = os.urandom(200000)
+    first = upload(content, 'a.bin')
+    second = upload(content, 'b.bin')
+
+    assert first['deduplicated'] is False
+    assert second['deduplicated'] is True
+    index = server.TEMP_STORAGE
+    assert index[first['file_id']]['blob'] == index[second['file_id']]['blob']
+    usage = server.STORAGE.usage()
+    assert usage['blobs'] == 1
+    assert usage['stored_bytes'] == len(content)
+
+
+def test_delete_releases_blob_and_counters(server, upload):
+    first = upload(os.urandom(5000), 'a.bin')
+    second = upload(os.urandom(5000), 'b.bin')
+    server.delete_file(first['file_id'])
+    server.delete_file(second['file_id'])
+
+    usage = server.STORAGE.usage()
+    assert usage['blobs'] == 0
+    assert usage['stored_bytes'] == 0
+    assert usage['files'] == 0
+
+
+def test_image_compression_is_reused_for_same_content(server, upload, monkeypatch):
+    monkeypatch.setattr(server, 'ASYNC_COMPRESSION', False)
+    buffer = io.BytesIO()
+    Image.effect_noise((1800, 1800), 40).convert('RGB').save(buffer, 'BMP')
+    content = buffer.getvalue()
+    assert len(content) > 5 * 1024 * 1024
+
+    first = upload(content, 'photo.bmp')
+    second = upload(content, 'copy.bmp')
+
+    assert first['compression']['compressed'] is True
+    assert second['deduplicated'] is True
+    assert second['compression'] == first['compression']
+    assert second['size_bytes'] == first['size_bytes'] < len(content)
+
+
+def test_sources_entry_is_dropped_with_its_encoded_blob(server, upload):
+    content = csv_content()
+    info = upload(content, 'a.csv')
+    blob = server.TEMP_STORAGE[info['file_id']]['blob']
+    source_hash = hashlib.sha256(content).hexdigest()
+    assert blob != source_hash
+    assert server.STORAGE.sources[source_hash]['blob'] == blob
+
+    server.delete_file(info['file_id'])
+    assert source_hash not in server.STORAGE.sources
+    assert blob not in server.STORAGE.blob_sources
+
+
+def test_memory_storage_drops_sources_of_released_blob(server):
+    storage = server.MemoryStorage()
+    blob = storage.put(b'encoded')
+    storage.remember_source('a' * 64, {'blob': blob, 'size': 7, 'compression_info': {}})
+    storage.remember_source('b' * 64, {'blob': blob, 'size': 7, 'compression_info': {}})
+
+    storage.release(blob)
+    assert storage.sources == {}
+    assert storage.blob_sources == {}
@@ -0,0 +1,59 @@
+"""Téléchargement: Range, ETag et requêtes conditionnelles sur /download"""
+import os
+
+
+def test_download_serves_etag_and_conditional_requests(client, upload):
+    content = os.urandom(100000)
+    info = upload(content, 'a.bin')
+    response = client.get(f"/download/{info['file_id']}")
+
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+    assert client.get(f"/download/{info['file_id']}", headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f"/download/{info['file_id']}", headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_single_and_suffix_ranges(client, upload):
+    content = os.urandom(100000)
+    file_id = upload(content, 'a.bin')['file_id']
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 10-19/100000'
+    assert response.data == content[10:20]
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=-100'})
+    assert response.status_code == 206
+    assert response.data == content[-100:]
+
+
+def test_multiple_ranges_use_multipart(client, upload):
+    content = os.urandom(100000)
+    file_id = upload(content, 'a.bin')['file_id']
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-4,1000-1009'})
+
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert len(response.data) == int(response.headers['Content-Length'])
+    assert content[0:5] in response.data and content[1000:1010] in response.data
+
+
+def test_unsatisfiable_range_and_if_range(client, upload):
+    content = os.urandom(1000)
+    file_id = upload(content, 'a.bin')['file_id']
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=5000-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */1000'
+
+    etag = client.get(f'/download/{file_id}').headers['ETag']
+    assert client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': etag}).status_code == 206
+    stale = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == content
+
+
+def test_unknown_file_is_404(client):
+    assert client.get('/download/does-not-exist').status_code == 404
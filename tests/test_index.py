@@ -0,0 +1,21 @@
+"""Index SQLite des métadonnées: reprise des entrées JSON d'une version précédente"""
+
+
+def test_sqlite_index_imports_legacy_json_entries(server, tmp_path):
+    legacy_dir = tmp_path / 'index'
+    legacy = server.DiskIndex(str(legacy_dir))
+    created = server.datetime(2024, 1, 2, 3, 4, 5)
+    legacy['file-1'] = {'filename': 'a.txt', 'created': created, 'expiry': created + server.timedelta(hours=1),
+                        'owner': 'secondary', 'size': 3}
+    legacy['file-2'] = {'filename': 'b.txt', 'size': 4}
+
+    index = server.SqliteIndex(str(tmp_path / 'index.db'), 'index')
+    assert index.import_json(str(legacy_dir)) == 2
+
+    assert not legacy_dir.exists()
+    assert len(index) == 2
+    assert index['file-1']['created'] == created
+    assert index['file-2'] == {'filename': 'b.txt', 'size': 4}
+    assert list(index.timeline()) == [('file-1', created, created + server.timedelta(hours=1), 'secondary')]
+    assert index.pop('file-2')['filename'] == 'b.txt'
+    assert 'file-2' not in index
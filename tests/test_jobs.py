@@ -0,0 +1,89 @@
+"""Compression en arrière-plan: cycle de vie des jobs (/jobs) et back-pressure (429)"""
+import io
+import time
+
+import pytest
+from PIL import Image
+
+CHUNK = 4 * 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def async_compression(server, monkeypatch):
+    monkeypatch.setattr(server, 'ASYNC_COMPRESSION', True)
+
+
+@pytest.fixture(scope='module')
+def large_image():
+    """BMP de plus de 5MB: au-delà du seuil de compression automatique"""
+    buffer = io.BytesIO()
+    Image.effect_noise((1800, 1800), 40).convert('RGB').save(buffer, 'BMP')
+    assert len(buffer.getvalue()) > 5 * 1024 * 1024
+    return buffer.getvalue()
+
+
+def wait_for_job(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.1)
+
+
+def test_job_goes_from_pending_to_done(server, client, upload, large_image):
+    info = upload(large_image, 'photo.bmp')
+    assert info['compression']['status'] == 'pending'
+    job_id = info['compression']['job_id']
+    assert server.TEMP_STORAGE[info['file_id']]['compression_status'] == 'pending'
+
+    job = client.get(f'/jobs/{job_id}').get_json()
+    assert job['file_id'] == info['file_id']
+    assert job['status'] in ('queued', 'running', 'done')
+
+    job = wait_for_job(client, job_id)
+    assert job['status'] == 'done', job
+    assert job['progress'] == 100
+    assert job['compression_info']['compressed'] is True
+
+    stored = server.TEMP_STORAGE[info['file_id']]
+    assert stored['compression_status'] == 'done'
+    assert stored['size'] < len(large_image)
+    assert stored['content_type'] == job['compression_info']['content_type']
+    assert len(client.get(f"/download/{info['file_id']}").data) == stored['size']
+
+
+def test_unknown_job_is_404(client):
+    assert client.get('/jobs/does-not-exist').status_code == 404
+
+
+def test_full_queue_rejects_upload(server, client, primary, large_image, monkeypatch):
+    monkeypatch.setattr(server.COMPRESSION_JOBS, 'queue_size', 0)
+    response = client.post('/upload', data={'file': (io.BytesIO(large_image), 'photo.bmp')},
+                           headers=primary, content_type='multipart/form-data')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '5'
+    usage = server.STORAGE.usage()
+    assert usage['files'] == 0
+    assert usage['blobs'] == 0
+
+
+def test_full_queue_keeps_chunked_upload_for_retry(server, client, primary, large_image, monkeypatch):
+    response = client.post('/uploads', json={'filename': 'photo.bmp', 'size': len(large_image), 'chunk_size': CHUNK},
+                           headers=primary)
+    upload_id = response.get_json()['upload_id']
+    for number, start in enumerate(range(0, len(large_image), CHUNK), 1):
+        client.put(f'/uploads/{upload_id}/chunks/{number}', data=large_image[start:start + CHUNK], headers=primary)
+
+    monkeypatch.setattr(server.COMPRESSION_JOBS, 'queue_size', 0)
+    response = client.post(f'/uploads/{upload_id}/complete', headers=primary)
+    assert response.status_code == 429
+    status = client.get(f'/uploads/{upload_id}', headers=primary).get_json()
+    assert status['missing_chunks'] == 0
+
+    monkeypatch.setattr(server.COMPRESSION_JOBS, 'queue_size', server.COMPRESS_QUEUE_SIZE)
+    response = client.post(f'/uploads/{upload_id}/complete', headers=primary)
+    assert response.status_code == 200
+    assert wait_for_job(client, response.get_json()['compression']['job_id'])['status'] == 'done'
+    assert server.STORAGE.usage()['chunk_bytes'] == 0
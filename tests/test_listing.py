@@ -0,0 +1,26 @@
+"""Listing /files: portée par clé et pagination par curseur"""
+
+
+def test_files_are_scoped_to_their_owner(client, primary, secondary, upload):
+    upload(b'primary file', 'p.txt')
+    upload(b'secondary file', 's.txt', headers=secondary)
+
+    def names(headers):
+        return sorted(f['filename'] for f in client.get('/files', headers=headers).get_json()['files'])
+    assert names(primary) == ['p.txt', 's.txt']
+    assert names(secondary) == ['s.txt']
+
+
+def test_files_pagination(client, primary, upload):
+    for i in range(5):
+        upload(f'file {i}'.encode(), f'f{i}.txt')
+    seen, cursor = [], None
+    while True:
+        query = '/files?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(query, headers=primary).get_json()
+        seen += [f['filename'] for f in page['files']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert seen == [f'f{i}.txt' for i in reversed(range(5))]
+    assert client.get('/files?cursor=garbage', headers=primary).status_code == 400
@@ -0,0 +1,31 @@
+"""Conversion PDF: fusion d'images et rejet des images illisibles"""
+import io
+
+from PIL import Image
+
+
+def image_bytes(fmt, size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 40).convert('RGB').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_images_to_pdf(client, primary):
+    files = [(io.BytesIO(image_bytes('PNG')), 'a.png'), (io.BytesIO(image_bytes('JPEG')), 'b.jpg')]
+    response = client.post('/convert/images-to-pdf', data={'files': files}, headers=primary,
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['pages'] == 2
+    assert client.get(f"/download/{response.get_json()['file_id']}").data.startswith(b'%PDF-')
+
+
+def test_images_to_pdf_rejects_unreadable_images(client, primary):
+    good = image_bytes('JPEG', (800, 600))
+    for name, content in (('empty.jpg', b''), ('text.jpg', b'hello'), ('truncated.jpg', good[:len(good) // 3])):
+        files = [(io.BytesIO(good), 'ok.jpg'), (io.BytesIO(content), name)]
+        response = client.post('/convert/images-to-pdf', data={'files': files}, headers=primary,
+                               content_type='multipart/form-data')
+        body = response.get_json()
+        assert response.status_code == 400, body
+        assert name in str(body)
@@ -0,0 +1,20 @@
+"""Détection du contenu à la réception: signature plutôt qu'extension déclarée"""
+import io
+
+from PIL import Image
+
+
+def image_bytes(fmt, size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 40).convert('RGB').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_sniffing_overrides_declared_extension(server, upload):
+    info = upload(image_bytes('PNG'), 'picture.txt')
+    assert info['detected']['extension'] == 'png'
+    assert info['is_image'] is True
+    assert server.TEMP_STORAGE[info['file_id']]['content_type'] == 'image/png'
+
+    info = upload(b'BM not really a bitmap ' * 100, 'fake.bmp')
+    assert info['is_image'] is False
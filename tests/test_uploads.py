@@ -0,0 +1,184 @@
+"""Uploads fractionnés (/uploads): ordre des morceaux, sommes SHA-256, finalisation, réservations"""
+import hashlib
+import os
+
+import pytest
+
+CHUNK = 256 * 1024
+
+
+@pytest.fixture
+def session(client, primary):
+    """open_session(contenu) -> (upload_id, morceaux)"""
+    def _open(content, filename='video.bin'):
+        response = client.post('/uploads', json={'filename': filename, 'size': len(content), 'chunk_size': CHUNK},
+                               headers=primary)
+        assert response.status_code == 201, response.get_json()
+        chunks = [content[i:i + CHUNK] for i in range(0, len(content), CHUNK)]
+        return response.get_json()['upload_id'], chunks
+    return _open
+
+
+def put_chunk(client, headers, upload_id, number, data, sha256=None):
+    if sha256:
+        headers = dict(headers, **{'X-Chunk-SHA256': sha256})
+    return client.put(f'/uploads/{upload_id}/chunks/{number}', data=data, headers=headers)
+
+
+def test_out_of_order_chunks_assemble_in_order(client, primary, session):
+    content = os.urandom(3 * CHUNK + 1000)
+    upload_id, chunks = session(content)
+    for number in (4, 2, 1, 3):
+        assert put_chunk(client, primary, upload_id, number, chunks[number - 1]).status_code == 200
+
+    status = client.get(f'/uploads/{upload_id}', headers=primary).get_json()
+    assert status['received_chunks'] == [1, 2, 3, 4]
+    assert status['missing_chunks'] == 0
+
+    response = client.post(f'/uploads/{upload_id}/complete', json={'sha256': hashlib.sha256(content).hexdigest()},
+                           headers=primary)
+    assert response.status_code == 200, response.get_json()
+    assert client.get(f"/download/{response.get_json()['file_id']}").data == content
+
+
+def test_resent_chunk_replaces_previous(server, client, primary, session):
+    content = os.urandom(2 * CHUNK)
+    upload_id, chunks = session(content)
+    put_chunk(client, primary, upload_id, 1, os.urandom(CHUNK))
+    put_chunk(client, primary, upload_id, 1, chunks[0])
+    put_chunk(client, primary, upload_id, 2, chunks[1])
+    assert server.STORAGE.usage()['chunk_bytes'] == 2 * CHUNK
+
+    file_id = client.post(f'/uploads/{upload_id}/complete', headers=primary).get_json()['file_id']
+    assert client.get(f'/download/{file_id}').data == content
+    assert server.STORAGE.usage()['chunk_bytes'] == 0
+
+
+def test_chunk_checksum_mismatch_is_rejected(client, primary, session):
+    content = os.urandom(2 * CHUNK)
+    upload_id, chunks = session(content)
+    response = put_chunk(client, primary, upload_id, 1, chunks[0], sha256=hashlib.sha256(b'other').hexdigest())
+    assert response.status_code >= 400
+
+    status = client.get(f'/uploads/{upload_id}', headers=primary).get_json()
+    assert status['received_chunks'] == []
+    good = put_chunk(client, primary, upload_id, 1, chunks[0], sha256=hashlib.sha256(chunks[0]).hexdigest())
+    assert good.status_code == 200
+
+
+def test_wrong_chunk_size_and_number(client, primary, session):
+    upload_id, chunks = session(os.urandom(2 * CHUNK))
+    assert put_chunk(client, primary, upload_id, 1, chunks[0][:-1]).status_code == 400
+    assert put_chunk(client, primary, upload_id, 3, chunks[0]).status_code == 400
+
+
+def test_complete_with_missing_chunks_keeps_session(client, primary, session):
+    upload_id, chunks = session(os.urandom(3 * CHUNK))
+    put_chunk(client, primary, upload_id, 2, chunks[1])
+
+    response = client.post(f'/uploads/{upload_id}/complete', headers=primary)
+    assert response.status_code == 409
+    assert response.get_json()['missing_chunks'] == [1, 3]
+    assert client.get(f'/uploads/{upload_id}', headers=primary).status_code == 200
+
+
+def test_file_checksum_mismatch_keeps_session(server, client, primary, session):
+    content = os.urandom(2 * CHUNK)
+    upload_id, chunks = session(content)
+    for number, data in enumerate(chunks, 1):
+        put_chunk(client, primary, upload_id, number, data)
+
+    response = client.post(f'/uploads/{upload_id}/complete', json={'sha256': '0' * 64}, headers=primary)
+    assert response.status_code == 422
+    assert response.get_json()['sha256'] == hashlib.sha256(content).hexdigest()
+    assert server.STORAGE.usage()['files'] == 0
+    assert client.post(f'/uploads/{upload_id}/complete', headers=primary).status_code == 200
+
+
+def test_double_complete_is_rejected(server, client, primary, session):
+    content = os.urandom(CHUNK + 10)
+    upload_id, chunks = session(content)
+    for number, data in enumerate(chunks, 1):
+        put_chunk(client, primary, upload_id, number, data)
+
+    assert client.post(f'/uploads/{upload_id}/complete', headers=primary).status_code == 200
+    assert client.post(f'/uploads/{upload_id}/complete', headers=primary).status_code == 404
+    assert server.STORAGE.usage()['files'] == 1
+
+
+def test_abort_frees_chunks(server, client, primary, session):
+    upload_id, chunks = session(os.urandom(2 * CHUNK))
+    put_chunk(client, primary, upload_id, 1, chunks[0])
+
+    assert client.delete(f'/uploads/{upload_id}', headers=primary).status_code == 200
+    assert client.get(f'/uploads/{upload_id}', headers=primary).status_code == 404
+    usage = server.STORAGE.usage()
+    assert usage['chunk_bytes'] == 0
+    assert usage['blobs'] == 0
+
+
+def test_open_sessions_reserve_the_quota(server, client, secondary, monkeypatch):
+    monkeypatch.setitem(server.STORAGE_BUDGET.quotas, 'secondary', 1024 * 1024)
+
+    def open_session(size):
+        return client.post('/uploads', json={'filename': 'part.bin', 'size': size, 'chunk_size': CHUNK},
+                           headers=secondary)
+
+    first = open_session(600 * 1024)
+    assert first.status_code == 201
+    assert server.STORAGE_BUDGET.used_by('secondary') == 600 * 1024
+    assert open_session(600 * 1024).status_code == 507
+
+    upload_id = first.get_json()['upload_id']
+    assert client.delete(f'/uploads/{upload_id}', headers=secondary).status_code == 200
+    assert server.STORAGE_BUDGET.used_by('secondary') == 0
+    assert server.STORAGE.usage()['reserved_bytes'] == 0
+    assert open_session(600 * 1024).status_code == 201
+
+
+def test_completed_session_is_charged_once(server, client, secondary):
+    content = os.urandom(CHUNK + 10)
+    response = client.post('/uploads', json={'filename': 'a.bin', 'size': len(content), 'chunk_size': CHUNK},
+                           headers=secondary)
+    upload_id = response.get_json()['upload_id']
+    put_chunk(client, secondary, upload_id, 1, content[:CHUNK])
+    put_chunk(client, secondary, upload_id, 2, content[CHUNK:])
+
+    assert client.post(f'/uploads/{upload_id}/complete', headers=secondary).status_code == 200
+    assert server.STORAGE_BUDGET.used_by('secondary') == len(content)
+    assert server.STORAGE.usage()['reserved_bytes'] == 0
+
+
+def test_open_sessions_reserve_the_budget(server, client, primary, secondary, monkeypatch):
+    monkeypatch.setattr(server.STORAGE_BUDGET, 'budget_bytes', 1024 * 1024)
+    response = client.post('/uploads', json={'filename': 'a.bin', 'size': 800 * 1024}, headers=primary)
+    assert response.status_code == 201
+    response = client.post('/uploads', json={'filename': 'b.bin', 'size': 300 * 1024}, headers=secondary)
+    assert response.status_code == 507
+
+
+def test_sessions_are_private_to_their_key(client, primary, secondary, session):
+    upload_id, chunks = session(os.urandom(CHUNK))
+
+    assert client.get(f'/uploads/{upload_id}', headers=secondary).status_code == 404
+    assert put_chunk(client, secondary, upload_id, 1, chunks[0]).status_code == 404
+    assert client.post(f'/uploads/{upload_id}/complete', headers=secondary).status_code == 404
+    assert client.delete(f'/uploads/{upload_id}', headers=secondary).status_code == 404
+
+    assert client.get(f'/uploads/{upload_id}', headers=primary).get_json()['received_chunks'] == []
+    assert put_chunk(client, primary, upload_id, 1, chunks[0]).status_code == 200
+    assert client.post(f'/uploads/{upload_id}/complete', headers=primary).status_code == 200
+
+
+def test_pending_chunks_do_not_evict_files(server, client, primary, upload, monkeypatch):
+    monkeypatch.setattr(server.STORAGE_BUDGET, 'budget_bytes', 1024 * 1024)
+    kept = upload(os.urandom(400000), 'kept.bin')
+    session = client.post('/uploads', json={'filename': 'big.bin', 'size': 3 * CHUNK, 'chunk_size': CHUNK},
+                          headers=primary).get_json()
+    for number in range(1, 4):
+        client.put(f"/uploads/{session['upload_id']}/chunks/{number}", data=os.urandom(CHUNK), headers=primary)
+
+    upload(os.urandom(100000), 'small.bin')
+
+    assert client.get(f"/download/{kept['file_id']}").status_code == 200
+    assert server.STORAGE.usage()['chunk_bytes'] == 3 * CHUNK